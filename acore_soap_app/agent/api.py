@@ -13,6 +13,13 @@ Example:
     >>> from acore_soap_app.agent.api import DEFAULT_PORT
     >>> from acore_soap_app.agent.api import SOAPRequest
     >>> from acore_soap_app.agent.api import SOAPResponse
+    >>> from acore_soap_app.agent.api import SOAPTransport
+    >>> from acore_soap_app.agent.api import get_default_transport
+    >>> from acore_soap_app.agent.api import set_default_transport
+    >>> from acore_soap_app.agent.api import AsyncSOAPClient
+    >>> from acore_soap_app.agent.api import BatchExecutor
+    >>> from acore_soap_app.agent.api import RateLimiter
+    >>> from acore_soap_app.agent.api import AIMDController
 """
 
 from .impl import DEFAULT_USERNAME
@@ -21,3 +28,10 @@ from .impl import DEFAULT_HOST
 from .impl import DEFAULT_PORT
 from .impl import SOAPRequest
 from .impl import SOAPResponse
+from .transport import SOAPTransport
+from .transport import get_default_transport
+from .transport import set_default_transport
+from .async_client import AsyncSOAPClient
+from .batch import BatchExecutor
+from .ratelimit import RateLimiter
+from .concurrency import AIMDController
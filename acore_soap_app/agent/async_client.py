@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""
+Asyncio SOAP client for batch execution.
+
+:class:`AsyncSOAPClient` 可以在 asyncio 程序中并发地发送大量 :class:`~acore_soap_app.agent.impl.SOAPRequest`,
+并通过 ``concurrency`` 参数限制同时在途 (in-flight) 的请求数量, 以免压垮 worldserver 的
+SOAP 线程. 返回的结果顺序和输入顺序一致, 且都是普通的
+:class:`~acore_soap_app.agent.impl.SOAPResponse` 对象.
+
+底层的 HTTP 请求仍然由 :class:`~acore_soap_app.agent.transport.SOAPTransport` 在一个
+大小为 ``concurrency`` 的线程池中完成, 因此它和同步的 :meth:`~acore_soap_app.agent.impl.SOAPRequest.send`
+共享同一套连接池和超时配置. 如果 transport 配置了
+:class:`~acore_soap_app.agent.ratelimit.RateLimiter`, 限流的等待会在 event loop 中以
+``asyncio.sleep`` 的方式完成, 不会占用线程池中的线程.
+"""
+
+import typing as T
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from ..timing import Phase, timer
+from .impl import DEFAULT_HOST, DEFAULT_PORT, SOAPRequest, SOAPResponse
+from .transport import SOAPTransport
+
+DEFAULT_CONCURRENCY = 10
+
+
+class AsyncSOAPClient:
+    """
+    Send many :class:`~acore_soap_app.agent.impl.SOAPRequest` concurrently
+    from asyncio code.
+
+    Usage example:
+
+    .. code-block:: python
+
+        >>> async def main():
+        ...     async with AsyncSOAPClient(concurrency=20) as client:
+        ...         requests = SOAPRequest.batch_load([".server info", ".gm list"])
+        ...         responses = await client.send_many(requests, timeout=5)
+        >>> asyncio.run(main())
+
+    :param transport: the transport to use, if None, create a dedicated one
+        whose pool size equals ``concurrency``.
+    :param concurrency: max number of in-flight requests.
+    :param timeout: default per-request timeout in seconds, None means no limit.
+    :param keep_body: if False, drop the raw XML body of the responses.
+    """
+
+    def __init__(
+        self,
+        transport: T.Optional[SOAPTransport] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        timeout: T.Optional[float] = None,
+        keep_body: bool = True,
+    ):
+        if concurrency < 1:
+            raise ValueError("concurrency must be greater than 0")
+        self._own_transport = transport is None
+        if transport is None:
+            transport = SOAPTransport(pool_maxsize=concurrency)
+        self.transport = transport
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.keep_body = keep_body
+        self._executor: T.Optional[ThreadPoolExecutor] = None
+        self._semaphore: T.Optional[asyncio.Semaphore] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.concurrency,
+                thread_name_prefix="acsoap",
+            )
+        return self._executor
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # create it lazily so that it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def _send(
+        self,
+        request: SOAPRequest,
+        timeout: T.Optional[float],
+    ) -> SOAPResponse:
+        rate_limiter = self.transport.rate_limiter
+        if rate_limiter is not None:
+            with timer(Phase.THROTTLE):
+                await rate_limiter.acquire_async(
+                    request.host or DEFAULT_HOST,
+                    request.port or DEFAULT_PORT,
+                    request.command,
+                )
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self._get_executor(),
+            functools.partial(
+                request.send,
+                transport=self.transport,
+                timeout=timeout,
+                keep_body=self.keep_body,
+                throttle=False,
+            ),
+        )
+        if timeout is None:
+            return await future
+        return await asyncio.wait_for(future, timeout)
+
+    async def send(
+        self,
+        request: SOAPRequest,
+        timeout: T.Optional[float] = None,
+    ) -> SOAPResponse:
+        """
+        Send a single request.
+
+        :param timeout: per-request timeout in seconds, if None, use the client
+            default. Raises :class:`asyncio.TimeoutError` when exceeded.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        async with self._get_semaphore():
+            return await self._send(request, timeout)
+
+    async def send_many(
+        self,
+        requests: T.Iterable[SOAPRequest],
+        timeout: T.Optional[float] = None,
+        return_exceptions: bool = False,
+    ) -> T.List[T.Union[SOAPResponse, BaseException]]:
+        """
+        Send many requests with at most ``concurrency`` of them in flight,
+        return the responses in input order.
+
+        :param timeout: per-request timeout in seconds, if None, use the client
+            default.
+        :param return_exceptions: if True, a failed request puts its exception
+            in the result list instead of aborting the whole batch.
+        """
+        requests = list(requests)
+        results: T.List[T.Any] = [None] * len(requests)
+        iterator = iter(enumerate(requests))
+
+        async def worker():
+            for ith, request in iterator:
+                try:
+                    results[ith] = await self.send(request, timeout=timeout)
+                except Exception as e:
+                    if return_exceptions:
+                        results[ith] = e
+                    else:
+                        raise
+
+        n_worker = min(self.concurrency, len(requests))
+        tasks = [asyncio.ensure_future(worker()) for _ in range(n_worker)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return results
+
+    async def close(self):
+        """
+        Shut down the worker threads, and the transport if it is owned by
+        this client.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._own_transport:
+            self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+"""
+Batch executor for running many SOAP requests on the game server.
+
+:class:`BatchExecutor` 是 ``acsoap gm`` 批量执行 GM 命令的底层实现. 当 ``workers`` 大于 1
+时, 它会用线程池并发地发送请求, 但仍然按照输入的顺序返回结果. 同一时间在途 (in-flight) 的请求
+数量最多为 ``workers`` 的两倍, 所以即使输入是一个很大的 generator, 内存占用也是有界的.
+
+当 ``raises=True`` 时, 一旦发现有请求失败, 就不再提交新的请求, 并在按顺序遇到第一个失败的
+请求时抛出 :class:`~acore_soap_app.exc.SOAPCommandFailedError`. 没有被发送的请求数量会
+记录在 :attr:`BatchExecutor.n_skipped` 中. 剩下的输入不会被读取 (它可能是一个很大的 S3
+文件), 所以只有输入有长度 (例如 list) 时才知道跳过了多少个, 否则为 None.
+
+如果指定了 ``adaptive`` (:class:`~acore_soap_app.agent.concurrency.AIMDController`),
+同时在途的请求数量会根据测量到的延迟和失败率在 ``floor`` 和 ``ceiling`` 之间自动调整.
+"""
+
+import typing as T
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from ..exc import SOAPCommandFailedError
+from .impl import SOAPRequest, SOAPResponse
+from .concurrency import AIMDController
+from .transport import (
+    SOAPTransport,
+    Timeout,
+    get_default_transport,
+)
+
+
+class BatchExecutor:
+    """
+    Send a batch of :class:`~acore_soap_app.agent.impl.SOAPRequest`, serially
+    or on a thread pool.
+
+    Usage example:
+
+    .. code-block:: python
+
+        >>> executor = BatchExecutor(workers=8, raises=True)
+        >>> for request, response in executor.run(requests):
+        ...     print(response.to_json())
+        >>> executor.n_sent, executor.n_skipped
+
+    :param workers: number of worker threads, 1 means run serially in the
+        current thread.
+    :param raises: if True, stop submitting new requests on the first failure
+        and raise :class:`~acore_soap_app.exc.SOAPCommandFailedError`.
+    :param transport: the transport to use, if None, use the default one. If
+        ``workers`` is larger than its pool size, a larger copy of it with the
+        same rate limiter and circuit breaker is used, and closed at the end of
+        each :meth:`run`.
+    :param timeout: per-request timeout, see :meth:`~acore_soap_app.agent.impl.SOAPRequest.send`.
+    :param keep_body: if False, drop the raw XML body of the responses.
+    :param adaptive: if given, the number of in-flight requests is tuned by
+        this :class:`~acore_soap_app.agent.concurrency.AIMDController`, and
+        ``workers`` is replaced by its ``ceiling``.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        raises: bool = True,
+        transport: T.Optional[SOAPTransport] = None,
+        timeout: Timeout = None,
+        keep_body: bool = True,
+        adaptive: T.Optional[AIMDController] = None,
+    ):
+        if adaptive is not None:
+            workers = adaptive.ceiling
+        if workers < 1:
+            raise ValueError("workers must be greater than 0")
+        self._own_transport: T.Optional[SOAPTransport] = None
+        if transport is None:
+            transport = get_default_transport()
+            if workers > transport.pool_maxsize:
+                transport = transport.with_pool_maxsize(workers)
+                self._own_transport = transport
+        self.workers = workers
+        self.raises = raises
+        self.transport = transport
+        self.timeout = timeout
+        self.keep_body = keep_body
+        self.adaptive = adaptive
+        self.n_sent = 0
+        self.n_skipped: T.Optional[int] = 0
+        self._total: T.Optional[int] = None
+        self._stop = threading.Event()
+
+    def _send(self, request: SOAPRequest) -> SOAPResponse:
+        start = time.perf_counter()
+        try:
+            response = request.send(
+                transport=self.transport,
+                timeout=self.timeout,
+                keep_body=self.keep_body,
+            )
+        except Exception:
+            self._stop.set()
+            if self.adaptive is not None:
+                self.adaptive.record(time.perf_counter() - start, faulted=True)
+            raise
+        finally:
+            # the slot is acquired before submission, see _run_threaded
+            if self.adaptive is not None:
+                self.adaptive.release()
+        if self.adaptive is not None:
+            self.adaptive.record(
+                time.perf_counter() - start,
+                faulted=response.succeeded is False,
+            )
+        if self.raises and (response.succeeded is False):
+            self._stop.set()
+        return response
+
+    def _fail(self, request: SOAPRequest, response: SOAPResponse):
+        raise SOAPCommandFailedError(
+            f"request failed: {request.command!r}, "
+            f"response: {response.message!r}, "
+            f"{self.format_skipped()}"
+        )
+
+    def format_skipped(self) -> str:
+        """
+        Describe how many requests are skipped, for the error message and logs.
+        """
+        if self.n_skipped is None:
+            return "the rest of the requests are skipped"
+        return f"{self.n_skipped} requests skipped"
+
+    def _skip_rest(self):
+        # don't read the rest of the input, it might be a large S3 stream
+        if self._total is None:
+            self.n_skipped = None
+        else:
+            self.n_skipped = self._total - self.n_sent
+
+    def _run_serial(
+        self,
+        iterator: T.Iterator[SOAPRequest],
+    ) -> T.Iterator[T.Tuple[SOAPRequest, SOAPResponse]]:
+        for request in iterator:
+            self.n_sent += 1
+            try:
+                response = self._send(request)
+            except Exception:
+                self._skip_rest()
+                raise
+            if self._stop.is_set():
+                self._skip_rest()
+                self._fail(request, response)
+            yield request, response
+
+    def _run_threaded(
+        self,
+        iterator: T.Iterator[SOAPRequest],
+    ) -> T.Iterator[T.Tuple[SOAPRequest, SOAPResponse]]:
+        window = self.workers * 2
+        adaptive = self.adaptive
+        pending: T.Deque[T.Tuple[SOAPRequest, Future]] = collections.deque()
+        with ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="acsoap",
+        ) as pool:
+
+            def fill():
+                while len(pending) < window and not self._stop.is_set():
+                    if adaptive is not None:
+                        # block until the AIMD controller allows one more
+                        # in-flight request
+                        adaptive.acquire()
+                        if self._stop.is_set():
+                            adaptive.release()
+                            return
+                    try:
+                        request = next(iterator)
+                    except StopIteration:
+                        if adaptive is not None:
+                            adaptive.release()
+                        return
+                    pending.append((request, pool.submit(self._send, request)))
+                    self.n_sent += 1
+
+            def abort():
+                # requests that were queued but not started yet are also skipped
+                for _, future in pending:
+                    if future.cancel():
+                        self.n_sent -= 1
+                        if adaptive is not None:
+                            adaptive.release()
+                self._skip_rest()
+
+            fill()
+            while pending:
+                request, future = pending.popleft()
+                try:
+                    response = future.result()
+                except Exception:
+                    abort()
+                    raise
+                if self.raises and (response.succeeded is False):
+                    abort()
+                    self._fail(request, response)
+                yield request, response
+                fill()
+
+    def run(
+        self,
+        requests: T.Iterable[SOAPRequest],
+    ) -> T.Iterator[T.Tuple[SOAPRequest, SOAPResponse]]:
+        """
+        Send all requests and yield ``(request, response)`` pairs in input order.
+        """
+        self.n_sent = 0
+        self.n_skipped = 0
+        self._total = len(requests) if isinstance(requests, T.Sized) else None
+        self._stop.clear()
+        iterator = iter(requests)
+        if self.workers == 1 and self.adaptive is None:
+            results = self._run_serial(iterator)
+        else:
+            results = self._run_threaded(iterator)
+        if self._own_transport is None:
+            return results
+        return self._close_after(results)
+
+    def _close_after(
+        self,
+        results: T.Iterator[T.Tuple[SOAPRequest, SOAPResponse]],
+    ) -> T.Iterator[T.Tuple[SOAPRequest, SOAPResponse]]:
+        # close the pool the executor created, it is re-created on the next run
+        try:
+            yield from results
+        finally:
+            self._own_transport.close()
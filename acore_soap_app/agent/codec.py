@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+Generated serializers for the :class:`~acore_soap_app.agent.impl.Base` dataclasses.
+
+``dataclasses.asdict`` 会递归地 deep copy 每一个字段, 而我们的 dataclass 基本上都是扁平的
+str, int, bool 字段. 所以这里为每个 dataclass 生成专门的 ``to_dict``, ``to_json`` 和
+``from_dict`` 函数 (每个类只生成一次, 然后缓存起来), 它们直接访问字段并跳过 None 值,
+``to_json`` 更是直接拼接 JSON 字符串, 不需要先构建中间的 dict.
+
+生成的函数和原来的实现输出完全一致:
+
+- ``to_dict(obj) == {k: v for k, v in dataclasses.asdict(obj).items() if v is not None}``
+- ``to_json(obj) == json.dumps(to_dict(obj))``
+- ``from_dict(cls, dct)`` 等价于 ``cls(**dct)``, 但是没有默认值的 ``T.Optional`` 类型字段可以省略.
+"""
+
+import typing as T
+import copy
+import json
+import threading
+import dataclasses
+from json.encoder import encode_basestring_ascii
+
+_FLAT_TYPES = (str, int, float, bool)
+
+
+def _is_flat(tp) -> bool:
+    """
+    Check if the type annotation is a flat scalar type, or Optional of it.
+    """
+    if tp in _FLAT_TYPES:
+        return True
+    if T.get_origin(tp) is T.Union:
+        return all(arg is type(None) or arg in _FLAT_TYPES for arg in T.get_args(tp))
+    return False
+
+
+def _is_optional(tp) -> bool:
+    return T.get_origin(tp) is T.Union and type(None) in T.get_args(tp)
+
+
+def _to_plain(value):
+    """
+    The slow path for nested values, same as ``dataclasses.asdict``.
+    """
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_plain(v) for v in value)
+    if isinstance(value, dict):
+        return type(value)((_to_plain(k), _to_plain(v)) for k, v in value.items())
+    return copy.deepcopy(value)
+
+
+def _encode(value) -> str:
+    """
+    Encode a non-str value to JSON, same as ``json.dumps``.
+    """
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if value.__class__ is int:
+        return int.__repr__(value)
+    return json.dumps(_to_plain(value))
+
+
+@dataclasses.dataclass(frozen=True)
+class Codec:
+    """
+    The generated serializers of a dataclass.
+    """
+
+    to_dict: T.Callable[[T.Any], dict]
+    to_json: T.Callable[[T.Any], str]
+    from_dict: T.Callable[[T.Type, dict], T.Any]
+    source: str
+
+
+def _generate(cls) -> Codec:
+    try:
+        hints = T.get_type_hints(cls)
+    except Exception:  # pragma: no cover
+        hints = dict()
+    fields = dataclasses.fields(cls)
+    namespace = {
+        "_to_plain": _to_plain,
+        "_encode": _encode,
+        "_encode_str": encode_basestring_ascii,
+    }
+
+    to_dict_lines = ["def to_dict(self):", "    d = {}"]
+    to_json_lines = ["def to_json(self):", "    parts = []"]
+    for field in fields:
+        name = field.name
+        tp = hints.get(name, field.type)
+        prefix = json.dumps(name) + ": "
+        to_dict_lines.append(f"    v = self.{name}")
+        to_dict_lines.append(f"    if v is not None:")
+        to_json_lines.append(f"    v = self.{name}")
+        to_json_lines.append(f"    if v is not None:")
+        if _is_flat(tp):
+            to_dict_lines.append(f"        d[{name!r}] = v")
+        else:
+            to_dict_lines.append(f"        d[{name!r}] = _to_plain(v)")
+        to_json_lines.append(
+            f"        parts.append({prefix!r} + "
+            f"(_encode_str(v) if v.__class__ is str else _encode(v)))"
+        )
+    to_dict_lines.append("    return d")
+    to_json_lines.append('    return "{" + ", ".join(parts) + "}"')
+
+    # ``cls(**dct)`` is already the fastest way to construct the object, we
+    # only need to fill the Optional fields that don't have a default value
+    from_dict_lines = ["def from_dict(cls, dct):"]
+    for field in fields:
+        if (
+            field.init
+            and field.default is dataclasses.MISSING
+            and field.default_factory is dataclasses.MISSING
+            and _is_optional(hints.get(field.name, field.type))
+        ):
+            from_dict_lines.append(f"    if {field.name!r} not in dct:")
+            from_dict_lines.append(f"        dct = {{{field.name!r}: None, **dct}}")
+    from_dict_lines.append("    return cls(**dct)")
+
+    source = "\n".join(to_dict_lines + [""] + to_json_lines + [""] + from_dict_lines)
+    exec(compile(source, f"<codec {cls.__qualname__}>", "exec"), namespace)
+    return Codec(
+        to_dict=namespace["to_dict"],
+        to_json=namespace["to_json"],
+        from_dict=namespace["from_dict"],
+        source=source,
+    )
+
+
+_codecs: T.Dict[type, Codec] = dict()
+_lock = threading.Lock()
+
+
+def get_codec(cls) -> Codec:
+    """
+    Get the generated :class:`Codec` for a dataclass, generate it on first use.
+    """
+    try:
+        return _codecs[cls]
+    except KeyError:
+        with _lock:
+            if cls not in _codecs:
+                _codecs[cls] = _generate(cls)
+            return _codecs[cls]
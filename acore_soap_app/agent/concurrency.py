@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""
+Adaptive concurrency control (AIMD) for batch sends.
+
+固定的 ``workers`` 数量要么在夜间太慢, 要么在高峰期太激进. :class:`AIMDController` 根据
+实际测量到的 ``send`` 延迟和失败率自动调整同时在途 (in-flight) 的请求数量:
+
+- 每收集到 ``window`` 个样本就做一次决策.
+- 如果平均延迟超过了 ``target_latency``, 或者失败率超过了 ``max_fault_rate``, 就把并发数
+  乘以 ``decrease`` (multiplicative decrease), 但不低于 ``floor``.
+- 否则把并发数加上 ``increase`` (additive increase), 但不超过 ``ceiling``.
+
+失败包括抛出的异常 (超时, 连接错误等) 和 ``succeeded=False`` 的 SOAP 响应. 每次调整都会通过
+``logging`` 记录 (logger 名为 ``acore_soap_app.agent.concurrency``). :attr:`AIMDController.history`
+只保留最近的 ``history_size`` 次决策, 整个批量任务的汇总请使用 :meth:`AIMDController.stats`.
+
+Usage example:
+
+.. code-block:: python
+
+    >>> controller = AIMDController(floor=1, ceiling=32, target_latency=0.2)
+    >>> executor = BatchExecutor(adaptive=controller)
+    >>> for request, response in executor.run(requests):
+    ...     ...
+    >>> controller.limit, controller.stats()
+"""
+
+import typing as T
+import math
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TARGET_LATENCY = 0.5
+DEFAULT_MAX_FAULT_RATE = 0.1
+DEFAULT_WINDOW = 10
+DEFAULT_HISTORY_SIZE = 100
+
+
+class AIMDController:
+    """
+    Thread-safe AIMD concurrency limit, it is also a gate that blocks the
+    caller of :meth:`acquire` while ``limit`` requests are in flight.
+
+    :param floor: the min concurrency.
+    :param ceiling: the max concurrency.
+    :param initial: the initial concurrency, default to ``floor``.
+    :param target_latency: the max acceptable mean latency in seconds.
+    :param max_fault_rate: the max acceptable ratio of failed requests.
+    :param increase: how much to add to the limit when healthy.
+    :param decrease: the factor to multiply the limit when overloaded.
+    :param window: number of samples for each decision.
+    :param history_size: number of the most recent decisions kept in :attr:`history`.
+    """
+
+    def __init__(
+        self,
+        floor: int = 1,
+        ceiling: int = 16,
+        initial: T.Optional[int] = None,
+        target_latency: float = DEFAULT_TARGET_LATENCY,
+        max_fault_rate: float = DEFAULT_MAX_FAULT_RATE,
+        increase: int = 1,
+        decrease: float = 0.5,
+        window: int = DEFAULT_WINDOW,
+        history_size: int = DEFAULT_HISTORY_SIZE,
+    ):
+        if floor < 1:
+            raise ValueError("floor must be greater than 0")
+        if ceiling < floor:
+            raise ValueError("ceiling must not be less than floor")
+        if not (0 < decrease < 1):
+            raise ValueError("decrease must be between 0 and 1")
+        if initial is None:
+            initial = floor
+        self.floor = floor
+        self.ceiling = ceiling
+        self.limit = min(max(initial, floor), ceiling)
+        self.target_latency = target_latency
+        self.max_fault_rate = max_fault_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        #: the recent ``(old_limit, new_limit, mean_latency, fault_rate)`` decisions
+        self.history: T.Deque[T.Tuple[int, int, float, float]] = collections.deque(
+            maxlen=history_size
+        )
+        self.n_increases = 0
+        self.n_decreases = 0
+        self.min_limit = self.limit
+        self.max_limit = self.limit
+        self.in_flight = 0
+        self._latencies: T.List[float] = list()
+        self._n_faults = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Block until the number of in-flight requests is below the limit.
+        """
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def record(self, latency: float, faulted: bool = False):
+        """
+        Record the latency and the outcome of a request, and adjust the limit
+        when a window is full.
+        """
+        with self._cond:
+            self._latencies.append(latency)
+            if faulted:
+                self._n_faults += 1
+            if len(self._latencies) >= self.window:
+                self._decide()
+
+    def _decide(self):
+        n = len(self._latencies)
+        mean_latency = sum(self._latencies) / n
+        fault_rate = self._n_faults / n
+        self._latencies.clear()
+        self._n_faults = 0
+
+        old_limit = self.limit
+        if mean_latency > self.target_latency or fault_rate > self.max_fault_rate:
+            new_limit = max(self.floor, math.floor(old_limit * self.decrease))
+            action = "decrease"
+            self.n_decreases += 1
+        else:
+            new_limit = min(self.ceiling, old_limit + self.increase)
+            action = "increase"
+            self.n_increases += 1
+        self.limit = new_limit
+        self.min_limit = min(self.min_limit, new_limit)
+        self.max_limit = max(self.max_limit, new_limit)
+        self.history.append((old_limit, new_limit, mean_latency, fault_rate))
+        logger.info(
+            "%s concurrency %d -> %d (mean latency %.3fs, target %.3fs, fault rate %.1f%%)",
+            action,
+            old_limit,
+            new_limit,
+            mean_latency,
+            self.target_latency,
+            fault_rate * 100,
+        )
+        if new_limit > old_limit:
+            self._cond.notify_all()
+
+    def stats(self) -> T.Dict[str, int]:
+        """
+        Return the summary of the decisions, its size doesn't grow with the batch.
+        """
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "increases": self.n_increases,
+                "decreases": self.n_decreases,
+            }
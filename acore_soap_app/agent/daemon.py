@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+"""
+Resident agent daemon over a local Unix socket.
+
+在非 S3 模式下, ``run_soap_command`` 中的每一个 GM 命令都是一行独立的 ``acsoap gm "..."``,
+每一行都要启动一个新的 Python 解释器, import boto3, fire 等依赖, 然后才发送一个 HTTP 请求.
+``acsoap serve`` 启动一个常驻进程, 它持有预热好的连接池和 AWS client, 通过本地的 Unix socket
+接收请求. ``acsoap gm`` 在 daemon 存在时只是一个很薄的客户端, 否则回退到在当前进程内执行.
+
+协议是 JSON Lines, 一个连接上可以依次发送多个请求:
+
+- 客户端发送一行: ``{"op": "gm", "args": {...}}``
+- 服务端返回若干行 ``{"out": "..."}`` (对应 stdout 的一行) 和 ``{"err": "..."}``
+  (对应 stderr 的一行), 最后以 ``{"done": true}`` 或者
+  ``{"error": {"type": "...", "message": "..."}}`` 结束.
+- 请求执行期间, 服务端每隔 ``heartbeat_interval`` 秒发送一行 ``{"heartbeat": true}``,
+  客户端会忽略它. 输出写到 S3 的批量任务在结束之前没有任何输出, 心跳让客户端可以区分
+  "还在执行" 和 "daemon 卡住了", 所以 ``read_timeout`` 不会限制批量任务的总时长.
+
+socket 文件的权限是 ``0600``, 只有启动 daemon 的用户可以连接. 没有 Unix socket 的平台
+(例如 Windows) 上可以 import 本模块, 但是不能启动 daemon, 客户端总是得到
+:class:`DaemonUnavailableError`.
+"""
+
+import typing as T
+import os
+import json
+import socket
+import threading
+import socketserver
+
+from ..exc import SOAPCommandFailedError, AgentDaemonError
+
+#: environment variable to override the default socket path
+SOCKET_PATH_ENV_VAR = "ACSOAP_SOCKET"
+DEFAULT_SOCKET_PATH = "/tmp/acsoap.sock"
+
+#: seconds to wait for the daemon to accept the connection
+DEFAULT_CONNECT_TIMEOUT = 1.0
+#: seconds to wait for the next message of a request, including the heartbeats
+DEFAULT_READ_TIMEOUT = 600.0
+#: seconds between the heartbeats of a running request
+DEFAULT_HEARTBEAT_INTERVAL = 10.0
+
+#: whether the platform supports Unix sockets, Windows doesn't
+HAS_UNIX_SOCKET = hasattr(socket, "AF_UNIX")
+
+#: ``handler(args, out, err)``, ``out`` and ``err`` write one line to the
+#: client's stdout and stderr
+Handler = T.Callable[[dict, T.Callable[[str], None], T.Callable[[str], None]], None]
+
+# exceptions that are re-raised as they are on the client side
+_REMOTE_EXCEPTIONS = {
+    SOAPCommandFailedError.__name__: SOAPCommandFailedError,
+}
+
+
+def get_socket_path(socket_path: T.Optional[str] = None) -> str:
+    if socket_path is None:
+        socket_path = os.environ.get(SOCKET_PATH_ENV_VAR, DEFAULT_SOCKET_PATH)
+    return socket_path
+
+
+def _dumps(message: dict) -> bytes:
+    return (json.dumps(message) + "\n").encode("utf-8")
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "_Server"
+
+    def handle(self):
+        lock = threading.Lock()
+
+        def send(message: dict):
+            with lock:
+                self.wfile.write(_dumps(message))
+                self.wfile.flush()
+
+        def heartbeat(stop: threading.Event):
+            while not stop.wait(self.server.heartbeat_interval):
+                with lock:
+                    # no heartbeat after the end of the request
+                    if stop.is_set():
+                        return
+                    try:
+                        self.wfile.write(_dumps({"heartbeat": True}))
+                        self.wfile.flush()
+                    except OSError:  # pragma: no cover
+                        return
+
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            stop = threading.Event()
+            threading.Thread(target=heartbeat, args=(stop,), daemon=True).start()
+            try:
+                request = json.loads(line)
+                handler = self.server.handlers[request["op"]]
+                handler(
+                    request.get("args", {}),
+                    lambda s: send({"out": s}),
+                    lambda s: send({"err": s}),
+                )
+            except BrokenPipeError:  # pragma: no cover
+                stop.set()
+                return
+            except Exception as e:
+                result = {"error": {"type": type(e).__name__, "message": str(e)}}
+            else:
+                result = {"done": True}
+            stop.set()
+            send(result)
+
+
+if HAS_UNIX_SOCKET:
+
+    class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+        handlers: T.Dict[str, Handler]
+        heartbeat_interval: float
+
+
+class AgentDaemon:
+    """
+    The ``acsoap serve`` server, it dispatches each request to the handler of
+    its ``op``. The handlers run in one thread per connection and share the
+    warm resources they closed over.
+
+    :param handlers: a mapping from op name to :data:`Handler`.
+    :param socket_path: the Unix socket path, default to ``$ACSOAP_SOCKET`` or
+        :data:`DEFAULT_SOCKET_PATH`.
+    :param heartbeat_interval: seconds between the heartbeats of a running
+        request, it must be shorter than the ``read_timeout`` of the clients.
+    """
+
+    def __init__(
+        self,
+        handlers: T.Dict[str, Handler],
+        socket_path: T.Optional[str] = None,
+        heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+    ):
+        self.handlers = handlers
+        self.socket_path = get_socket_path(socket_path)
+        self.heartbeat_interval = heartbeat_interval
+        self._server: T.Optional[_Server] = None
+
+    def bind(self):
+        """
+        Create the socket, a stale socket file left by a dead daemon is removed.
+        """
+        if not HAS_UNIX_SOCKET:  # pragma: no cover
+            raise AgentDaemonError("Unix socket is not supported on this platform")
+        if os.path.exists(self.socket_path):
+            if DaemonClient(self.socket_path).is_alive():
+                raise AgentDaemonError(
+                    f"another daemon is listening on {self.socket_path!r}"
+                )
+            os.remove(self.socket_path)
+        old_umask = os.umask(0o177)
+        try:
+            self._server = _Server(self.socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self._server.handlers = self.handlers
+        self._server.heartbeat_interval = self.heartbeat_interval
+
+    def serve_forever(self):
+        """
+        Serve until :meth:`shutdown` is called or the process is interrupted.
+        """
+        if self._server is None:
+            self.bind()
+        try:
+            self._server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+    def close(self):
+        if self._server is not None:
+            self._server.server_close()
+            self._server = None
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:  # pragma: no cover
+                pass
+
+    def __enter__(self):
+        self.bind()
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        self.close()
+
+
+class DaemonUnavailableError(ConnectionError):
+    """
+    raises when no daemon is listening on the socket.
+    """
+
+
+class DaemonClient:
+    """
+    The client of :class:`AgentDaemon`.
+
+    :param connect_timeout: seconds to wait for the connection, the daemon is
+        considered unavailable if it doesn't accept in time.
+    :param read_timeout: seconds to wait for the next message of a request.
+        The daemon sends heartbeats while the request is running, so a long
+        batch doesn't time out, only a hung daemon does.
+    """
+
+    def __init__(
+        self,
+        socket_path: T.Optional[str] = None,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+    ):
+        self.socket_path = get_socket_path(socket_path)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+    def connect(self) -> socket.socket:
+        """
+        Connect to the daemon, raise :class:`DaemonUnavailableError` if there
+        is no daemon, or it can't be connected for any reason, e.g. the socket
+        belongs to another user or the daemon is hung.
+        """
+        if not HAS_UNIX_SOCKET:  # pragma: no cover
+            raise DaemonUnavailableError("Unix socket is not supported on this platform")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise DaemonUnavailableError(str(e))
+        sock.settimeout(self.read_timeout)
+        return sock
+
+    def is_alive(self) -> bool:
+        try:
+            self.connect().close()
+            return True
+        except DaemonUnavailableError:
+            return False
+
+    def call(
+        self,
+        op: str,
+        args: dict,
+        out: T.Callable[[str], None],
+        err: T.Callable[[str], None],
+    ):
+        """
+        Send a request and forward the output lines to ``out`` and ``err``
+        as they arrive. The error of the handler is re-raised.
+
+        :raises AgentDaemonError: if the daemon doesn't send anything, not even
+            a heartbeat, in ``read_timeout`` seconds. The request may have been
+            executed, so it is not retried.
+        """
+        with self.connect() as sock:
+            sock.sendall(_dumps({"op": op, "args": args}))
+            with sock.makefile("rb") as f:
+                for line in self._iter_lines(f):
+                    message = json.loads(line)
+                    if message.get("heartbeat"):
+                        continue
+                    elif "out" in message:
+                        out(message["out"])
+                    elif "err" in message:
+                        err(message["err"])
+                    elif "error" in message:
+                        error = message["error"]
+                        try:
+                            exc_class = _REMOTE_EXCEPTIONS[error["type"]]
+                        except KeyError:
+                            raise AgentDaemonError(
+                                f"{error['type']}: {error['message']}"
+                            )
+                        raise exc_class(error["message"])
+                    elif message.get("done"):
+                        return
+        raise AgentDaemonError("connection closed by the daemon")
+
+    def _iter_lines(self, f) -> T.Iterator[bytes]:
+        while True:
+            try:
+                line = f.readline()
+            except socket.timeout:
+                raise AgentDaemonError(
+                    f"no response from the daemon in {self.read_timeout} seconds"
+                )
+            if not line:
+                return
+            yield line
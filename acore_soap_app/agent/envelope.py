@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+Precompiled SOAP request envelope builder.
+
+``execute-command.xml`` 模板只在第一次构造请求的时候被读取, 压缩 (去掉缩进和换行) 并切分成
+prefix 和 suffix 两段 bytes, import 本模块不会读取磁盘. 之后每次构造请求时, 只需要对
+GM 命令进行 XML 转义和 UTF-8 编码, 然后和 prefix, suffix 拼接起来即可. 得到的 bytes
+payload 可以直接交给 :class:`~acore_soap_app.agent.transport.SOAPTransport` 或者任何
+其他 HTTP 客户端发送.
+"""
+
+import typing as T
+
+from ..paths import dir_python_lib
+
+path_xml = dir_python_lib.joinpath("agent", "execute-command.xml")
+
+_PLACEHOLDER = "{command}"
+
+
+def compile_envelope(template: str) -> T.Tuple[bytes, bytes]:
+    """
+    Minify the envelope template and split it into the UTF-8 encoded prefix
+    and suffix around the ``{command}`` placeholder.
+    """
+    minified = " ".join(template.split()).replace("> <", "><")
+    prefix, suffix = minified.split(_PLACEHOLDER)
+    return prefix.encode("utf-8"), suffix.encode("utf-8")
+
+
+_envelope: T.Optional[T.Tuple[bytes, bytes]] = None
+
+
+def get_envelope() -> T.Tuple[bytes, bytes]:
+    """
+    Return the compiled ``(prefix, suffix)``, the template is read and compiled
+    on the first call.
+    """
+    global _envelope
+    if _envelope is None:
+        _envelope = compile_envelope(path_xml.read_text(encoding="utf-8"))
+    return _envelope
+
+
+def __getattr__(name: str):
+    # ENVELOPE_PREFIX and ENVELOPE_SUFFIX are computed lazily
+    if name == "ENVELOPE_PREFIX":
+        return get_envelope()[0]
+    if name == "ENVELOPE_SUFFIX":
+        return get_envelope()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def escape_command(command: str) -> str:
+    """
+    Escape the GM command so that it can be used as XML character data.
+    """
+    if "&" in command:
+        command = command.replace("&", "&amp;")
+    if "<" in command:
+        command = command.replace("<", "&lt;")
+    if ">" in command:
+        command = command.replace(">", "&gt;")
+    return command
+
+
+def encode_request(command: str) -> bytes:
+    """
+    Build the ready-to-send SOAP XML payload for a GM command.
+    """
+    prefix, suffix = get_envelope()
+    return b"".join((prefix, escape_command(command).encode("utf-8"), suffix))
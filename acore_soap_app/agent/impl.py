@@ -6,48 +6,116 @@ Agent implementation.
 
 import typing as T
 import json
+import time
 import dataclasses
-import xml.etree.ElementTree as ET
 
-import requests
-
-from ..paths import dir_python_lib
 from ..exc import SOAPResponseParseError
-from ..utils import get_object, put_object
+from .. import metrics
+from ..timing import Phase, timer
+from ..utils import get_object, iter_json_objects, write_json_objects
+from .parser import fast_parse
+from .envelope import encode_request
+from .codec import get_codec
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from .transport import SOAPTransport, Timeout
 
 
 # ------------------------------------------------------------------------------
 # Soap Request and Response
 # ------------------------------------------------------------------------------
-path_xml = dir_python_lib.joinpath("agent", "execute-command.xml")
-
-# default soap request headers
-_SOAP_REQUEST_HEADERS = {"Content-Type": "application/xml"}
-_SOAP_REQUEST_XML_TEMPLATE = path_xml.read_text(encoding="utf-8")
 DEFAULT_USERNAME = "admin"
 DEFAULT_PASSWORD = "admin"
 DEFAULT_HOST = "localhost"
 DEFAULT_PORT = 7878
 
+#: the prefix of a batch of objects encoded by :meth:`Base.batch_dump_to_inline`
+INLINE_PREFIX = "b64gz:"
+#: SSM Run Command only returns the first 24,000 characters of the stdout
+SSM_STDOUT_LIMIT = 24000
+#: ``acsoap gm --overflow`` keeps the stdout under this number of characters
+MAX_STDOUT_SIZE = 20000
+#: the ``--overflow`` value that only compresses the stdout, without S3
+OVERFLOW_INLINE = "inline"
+
+
+def encode_inline(json_strs: T.Iterable[str]) -> str:
+    """
+    Encode JSON strings as ``b64gz:`` + URL safe base64 of the gzipped
+    JSON Lines.
+    """
+    import gzip
+    import base64
+
+    data = "\n".join(json_strs)
+    # mtime=0 makes the output deterministic
+    payload = gzip.compress(data.encode("utf-8"), mtime=0)
+    return INLINE_PREFIX + base64.urlsafe_b64encode(payload).decode("ascii")
+
+
+def decode_inline(inline: str) -> T.Iterator[str]:
+    """
+    The reverse of :func:`encode_inline`, yield the JSON strings.
+    """
+    import gzip
+    import base64
+
+    payload = base64.urlsafe_b64decode(inline[len(INLINE_PREFIX) :])
+    for line in gzip.decompress(payload).decode("utf-8").splitlines():
+        if line:
+            yield line
+
+
+def _add_slots(cls):
+    """
+    Re-create a dataclass with ``__slots__``, so that instances don't carry a
+    per-instance ``__dict__``. This is what ``dataclasses.dataclass(slots=True)``
+    does, but that is only available on Python 3.10+.
+    """
+    inherited = set()
+    for base in cls.__mro__[1:-1]:
+        inherited.update(base.__dict__.get("__slots__", ()))
+    cls_dict = dict(cls.__dict__)
+    field_names = tuple(
+        field.name
+        for field in dataclasses.fields(cls)
+        if field.name not in inherited
+    )
+    cls_dict["__slots__"] = field_names
+    for name in field_names:
+        # remove the class attributes holding the default values,
+        # they would conflict with the slot descriptors
+        cls_dict.pop(name, None)
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+    new_cls = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    new_cls.__qualname__ = cls.__qualname__
+    return new_cls
+
 
 @dataclasses.dataclass
 class Base:
     """
     Base class for :class:`SOAPRequest` and :class:`SOAPResponse`.
+
+    The serialization methods use the flat field access serializers generated
+    for each subclass by :func:`~acore_soap_app.agent.codec.get_codec`.
     """
 
+    __slots__ = ()
+
     @classmethod
     def from_dict(cls, dct: dict):
         """
         Construct an object from a dict.
         """
-        return cls(**dct)
+        return get_codec(cls).from_dict(cls, dct)
 
     def to_dict(self) -> dict:
         """
-        Convert the object to a dict.
+        Convert the object to a dict, None values are skipped.
         """
-        return {k: v for k, v in dataclasses.asdict(self).items() if v is not None}
+        return get_codec(self.__class__).to_dict(self)
 
     @classmethod
     def from_json(cls, json_str: str):
@@ -56,11 +124,24 @@ class Base:
         """
         return cls.from_dict(json.loads(json_str))
 
-    def to_json(self) -> str:  # pragma: no cover
+    def to_json(self) -> str:
         """
-        Convert the object to a JSON string.
+        Convert the object to a JSON string, None values are skipped.
         """
-        return json.dumps(self.to_dict())
+        return get_codec(self.__class__).to_json(self)
+
+    @classmethod
+    def batch_iter_from_s3(
+        cls,
+        s3_client,
+        s3uri: str,
+    ) -> T.Iterator:
+        """
+        以流的方式从 S3 中逐个加载对象. 支持 JSON 数组和 JSON Lines 两种格式, 详见
+        :func:`~acore_soap_app.utils.iter_json_objects`.
+        """
+        for dct in iter_json_objects(s3_client, s3uri=s3uri):
+            yield cls.from_dict(dct)
 
     @classmethod
     def batch_load_from_s3(
@@ -71,8 +152,7 @@ class Base:
         """
         从 S3 中加载多个对象.
         """
-        json_str = get_object(s3_client, s3uri=s3uri)
-        return [cls.from_dict(dct) for dct in json.loads(json_str)]
+        return list(cls.batch_iter_from_s3(s3_client, s3uri=s3uri))
 
     @classmethod
     def batch_dump_to_s3(
@@ -82,12 +162,35 @@ class Base:
         s3uri: str,
     ):
         """
-        将多个对象以 JSON 格式保存到 S3 中.
+        将多个对象以 JSON 格式保存到 S3 中. 如果 ``s3uri`` 以 ``.jsonl`` 或 ``.ndjson``
+        结尾, 则使用 JSON Lines 格式. 数据是增量写入的, ``instances`` 可以是一个 generator.
         """
-        data = [instance.to_dict() for instance in instances]
-        put_object(s3_client=s3_client, s3uri=s3uri, body=json.dumps(data))
+        write_json_objects(
+            s3_client=s3_client,
+            s3uri=s3uri,
+            json_strs=(instance.to_json() for instance in instances),
+        )
+
+    @classmethod
+    def batch_dump_to_inline(cls, instances: T.Iterable) -> str:
+        """
+        把多个对象编码成一个可以直接放在 shell 命令行 (或者 SSM 的 stdout) 中的字符串:
+        ``b64gz:`` 前缀加上 gzip 压缩之后的 JSON Lines 的 URL safe base64 编码.
+        这样一批命令只需要启动一次 ``acsoap gm``, 并且不需要 S3.
+        :meth:`batch_iter_from_inline` 可以读取这个字符串.
+        """
+        return encode_inline(instance.to_json() for instance in instances)
+
+    @classmethod
+    def batch_iter_from_inline(cls, inline: str) -> T.Iterator:
+        """
+        逐个加载 :meth:`batch_dump_to_inline` 编码的对象.
+        """
+        for line in decode_inline(inline):
+            yield cls.from_json(line)
 
 
+@_add_slots
 @dataclasses.dataclass
 class SOAPRequest(Base):
     """
@@ -154,21 +257,83 @@ class SOAPRequest(Base):
         port = self.port or DEFAULT_PORT
         return f"http://{username}:{password}@{host}:{port}/"
 
-    def send(self) -> "SOAPResponse":  # pragma: no cover
+    def encode(self) -> bytes:
+        """
+        Build the ready-to-send SOAP XML payload, see
+        :func:`~acore_soap_app.agent.envelope.encode_request`.
+        """
+        return encode_request(self.command)
+
+    def send(
+        self,
+        transport: T.Optional["SOAPTransport"] = None,
+        timeout: "Timeout" = None,
+        keep_body: bool = True,
+        throttle: bool = True,
+    ) -> "SOAPResponse":
         """
         Run soap command via HTTP request. This function "has to" be run on the
         game server and talk to the localhost. You should NEVER open SOAP port
         to public!
+
+        :param transport: the :class:`~acore_soap_app.agent.transport.SOAPTransport`
+            to use, if None, use the process wide default one, so that all
+            requests to the same endpoint reuse the same keep-alive connections.
+        :param timeout: per-request timeout, either a single number or a
+            ``(connect, read)`` tuple. If None, use the transport default.
+        :param keep_body: if False, drop the raw XML body of the response,
+            see :meth:`SOAPResponse.parse`.
+        :param throttle: if False, skip the rate limiter of the transport,
+            see :class:`~acore_soap_app.agent.ratelimit.RateLimiter`.
         """
-        http_response = requests.post(
-            self.endpoint,
-            headers=_SOAP_REQUEST_HEADERS,
-            data=_SOAP_REQUEST_XML_TEMPLATE.format(command=self.command),
-        )
-        return SOAPResponse.parse(http_response.text)
+        if transport is None:
+            from .transport import get_default_transport
+
+            transport = get_default_transport()
+        host = self.host or DEFAULT_HOST
+        port = self.port or DEFAULT_PORT
+        with timer(Phase.BUILD):
+            data = self.encode()
+
+        agent_metrics = metrics.agent_metrics
+        if agent_metrics is not None:
+            endpoint = f"{host}:{port}"
+            agent_metrics.requests.inc(endpoint=endpoint)
+            agent_metrics.in_flight.inc(endpoint=endpoint)
+            start = time.perf_counter()
+        try:
+            http_response = transport.post(
+                host=host,
+                port=port,
+                username=self.username or DEFAULT_USERNAME,
+                password=self.password or DEFAULT_PASSWORD,
+                data=data,
+                timeout=timeout,
+                command=self.command,
+                throttle=throttle,
+            )
+        except Exception:
+            if agent_metrics is not None:
+                agent_metrics.errors.inc(endpoint=endpoint)
+            raise
+        finally:
+            if agent_metrics is not None:
+                agent_metrics.in_flight.dec(endpoint=endpoint)
+                agent_metrics.latency.observe(
+                    time.perf_counter() - start, endpoint=endpoint
+                )
+
+        with timer(Phase.PARSE):
+            response = SOAPResponse.parse(http_response.text, keep_body=keep_body)
+        if agent_metrics is not None:
+            agent_metrics.responses.inc(
+                endpoint=endpoint,
+                outcome="succeeded" if response.succeeded else "fault",
+            )
+        return response
 
     @classmethod
-    def batch_load(
+    def batch_iter(
         cls,
         request_like: T.Union[
             str,
@@ -179,39 +344,16 @@ class SOAPRequest(Base):
         username: T.Optional[str] = None,
         password: T.Optional[str] = None,
         s3_client=None,
-    ) -> T.List["SOAPRequest"]:
+    ) -> T.Iterator["SOAPRequest"]:
         """
-        从各种形式的输入中加载 :class:`SOAPRequest`. 该方法总是返回一个列表.
-
-        输入参数 ``request_like`` 代表着要运行的 GM 命令, 它可能是以下几种形式中的一种:
-
-        - 如果是一个字符串:
-            - 如果是以 s3:// 开头, 那么就去 S3 读数据, 此时需要给定 ``s3_client`` 参数.
-                通常用于 payload 比较大的情况:
-                - 如果读到的数据是单个字典, 那么就视为一个 SOAPRequest.
-                - 如果读到的数据是一个列表, 那么就视为多个 SOAPRequest.
-            - 如果不是以 s3:// 开头, 那么就视为一个 GM command.
-        - 如果是一个字符串列表, 那么就视为多个 GM 命令.
-        - 它还可以是单个 SOAPRequest 或 SOAPRequest 列表.
-        - 这个参数最终都会被转换成 SOAPRequest 的列表.
-
-        :param request_like: 上面已经说过了.
-        :param username: 默认的用户名, 只有当 request.username 为 None 的时候才会用到.
-        :param password: 默认的密码, 只有当 request.password 为 None 的时候才会用到.
-        :param s3_client: boto3.client("s3")
+        和 :meth:`SOAPRequest.batch_load` 一样, 但是返回一个 generator. 如果输入是
+        S3 上的 JSON Lines 文件, 则以流的方式逐行读取, 内存占用和请求的数量无关.
         """
         if isinstance(request_like, str):
-            if request_like.startswith("s3://"):  # pragma: no cover
-                data = json.loads(get_object(s3_client=s3_client, s3uri=request_like))
-                if isinstance(data, dict):  # pragma: no cover
-                    requests = [SOAPRequest.from_dict(data)]
-                elif isinstance(data, list):
-                    requests = [SOAPRequest.from_dict(dct) for dct in data]
-                else:  # pragma: no cover
-                    raise TypeError(
-                        f"data in S3 must be a dict or "
-                        f"a list of dict, not {type(data)}"
-                    )
+            if request_like.startswith("s3://"):
+                requests = cls._iter_from_s3(s3_client=s3_client, s3uri=request_like)
+            elif request_like.startswith(INLINE_PREFIX):
+                requests = cls.batch_iter_from_inline(request_like)
             else:
                 requests = [SOAPRequest(command=request_like)]
         elif isinstance(request_like, SOAPRequest):
@@ -232,9 +374,69 @@ class SOAPRequest(Base):
             )
         for request in requests:
             request.set_default(username=username, password=password)
-        return requests
+            yield request
+
+    @classmethod
+    def _iter_from_s3(cls, s3_client, s3uri: str) -> T.Iterator["SOAPRequest"]:
+        for data in iter_json_objects(s3_client=s3_client, s3uri=s3uri):
+            if isinstance(data, dict):
+                yield SOAPRequest.from_dict(data)
+            else:  # pragma: no cover
+                raise TypeError(
+                    f"data in S3 must be a dict or "
+                    f"a list of dict, not {type(data)}"
+                )
+
+    @classmethod
+    def batch_load(
+        cls,
+        request_like: T.Union[
+            str,
+            T.List[str],
+            "SOAPRequest",
+            T.List["SOAPRequest"],
+        ],
+        username: T.Optional[str] = None,
+        password: T.Optional[str] = None,
+        s3_client=None,
+    ) -> T.List["SOAPRequest"]:
+        """
+        从各种形式的输入中加载 :class:`SOAPRequest`. 该方法总是返回一个列表.
 
+        输入参数 ``request_like`` 代表着要运行的 GM 命令, 它可能是以下几种形式中的一种:
 
+        - 如果是一个字符串:
+            - 如果是以 s3:// 开头, 那么就去 S3 读数据, 此时需要给定 ``s3_client`` 参数.
+                通常用于 payload 比较大的情况:
+                - 如果读到的数据是单个字典, 那么就视为一个 SOAPRequest.
+                - 如果读到的数据是一个列表, 那么就视为多个 SOAPRequest.
+                - 如果是 JSON Lines 格式 (``.jsonl`` 扩展名, 或者每行一个字典),
+                    那么每一行视为一个 SOAPRequest.
+            - 如果是以 ``b64gz:`` 开头, 那么就视为由 :meth:`SOAPRequest.batch_dump_to_inline`
+                编码的多个 SOAPRequest.
+            - 其他情况, 那么就视为一个 GM command.
+        - 如果是一个字符串列表, 那么就视为多个 GM 命令.
+        - 它还可以是单个 SOAPRequest 或 SOAPRequest 列表.
+        - 这个参数最终都会被转换成 SOAPRequest 的列表.
+
+        如果你不想一次性把所有的请求都加载到内存中, 请使用 :meth:`SOAPRequest.batch_iter`.
+
+        :param request_like: 上面已经说过了.
+        :param username: 默认的用户名, 只有当 request.username 为 None 的时候才会用到.
+        :param password: 默认的密码, 只有当 request.password 为 None 的时候才会用到.
+        :param s3_client: boto3.client("s3")
+        """
+        return list(
+            cls.batch_iter(
+                request_like=request_like,
+                username=username,
+                password=password,
+                s3_client=s3_client,
+            )
+        )
+
+
+@_add_slots
 @dataclasses.dataclass
 class SOAPResponse(Base):
     """
@@ -256,7 +458,8 @@ class SOAPResponse(Base):
         >>> res.succeeded
         True
 
-    :param body: the raw SOAP XML response
+    :param body: the raw SOAP XML response, it is None if the response is
+        parsed with ``keep_body=False``.
     :param message: if succeeded, it is the ``<result>...</result>`` part.
         if failed, it is the ``<faultstring>...</faultstring>`` part
     :param succeeded: a boolean flag to indicate whether the command is succeeded
@@ -271,15 +474,45 @@ class SOAPResponse(Base):
     - :meth:`~Base.batch_dump_to_s3`
     """
 
-    body: str = dataclasses.field()
+    body: T.Optional[str] = dataclasses.field()
     message: str = dataclasses.field()
     succeeded: bool = dataclasses.field()
 
     @classmethod
-    def parse(cls, body: str) -> "SOAPResponse":
+    def parse(cls, body: str, keep_body: bool = True) -> "SOAPResponse":
         """
         Parse the SOAP XML response.
+
+        It uses :func:`~acore_soap_app.agent.parser.fast_parse` for regular
+        AzerothCore responses, and only falls back to ElementTree for
+        unexpected documents.
+
+        :param keep_body: if False, drop the raw XML body and only keep the
+            extracted message, it saves a lot of memory when you hold many
+            responses.
+        """
+        result = fast_parse(body)
+        if result is not None:
+            message, succeeded = result
+            return cls(
+                body=body.strip() if keep_body else None,
+                message=message,
+                succeeded=succeeded,
+            )
+        try:
+            return cls._parse_element_tree(body, keep_body=keep_body)
+        except Exception:
+            if metrics.agent_metrics is not None:
+                metrics.agent_metrics.parse_errors.inc()
+            raise
+
+    @classmethod
+    def _parse_element_tree(cls, body: str, keep_body: bool = True) -> "SOAPResponse":
+        """
+        Parse the SOAP XML response with ElementTree.
         """
+        import xml.etree.ElementTree as ET
+
         root = ET.fromstring(body)
         results = list(root.iter("result"))
         if len(results):
@@ -289,7 +522,7 @@ class SOAPResponse(Base):
             else:
                 message = "No result"
             return cls(
-                body=body.strip(),
+                body=body.strip() if keep_body else None,
                 message=message,
                 succeeded=True,
             )
@@ -301,7 +534,7 @@ class SOAPResponse(Base):
             else:
                 message = "No fault string"
             return cls(
-                body=body.strip(),
+                body=body.strip() if keep_body else None,
                 message=message,
                 succeeded=False,
             )
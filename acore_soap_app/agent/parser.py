@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fast path parser for the AzerothCore SOAP XML response.
+
+AzerothCore 的 SOAP 响应是一个形状固定的 envelope, 我们真正需要的只是
+``<result>...</result>`` 或 ``<faultstring>...</faultstring>`` 中的文本. 所以没有必要
+为每个响应都构建一个完整的 ElementTree. 和 ElementTree 的实现一样, :func:`fast_parse`
+先找第一个 ``<result>``, 没有的话再找第一个 ``<faultstring>``, 并自行解码 XML 实体
+(例如 ``&#xD;``, ``&lt;``). 如果文档的形状不符合预期 (例如有 CDATA, 嵌套元素, 未知实体,
+或者不是合法 XML 字符的字符引用), 它会返回 None, 由调用者回退到 ElementTree 的实现.
+"""
+
+import typing as T
+import re
+
+# ``<result>text</result>``, ``<result/>`` or the same for ``<faultstring>``,
+# the text must not contain any markup
+_pattern_result = re.compile(r"<result(?:/>|>([^<]*)</result>)")
+_pattern_faultstring = re.compile(r"<faultstring(?:/>|>([^<]*)</faultstring>)")
+_pattern_entity = re.compile(r"&(#x[0-9a-fA-F]+|#[0-9]+|[A-Za-z]+);")
+
+_PREDEFINED_ENTITIES = {
+    "lt": "<",
+    "gt": ">",
+    "amp": "&",
+    "quot": '"',
+    "apos": "'",
+}
+
+
+class _UnknownEntity(Exception):
+    pass
+
+
+def is_xml_char(code: int) -> bool:
+    """
+    Whether the code point is a legal XML 1.0 ``Char``, a character reference
+    to anything else is rejected by the XML parser, e.g. ``&#0;``.
+    """
+    return (
+        code in (0x9, 0xA, 0xD)
+        or 0x20 <= code <= 0xD7FF
+        or 0xE000 <= code <= 0xFFFD
+        or 0x10000 <= code <= 0x10FFFF
+    )
+
+
+def _replace_entity(match: "re.Match") -> str:
+    name = match.group(1)
+    try:
+        return _PREDEFINED_ENTITIES[name]
+    except KeyError:
+        pass
+    if name.startswith("#x"):
+        code = int(name[2:], 16)
+    elif name.startswith("#"):
+        code = int(name[1:])
+    else:
+        raise _UnknownEntity(name)
+    if not is_xml_char(code):
+        raise _UnknownEntity(name)
+    return chr(code)
+
+
+def unescape_xml(text: str) -> T.Optional[str]:
+    """
+    Decode the XML character data the same way an XML parser does: normalize
+    line endings, then resolve the predefined and numeric character
+    references. Return None if there is an entity we don't know, or a
+    character reference that is not a legal XML character.
+    """
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if "&" not in text:
+        return text
+    # AzerothCore ends every line with "&#xD;", handle it without the regex
+    text = text.replace("&#xD;", "\r")
+    if "&" not in text:
+        return text
+    n_ampersand = text.count("&")
+    try:
+        text, n = _pattern_entity.subn(_replace_entity, text)
+    except _UnknownEntity:
+        return None
+    # a bare "&" is not well-formed XML, let the full parser decide
+    if n != n_ampersand:
+        return None
+    return text
+
+
+def fast_parse(body: str) -> T.Optional[T.Tuple[str, bool]]:
+    """
+    Extract the message from a SOAP XML response with a single scan.
+
+    :return: a ``(message, succeeded)`` tuple, or None if the document doesn't
+        look like a regular AzerothCore SOAP response.
+    """
+    # the first <result> wins wherever the <faultstring> is, like ElementTree
+    for tag, pattern in (
+        ("result", _pattern_result),
+        ("faultstring", _pattern_faultstring),
+    ):
+        start = body.find(f"<{tag}")
+        if start != -1:
+            break
+    else:
+        return None
+    match = pattern.match(body, start)
+    if match is None:  # the first element has attributes or markup
+        return None
+    text = match.group(1)
+    succeeded = tag == "result"
+    if text:
+        text = unescape_xml(text)
+        if text is None:
+            return None
+        message = text.strip()
+    elif succeeded:
+        message = "No result"
+    else:
+        message = "No fault string"
+    return message, succeeded
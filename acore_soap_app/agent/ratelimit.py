@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""
+Token bucket rate limiter for the worldserver SOAP endpoint.
+
+worldserver 只有一个 SOAP 线程, 批量任务如果不加限制地发送成千上万个 GM 命令, 会导致游戏内
+出现卡顿. :class:`RateLimiter` 为每个 ``host:port`` 维护一个 token bucket:
+
+- ``rate`` 是每秒补充的 token 数量, ``burst`` 是 bucket 的容量, 也就是允许的最大突发量.
+- 每个命令默认消耗 1 个 token, 可以用 ``weights`` 按照命令前缀指定更大的消耗, 例如
+  ``.reload`` 这种代价很高的命令.
+- 采用 "先预约, 再等待" 的方式: 预约 token 是在锁内完成的, 等待则在锁外, 所以多线程和
+  asyncio 的调用者之间是公平的, 等待时也不会阻塞其他 endpoint.
+- :meth:`RateLimiter.stats` 返回等待时间的统计, 用于在吞吐量和玩家可感知的延迟之间做权衡.
+
+把 :class:`RateLimiter` 交给 :class:`~acore_soap_app.agent.transport.SOAPTransport`,
+串行, 多线程 (:class:`~acore_soap_app.agent.batch.BatchExecutor`) 以及 asyncio
+(:class:`~acore_soap_app.agent.async_client.AsyncSOAPClient`) 的发送路径都会共享同一个限流.
+
+Usage example:
+
+.. code-block:: python
+
+    >>> limiter = RateLimiter(rate=20, burst=5, weights={".reload": 10})
+    >>> transport = SOAPTransport(rate_limiter=limiter)
+    >>> for request in requests:
+    ...     request.send(transport=transport)
+    >>> limiter.stats()
+"""
+
+import typing as T
+import time
+import asyncio
+import threading
+
+#: Default command prefix weights, expensive commands cost more tokens.
+DEFAULT_WEIGHTS: T.Dict[str, float] = {
+    ".reload": 10,
+}
+
+
+class TokenBucket:
+    """
+    A token bucket that allows the token count to go negative, the debt is
+    the time that the caller has to wait. Not thread-safe on its own.
+
+    :param rate: tokens added per second.
+    :param burst: the capacity of the bucket, the bucket starts full.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        clock: T.Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        Take ``tokens`` from the bucket and return the number of seconds to
+        wait before the reservation is fulfilled.
+        """
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= tokens
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Thread-safe rate limiter with one :class:`TokenBucket` per ``host:port``.
+
+    :param rate: the sustained number of commands (tokens) per second.
+    :param burst: the max burst size, default to ``rate``, at least 1.
+    :param weights: a mapping from command prefix to its cost in tokens,
+        the longest matching prefix wins, other commands cost 1 token.
+        Default is :data:`DEFAULT_WEIGHTS`.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: T.Optional[float] = None,
+        weights: T.Optional[T.Dict[str, float]] = None,
+        clock: T.Callable[[], float] = time.monotonic,
+        sleep: T.Callable[[float], None] = time.sleep,
+    ):
+        if rate <= 0:
+            raise ValueError("rate must be greater than 0")
+        if burst is None:
+            burst = max(rate, 1)
+        if burst <= 0:
+            raise ValueError("burst must be greater than 0")
+        if weights is None:
+            weights = DEFAULT_WEIGHTS
+        self.rate = rate
+        self.burst = burst
+        # sorted by length so that the longest prefix is matched first
+        self.weights = sorted(weights.items(), key=lambda kv: len(kv[0]), reverse=True)
+        self.clock = clock
+        self.sleep = sleep
+        self._buckets: T.Dict[T.Tuple[str, int], TokenBucket] = dict()
+        self._lock = threading.Lock()
+        self.n_acquired = 0
+        self.n_throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def get_weight(self, command: T.Optional[str]) -> float:
+        """
+        Return the number of tokens that the command costs.
+        """
+        if command:
+            command = command.lstrip()
+            for prefix, weight in self.weights:
+                if command.startswith(prefix):
+                    return weight
+        return 1
+
+    def reserve(self, host: str, port: int, command: T.Optional[str] = None) -> float:
+        """
+        Reserve the tokens for a command and return the seconds to wait.
+        """
+        key = (host, port)
+        tokens = self.get_weight(command)
+        with self._lock:
+            try:
+                bucket = self._buckets[key]
+            except KeyError:
+                bucket = TokenBucket(self.rate, self.burst, clock=self.clock)
+                self._buckets[key] = bucket
+            wait = bucket.reserve(tokens)
+            self.n_acquired += 1
+            if wait > 0:
+                self.n_throttled += 1
+                self.total_wait += wait
+                if wait > self.max_wait:
+                    self.max_wait = wait
+        return wait
+
+    def acquire(self, host: str, port: int, command: T.Optional[str] = None) -> float:
+        """
+        Block until the command is allowed to be sent, return the seconds waited.
+        """
+        wait = self.reserve(host, port, command)
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    async def acquire_async(
+        self,
+        host: str,
+        port: int,
+        command: T.Optional[str] = None,
+    ) -> float:
+        """
+        The asyncio version of :meth:`acquire`.
+        """
+        wait = self.reserve(host, port, command)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def stats(self) -> T.Dict[str, float]:
+        """
+        Return the wait time statistics.
+        """
+        with self._lock:
+            return {
+                "acquired": self.n_acquired,
+                "throttled": self.n_throttled,
+                "total_wait": self.total_wait,
+                "max_wait": self.max_wait,
+                "mean_wait": (
+                    self.total_wait / self.n_acquired if self.n_acquired else 0.0
+                ),
+            }
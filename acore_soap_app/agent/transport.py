@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+"""
+HTTP transport for sending SOAP requests to the worldserver.
+
+:class:`SOAPTransport` 维护了一组可复用的 ``requests.Session``, 以
+``(host, port, username, password)`` 为 key. 同一个 SOAP endpoint 的所有请求都会复用
+同一个 Session 背后的 keep-alive TCP 连接池, 并且 Basic Auth header 只会在创建 Session
+的时候计算一次. 这样在批量执行成千上万个 GM 命令时就不用为每个命令都重新建立 TCP 连接了.
+
+:meth:`~acore_soap_app.agent.impl.SOAPRequest.send` 默认使用
+:func:`get_default_transport` 返回的全局单例.
+"""
+
+import typing as T
+import copy
+import base64
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..circuit_breaker import CircuitBreaker
+from ..timing import Phase, timer
+from .ratelimit import RateLimiter
+
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = None
+
+_SOAP_REQUEST_HEADERS = {"Content-Type": "application/xml"}
+
+SessionKey = T.Tuple[str, int, str, str]
+Timeout = T.Optional[T.Union[float, T.Tuple[T.Optional[float], T.Optional[float]]]]
+
+
+def _make_basic_auth_header(username: str, password: str) -> str:
+    token = base64.b64encode(f"{username}:{password}".encode("utf-8"))
+    return "Basic " + token.decode("ascii")
+
+
+def is_endpoint_failure(e: BaseException) -> bool:
+    """
+    Check if the exception means that the SOAP endpoint is unreachable.
+    """
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+
+class SOAPTransport:
+    """
+    A thread-safe pool of keep-alive HTTP sessions keyed by
+    ``(host, port, username, password)``.
+
+    Usage example:
+
+    .. code-block:: python
+
+        >>> transport = SOAPTransport(pool_maxsize=20, read_timeout=30)
+        >>> response = SOAPRequest(command=".server info").send(transport=transport)
+
+    :param pool_maxsize: max number of connections to keep in the pool of each
+        session. Set it to at least the number of concurrent workers.
+    :param pool_block: if True, block when all connections of a pool are in use
+        instead of opening a throw-away connection.
+    :param keep_alive: if False, send ``Connection: close`` so that every request
+        uses a fresh TCP connection (the legacy behavior).
+    :param connect_timeout: default TCP connect timeout in seconds.
+    :param read_timeout: default read timeout in seconds, None means wait forever.
+    :param max_retries: number of retries on connection errors, see
+        :class:`requests.adapters.HTTPAdapter`.
+    :param rate_limiter: optional :class:`~acore_soap_app.agent.ratelimit.RateLimiter`
+        applied to every :meth:`post` of this transport, per ``host:port``.
+    :param circuit_breaker: optional :class:`~acore_soap_app.circuit_breaker.CircuitBreaker`
+        keyed by ``host:port``. Connection errors and timeouts count as
+        failures, once the circuit is open :meth:`post` fails fast with
+        :class:`~acore_soap_app.exc.CircuitOpenError`.
+    """
+
+    def __init__(
+        self,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        pool_block: bool = False,
+        keep_alive: bool = True,
+        connect_timeout: T.Optional[float] = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: T.Optional[float] = DEFAULT_READ_TIMEOUT,
+        max_retries: int = 0,
+        rate_limiter: T.Optional[RateLimiter] = None,
+        circuit_breaker: T.Optional[CircuitBreaker] = None,
+    ):
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self._sessions: T.Dict[SessionKey, requests.Session] = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self) -> T.Tuple[T.Optional[float], T.Optional[float]]:
+        """
+        The default ``(connect, read)`` timeout tuple.
+        """
+        return (self.connect_timeout, self.read_timeout)
+
+    def _new_session(self, username: str, password: str) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+            max_retries=self.max_retries,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(_SOAP_REQUEST_HEADERS)
+        session.headers["Authorization"] = _make_basic_auth_header(username, password)
+        if self.keep_alive is False:
+            session.headers["Connection"] = "close"
+        # we never want to pick up proxy settings or .netrc for localhost
+        session.trust_env = False
+        return session
+
+    def get_session(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+    ) -> requests.Session:
+        """
+        Get the session for the given SOAP endpoint and credentials, create one
+        if it doesn't exist yet.
+        """
+        key = (host, port, username, password)
+        try:
+            return self._sessions[key]
+        except KeyError:
+            with self._lock:
+                if key not in self._sessions:
+                    self._sessions[key] = self._new_session(username, password)
+                return self._sessions[key]
+
+    def post(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        data: T.Union[str, bytes],
+        timeout: Timeout = None,
+        command: T.Optional[str] = None,
+        throttle: bool = True,
+    ) -> requests.Response:
+        """
+        Send the SOAP XML payload to ``http://{host}:{port}/``.
+
+        :param timeout: per-request timeout, either a single number or a
+            ``(connect, read)`` tuple. If None, use the transport default.
+        :param command: the GM command in the payload, used to look up its
+            rate limit weight.
+        :param throttle: if False, skip the rate limiter, for callers that
+            already acquired the tokens.
+        """
+        circuit_breaker = self.circuit_breaker
+        if circuit_breaker is not None:
+            # reject before taking any rate limit token
+            key = f"{host}:{port}"
+            circuit_breaker.before_call(key)
+        try:
+            if throttle and (self.rate_limiter is not None):
+                with timer(Phase.THROTTLE):
+                    self.rate_limiter.acquire(host, port, command)
+            session = self.get_session(host, port, username, password)
+            if timeout is None:
+                timeout = self.timeout
+            with timer(Phase.HTTP):
+                response = session.post(
+                    f"http://{host}:{port}/",
+                    data=data,
+                    timeout=timeout,
+                )
+        except Exception as e:
+            if circuit_breaker is not None:
+                circuit_breaker.on_error(key, e, is_endpoint_failure)
+            raise
+        if circuit_breaker is not None:
+            circuit_breaker.on_success(key)
+        return response
+
+    def with_rate_limiter(self, rate_limiter: T.Optional[RateLimiter]) -> "SOAPTransport":
+        """
+        Return a transport that shares the connection pool of this one, but is
+        throttled by ``rate_limiter``. Closing either of them closes the pool.
+        """
+        transport = copy.copy(self)
+        transport.rate_limiter = rate_limiter
+        return transport
+
+    def with_pool_maxsize(self, pool_maxsize: int) -> "SOAPTransport":
+        """
+        Return a new transport with a different pool size and the same
+        settings, rate limiter and circuit breaker as this one. The new
+        transport has its own connection pool, the caller should close it.
+        """
+        return SOAPTransport(
+            pool_maxsize=pool_maxsize,
+            pool_block=self.pool_block,
+            keep_alive=self.keep_alive,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            max_retries=self.max_retries,
+            rate_limiter=self.rate_limiter,
+            circuit_breaker=self.circuit_breaker,
+        )
+
+    def close(self):
+        """
+        Close all pooled sessions and their connections.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+_default_transport: T.Optional[SOAPTransport] = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport() -> SOAPTransport:
+    """
+    Get the process wide :class:`SOAPTransport` singleton.
+    """
+    global _default_transport
+    if _default_transport is None:
+        with _default_transport_lock:
+            if _default_transport is None:
+                _default_transport = SOAPTransport()
+    return _default_transport
+
+
+def set_default_transport(transport: SOAPTransport):
+    """
+    Replace the process wide :class:`SOAPTransport` singleton, for example to
+    use a different pool size or timeout for every
+    :meth:`~acore_soap_app.agent.impl.SOAPRequest.send` call.
+    """
+    global _default_transport
+    with _default_transport_lock:
+        _default_transport = transport
@@ -6,9 +6,30 @@ from .agent.api import DEFAULT_HOST
 from .agent.api import DEFAULT_PORT
 from .agent.api import SOAPRequest
 from .agent.api import SOAPResponse
+from .agent.api import SOAPTransport
 from .sdk.api import run_soap_command
+from .sdk.api import run_fleet_soap_command
+from .sdk.api import iter_fleet_soap_command
 from .sdk.api import canned
+from .sdk.api import ResponseCache
+from .sdk.api import InstanceResolver
+from .sdk.api import PollingStrategy
+from .sdk.api import SingleFlight
+from .sdk.api import AsyncSingleFlight
 from .exc import EC2IsNotRunningError
 from .exc import RunCommandError
+from .exc import SSMOutputTruncatedError
 from .exc import SOAPResponseParseError
 from .exc import SOAPCommandFailedError
+from .exc import CircuitOpenError
+from .circuit_breaker import CircuitState
+from .circuit_breaker import CircuitBreaker
+from .timing import Phase
+from .timing import Collector
+from .timing import HistogramCollector
+from .timing import collect
+from .metrics import MetricsRegistry
+from .metrics import MetricsServer
+from .metrics import write_textfile
+from .metrics import enable_metrics
+from .metrics import disable_metrics
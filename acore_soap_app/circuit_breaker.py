@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+"""
+Circuit breaker for the SOAP endpoints and the remote game servers.
+
+当 worldserver 挂掉的时候, 每个请求都要等完整的 TCP 超时才会失败, 一个批量任务就会浪费
+大量的时间. :class:`CircuitBreaker` 为每个目标 (agent 中是 ``host:port``, SDK 中是
+``server_id``) 维护一个三态的熔断器:
+
+- ``closed``: 正常状态, 所有请求都会被发送. 连续失败 ``failure_threshold`` 次后进入 ``open``.
+- ``open``: 所有请求立刻以 :class:`~acore_soap_app.exc.CircuitOpenError` 失败, 不会被发送.
+  ``recovery_timeout`` 秒之后进入 ``half_open``.
+- ``half_open``: 最多允许 ``half_open_max_calls`` 个试探请求, 成功则回到 ``closed``,
+  失败则重新进入 ``open``.
+
+只有代表目标不可达的异常 (例如连接错误, 超时) 才算失败, 这由 :class:`CircuitBreaker`
+的 ``is_failure`` 参数决定. 如果不指定, 则使用调用方的默认判断, 例如
+:class:`~acore_soap_app.agent.transport.SOAPTransport` 只把连接错误和超时算作失败.
+
+状态的每次变化都会调用通过 :meth:`CircuitBreaker.add_listener` 注册的回调函数,
+同时也会记录在 :meth:`CircuitBreaker.stats` 的计数器中.
+
+Usage example:
+
+.. code-block:: python
+
+    >>> breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+    >>> breaker.add_listener(lambda key, old, new: print(f"{key}: {old} -> {new}"))
+    >>> transport = SOAPTransport(circuit_breaker=breaker)
+"""
+
+import typing as T
+import enum
+import time
+import threading
+import dataclasses
+
+from .exc import CircuitOpenError
+
+ResultT = T.TypeVar("ResultT")
+Listener = T.Callable[[str, "CircuitState", "CircuitState"], None]
+
+
+class CircuitState(str, enum.Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+@dataclasses.dataclass
+class _Circuit:
+    state: CircuitState = CircuitState.CLOSED
+    n_failures: int = 0
+    opened_at: float = 0.0
+    n_probes: int = 0
+
+
+def _always(e: BaseException) -> bool:
+    return True
+
+
+class CircuitBreaker:
+    """
+    A thread-safe circuit breaker, each key has its own circuit.
+
+    :param failure_threshold: number of consecutive failures to open the circuit.
+    :param recovery_timeout: seconds to wait in the open state before
+        letting a probe call through.
+    :param half_open_max_calls: max number of concurrent probe calls in the
+        half open state.
+    :param is_failure: a function that decides whether an exception counts as
+        a failure of the target. If None, the caller's default of
+        :meth:`on_error` is used, in :meth:`call` every exception is a failure.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1,
+        is_failure: T.Optional[T.Callable[[BaseException], bool]] = None,
+        clock: T.Callable[[], float] = time.monotonic,
+    ):
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be greater than 0")
+        if half_open_max_calls < 1:
+            raise ValueError("half_open_max_calls must be greater than 0")
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.is_failure = is_failure
+        self.clock = clock
+        self._circuits: T.Dict[str, _Circuit] = dict()
+        self._listeners: T.List[Listener] = list()
+        self._lock = threading.Lock()
+        self.n_rejected = 0
+        self.n_transitions: T.Dict[CircuitState, int] = {
+            state: 0 for state in CircuitState
+        }
+
+    def add_listener(self, listener: Listener):
+        """
+        Register a ``listener(key, old_state, new_state)`` callback, it is
+        called on every state transition.
+        """
+        self._listeners.append(listener)
+
+    def _transit(
+        self,
+        key: str,
+        circuit: _Circuit,
+        state: CircuitState,
+        events: list,
+    ):
+        # must be called with the lock held, the listeners are called later
+        # without the lock
+        events.append((key, circuit.state, state))
+        self.n_transitions[state] += 1
+        circuit.state = state
+        if state is CircuitState.OPEN:
+            circuit.opened_at = self.clock()
+        circuit.n_failures = 0
+        circuit.n_probes = 0
+
+    def _emit(self, events: list):
+        for key, old, new in events:
+            for listener in self._listeners:
+                listener(key, old, new)
+
+    def get_state(self, key: str) -> CircuitState:
+        """
+        Return the current state of the circuit, an open circuit whose recovery
+        timeout has passed is reported as half open.
+        """
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                return CircuitState.CLOSED
+            if (
+                circuit.state is CircuitState.OPEN
+                and self.clock() - circuit.opened_at >= self.recovery_timeout
+            ):
+                return CircuitState.HALF_OPEN
+            return circuit.state
+
+    def before_call(self, key: str):
+        """
+        Check if the call is allowed, raise
+        :class:`~acore_soap_app.exc.CircuitOpenError` if not. Every allowed call
+        must be followed by :meth:`on_success` or :meth:`on_failure`.
+        """
+        events = list()
+        try:
+            with self._lock:
+                try:
+                    circuit = self._circuits[key]
+                except KeyError:
+                    circuit = _Circuit()
+                    self._circuits[key] = circuit
+                if circuit.state is CircuitState.OPEN:
+                    elapsed = self.clock() - circuit.opened_at
+                    if elapsed < self.recovery_timeout:
+                        self.n_rejected += 1
+                        raise CircuitOpenError(key, self.recovery_timeout - elapsed)
+                    self._transit(key, circuit, CircuitState.HALF_OPEN, events)
+                if circuit.state is CircuitState.HALF_OPEN:
+                    if circuit.n_probes >= self.half_open_max_calls:
+                        self.n_rejected += 1
+                        raise CircuitOpenError(key, 0.0)
+                    circuit.n_probes += 1
+        finally:
+            self._emit(events)
+
+    def on_success(self, key: str):
+        """
+        Record a successful call.
+        """
+        events = list()
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:  # reset during the call
+                return
+            if circuit.state is CircuitState.HALF_OPEN:
+                self._transit(key, circuit, CircuitState.CLOSED, events)
+            else:
+                circuit.n_failures = 0
+        self._emit(events)
+
+    def on_failure(self, key: str):
+        """
+        Record a failed call.
+        """
+        events = list()
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:  # reset during the call
+                return
+            if circuit.state is CircuitState.HALF_OPEN:
+                self._transit(key, circuit, CircuitState.OPEN, events)
+            elif circuit.state is CircuitState.CLOSED:
+                circuit.n_failures += 1
+                if circuit.n_failures >= self.failure_threshold:
+                    self._transit(key, circuit, CircuitState.OPEN, events)
+        self._emit(events)
+
+    def on_error(
+        self,
+        key: str,
+        e: BaseException,
+        is_failure: T.Callable[[BaseException], bool] = _always,
+    ):
+        """
+        Record a call that raised ``e``. It is a failure if the ``is_failure``
+        of the breaker says so, or the caller's default ``is_failure`` if the
+        breaker doesn't have one.
+        """
+        if self.is_failure is not None:
+            is_failure = self.is_failure
+        if is_failure(e):
+            self.on_failure(key)
+        else:
+            # the target did respond, e.g. an application level error
+            self.on_success(key)
+
+    def call(self, key: str, func: T.Callable[[], ResultT]) -> ResultT:
+        """
+        Call ``func`` through the circuit of ``key``.
+        """
+        self.before_call(key)
+        try:
+            result = func()
+        except Exception as e:
+            self.on_error(key, e)
+            raise
+        self.on_success(key)
+        return result
+
+    def reset(self, key: T.Optional[str] = None):
+        """
+        Forget the state of a circuit, or all circuits if ``key`` is None.
+        """
+        with self._lock:
+            if key is None:
+                self._circuits.clear()
+            else:
+                self._circuits.pop(key, None)
+
+    def stats(self) -> T.Dict[str, T.Any]:
+        """
+        Return the transition and rejection counters, and the state of each
+        circuit that is not closed.
+        """
+        with self._lock:
+            return {
+                "rejected": self.n_rejected,
+                "opened": self.n_transitions[CircuitState.OPEN],
+                "half_opened": self.n_transitions[CircuitState.HALF_OPEN],
+                "closed": self.n_transitions[CircuitState.CLOSED],
+                "not_closed": {
+                    key: circuit.state.value
+                    for key, circuit in self._circuits.items()
+                    if circuit.state is not CircuitState.CLOSED
+                },
+            }
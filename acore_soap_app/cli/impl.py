@@ -2,18 +2,29 @@
 
 """
 Command line low lever implementations.
+
+每一个 GM 命令在 SSM 中都是一次独立的 ``acsoap gm`` 调用, 所以启动时间非常关键. 本模块只在
+顶层 import 标准库和轻量的模块, boto3, requests, SDK 等较重的依赖都在用到它们的函数内部
+才 import, 这样每个子命令只加载它自己需要的东西. 例如 daemon 存在时的 ``acsoap gm``
+完全不需要 import requests 和 boto3.
 """
 
 import typing as T
+import sys
 import json
+import time
+import logging
+import functools
 from datetime import datetime, timezone
 
-from simple_aws_ec2.api import EC2MetadataCache
-from acore_constants.api import TagKey
+from ..agent.concurrency import DEFAULT_TARGET_LATENCY
+from ..timing import HistogramCollector, add_collector, remove_collector
+from .. import metrics
 
-from ..agent.api import SOAPRequest, SOAPResponse
-from ..sdk.api import canned
-from ..exc import SOAPCommandFailedError
+if T.TYPE_CHECKING:  # pragma: no cover
+    from ..agent.impl import SOAPRequest
+    from ..agent.transport import SOAPTransport
+    from ..agent.ratelimit import RateLimiter
 
 
 def ensure_ec2_environment():
@@ -21,21 +32,235 @@ def ensure_ec2_environment():
         raise EnvironmentError("This is not a EC2 environment")
 
 
-def ensure_response_succeeded(
-    request: SOAPRequest,
-    response: SOAPResponse,
-    raises: bool,
-) -> SOAPResponse:
-    if response.succeeded:
-        return response
-    else:
-        if raises:
-            raise SOAPCommandFailedError(
-                f"request failed: {request.command!r}, "
-                f"response: {response.message!r}"
+def get_s3_client():
+    from simple_aws_ec2.api import EC2MetadataCache
+
+    boto_ses = EC2MetadataCache.load().get_boto_ses_from_ec2_inside()
+    return boto_ses.client("s3")
+
+
+def print_err(line: str):
+    print(line, file=sys.stderr)
+
+
+def setup_logging():
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="%(asctime)s %(name)s %(message)s",
+    )
+
+
+def write_bounded_stdout(
+    json_strs: T.Iterable[str],
+    overflow: str,
+    get_s3_client: T.Callable[[], T.Any] = get_s3_client,
+    out: T.Callable[[str], None] = print,
+    max_size: T.Optional[int] = None,
+):
+    """
+    把 JSON Lines 输出到 stdout, 并且保证输出不会超过 ``max_size`` 个字符. SSM Run
+    Command 只会返回 stdout 的前 24,000 个字符, 超出的部分会被悄悄地截断.
+
+    1. 如果所有的行加起来不超过 ``max_size``, 则原样逐行输出.
+    2. 否则把所有的行用 :func:`~acore_soap_app.agent.impl.encode_inline` 压缩成一行
+       ``b64gz:...`` 输出. SOAP 的 XML body 重复度很高, 通常可以压缩到十分之一以下.
+    3. 如果压缩之后仍然太大, 并且 ``overflow`` 是一个 S3 uri, 则把 JSON Lines 写入
+       这个 S3 uri, stdout 只输出这个 S3 uri. 如果 ``overflow`` 是 ``"inline"``,
+       则仍然输出压缩之后的结果, 由 SDK 检测到截断并报错.
+
+    SDK 端的 :func:`~acore_soap_app.sdk.core.run_soap_command` 会自动识别这三种输出.
+    因为要知道输出的总大小, 所有的结果会先缓存在内存中. 如果 ``json_strs`` 在中途抛出
+    异常 (例如 ``raises=True`` 时遇到失败的命令), 已经得到的结果仍然会按照上面的规则输出,
+    然后再重新抛出这个异常, 因为这些 GM 命令已经执行过了.
+
+    :param overflow: ``"inline"`` 或者一个 S3 uri.
+    :param max_size: 默认为 :data:`~acore_soap_app.agent.impl.MAX_STDOUT_SIZE`.
+    """
+    from ..agent.impl import MAX_STDOUT_SIZE, OVERFLOW_INLINE
+
+    if max_size is None:
+        max_size = MAX_STDOUT_SIZE
+    if not (overflow == OVERFLOW_INLINE or overflow.startswith("s3://")):
+        raise ValueError(
+            f"overflow must be {OVERFLOW_INLINE!r} or a S3 uri, not {overflow!r}"
+        )
+    lines = list()
+    size = 0
+    try:
+        for json_str in json_strs:
+            lines.append(json_str)
+            size += len(json_str) + 1
+    except Exception:
+        _write_bounded_lines(lines, size, overflow, get_s3_client, out, max_size)
+        raise
+    _write_bounded_lines(lines, size, overflow, get_s3_client, out, max_size)
+
+
+def _write_bounded_lines(
+    lines: T.List[str],
+    size: int,
+    overflow: str,
+    get_s3_client: T.Callable[[], T.Any],
+    out: T.Callable[[str], None],
+    max_size: int,
+):
+    from ..agent.impl import OVERFLOW_INLINE, encode_inline
+    from ..utils import write_json_objects
+
+    if size <= max_size:
+        for line in lines:
+            out(line)
+        return
+    inline = encode_inline(lines)
+    if len(inline) <= max_size or overflow == OVERFLOW_INLINE:
+        out(inline)
+        return
+    write_json_objects(
+        s3_client=get_s3_client(),
+        s3uri=overflow,
+        json_strs=lines,
+    )
+    out(overflow)
+
+
+def run_gm(
+    request_like: T.Union[
+        str,
+        T.List[str],
+        "SOAPRequest",
+        T.List["SOAPRequest"],
+    ],
+    username: T.Optional[str] = None,
+    password: T.Optional[str] = None,
+    raises: bool = True,
+    s3uri_output: T.Optional[str] = None,
+    workers: int = 1,
+    keep_body: bool = True,
+    qps: T.Optional[float] = None,
+    burst: T.Optional[float] = None,
+    adaptive: bool = False,
+    target_latency: float = DEFAULT_TARGET_LATENCY,
+    latency_stats: bool = False,
+    metrics_file: T.Optional[str] = None,
+    overflow: T.Optional[str] = None,
+    get_s3_client: T.Callable[[], T.Any] = get_s3_client,
+    transport: T.Optional["SOAPTransport"] = None,
+    get_rate_limiter: T.Optional[T.Callable[..., "RateLimiter"]] = None,
+    out: T.Callable[[str], None] = print,
+    err: T.Callable[[str], None] = print_err,
+):
+    """
+    :func:`gm` 在当前进程内执行的底层实现, 也是 ``acsoap serve`` daemon 的 ``gm`` handler.
+
+    :param get_s3_client: 返回 S3 client 的函数, 只有在需要读写 S3 的时候才会被调用.
+    :param transport: 使用的 :class:`~acore_soap_app.agent.transport.SOAPTransport`,
+        如果为 None 则使用默认的. 如果指定了 ``qps``, 则复用它的连接池并加上限流.
+    :param get_rate_limiter: 以 ``rate``, ``burst`` 为参数返回
+        :class:`~acore_soap_app.agent.ratelimit.RateLimiter` 的函数, daemon 用它在多次
+        调用之间共享同一个限流. 如果为 None 则每次创建一个新的.
+    :param out: 输出一行到 stdout 的函数.
+    :param err: 输出一行到 stderr 的函数.
+
+    其他参数请参考 :func:`gm`.
+    """
+    from ..agent.impl import SOAPRequest, SOAPResponse
+    from ..agent.batch import BatchExecutor
+    from ..agent.transport import get_default_transport, DEFAULT_POOL_MAXSIZE
+    from ..agent.ratelimit import RateLimiter
+    from ..agent.concurrency import AIMDController
+
+    if metrics_file is not None:
+        metrics.enable_metrics()
+
+    # handle input
+    s3_client = None
+    is_s3_input = isinstance(request_like, str) and request_like.startswith("s3://")
+    if is_s3_input or (s3uri_output is not None):
+        s3_client = get_s3_client()
+    requests = SOAPRequest.batch_iter(
+        request_like=request_like,
+        username=username,
+        password=password,
+        s3_client=s3_client,
+    )
+    if not is_s3_input:
+        # the input is already in memory, with a list the executor knows how
+        # many requests are skipped on failure
+        requests = list(requests)
+
+    # run, requests are loaded, sent and written out one by one, so the memory
+    # usage doesn't grow with the batch size
+    rate_limiter = None
+    own_transport = None
+    if qps is not None:
+        if get_rate_limiter is None:
+            get_rate_limiter = RateLimiter
+        rate_limiter = get_rate_limiter(rate=qps, burst=burst)
+        if transport is None:
+            # keep the settings and the circuit breaker of the default transport
+            transport = own_transport = get_default_transport().with_pool_maxsize(
+                max(workers, DEFAULT_POOL_MAXSIZE)
             )
+            transport.rate_limiter = rate_limiter
         else:
-            return response
+            transport = transport.with_rate_limiter(rate_limiter)
+    controller = None
+    if adaptive:
+        controller = AIMDController(
+            floor=1,
+            ceiling=workers,
+            target_latency=target_latency,
+        )
+    executor = BatchExecutor(
+        workers=workers,
+        raises=raises,
+        transport=transport,
+        keep_body=keep_body,
+        adaptive=controller,
+    )
+    responses = (response for _, response in executor.run(requests))
+
+    collector = None
+    if latency_stats:
+        collector = HistogramCollector()
+        add_collector(collector)
+    start = time.perf_counter()
+
+    # handle output
+    try:
+        if s3uri_output is not None:
+            SOAPResponse.batch_dump_to_s3(
+                s3_client=s3_client,
+                instances=responses,
+                s3uri=s3uri_output,
+            )
+        elif overflow is None:
+            for response in responses:
+                out(response.to_json())
+        else:
+            write_bounded_stdout(
+                json_strs=(response.to_json() for response in responses),
+                overflow=overflow,
+                get_s3_client=get_s3_client,
+                out=out,
+            )
+    finally:
+        if own_transport is not None:
+            own_transport.close()
+        if executor.n_skipped != 0:
+            err(executor.format_skipped())
+        if rate_limiter is not None:
+            err(f"rate limit: {json.dumps(rate_limiter.stats())}")
+        if controller is not None:
+            err(f"adaptive concurrency: {json.dumps(controller.stats())}")
+        if collector is not None:
+            remove_collector(collector)
+            err(f"elapsed: {time.perf_counter() - start:.3f}s")
+            for line in collector.format_summary().splitlines():
+                err(line)
+        if metrics_file is not None:
+            metrics.write_textfile(metrics.get_registry(), metrics_file)
 
 
 def gm(
@@ -49,6 +274,16 @@ def gm(
     password: T.Optional[str] = None,
     raises: bool = True,
     s3uri_output: T.Optional[str] = None,
+    workers: int = 1,
+    keep_body: bool = True,
+    qps: T.Optional[float] = None,
+    burst: T.Optional[float] = None,
+    adaptive: bool = False,
+    target_latency: float = DEFAULT_TARGET_LATENCY,
+    latency_stats: bool = False,
+    metrics_file: T.Optional[str] = None,
+    overflow: T.Optional[str] = None,
+    daemon: bool = True,
 ):
     """
     运行一个或多个 GM 命令. 例如 ``.server info``.
@@ -60,36 +295,131 @@ def gm(
         failed SOAP Response 原封不动地返回.
     :param s3uri_output: 可选参数, 如果为 None, 则将
         :class:`~acore_soap_app.agent.impl.SOAPResponse` 对象转换为 JSON 并打印.
-        如果给定, 则将 JSON 保存到 S3 中. 常用于返回结果特别大的情况.
+        如果给定, 则将 JSON 保存到 S3 中. 常用于返回结果特别大的情况. 如果以 ``.jsonl``
+        结尾, 则使用 JSON Lines 格式增量地写入. 如果以 ``.gz`` 或 ``.zst`` 结尾,
+        则同时进行压缩.
+    :param workers: 并发执行的线程数, 默认为 1, 也就是按顺序一个个执行. 无论是否并发,
+        输出的顺序都和输入的顺序一致. 如果 ``raises=True``, 在遇到第一个失败的命令后就不再
+        发送新的命令, 被跳过的命令数量会打印到 stderr.
+    :param keep_body: 默认为 True. 如果为 False, 则输出的
+        :class:`~acore_soap_app.agent.impl.SOAPResponse` 中不包含原始的 XML body,
+        可以大幅减少输出的大小.
+    :param qps: 可选参数, 每秒最多发送多少个 GM 命令, 用于保护 worldserver 的 SOAP 线程.
+        等待时间的统计会打印到 stderr. 请参考 :class:`~acore_soap_app.agent.ratelimit.RateLimiter`.
+        如果由 daemon 执行, 则 ``qps`` 相同的调用共享同一个限流, 统计是累计值.
+    :param burst: 限流允许的最大突发量, 默认和 ``qps`` 相同.
+    :param adaptive: 默认为 False. 如果为 True, 则根据测量到的延迟和失败率在 1 和
+        ``workers`` 之间自动调整并发数, 调整的汇总会打印到 stderr. 请参考
+        :class:`~acore_soap_app.agent.concurrency.AIMDController`.
+    :param target_latency: ``adaptive=True`` 时, 单个命令可接受的平均延迟 (秒).
+    :param latency_stats: 默认为 False. 如果为 True, 则把每个阶段 (构造请求, HTTP,
+        解析, S3 读写等) 耗时的 p50 / p95 / p99 统计打印到 stderr. 请参考
+        :mod:`acore_soap_app.timing`.
+    :param metrics_file: 可选参数, 执行结束后把 Prometheus 格式的 metrics 写入这个文件,
+        用于 node_exporter 的 textfile collector. 如果由 daemon 执行, 则 metrics 是
+        daemon 启动以来的累计值. 请参考 :mod:`acore_soap_app.metrics`.
+    :param overflow: 可选参数, 只在 ``s3uri_output`` 为 None 时有效. 如果给定, 则保证
+        stdout 不超过 SSM 能返回的大小: 输出太大时会被压缩成一行, 如果压缩后仍然太大,
+        并且 ``overflow`` 是一个 S3 uri, 则写入 S3. 请参考 :func:`write_bounded_stdout`.
+    :param daemon: 默认为 True. 如果 ``acsoap serve`` daemon 正在运行, 则交给 daemon
+        执行, 否则在当前进程内执行.
     """
     ensure_ec2_environment()
-
-    # handle input
-    boto_ses = EC2MetadataCache.load().get_boto_ses_from_ec2_inside()
-    s3_client = boto_ses.client("s3")
-    requests = SOAPRequest.batch_load(
+    kwargs = dict(
         request_like=request_like,
         username=username,
         password=password,
-        s3_client=s3_client,
+        raises=raises,
+        s3uri_output=s3uri_output,
+        workers=workers,
+        keep_body=keep_body,
+        qps=qps,
+        burst=burst,
+        adaptive=adaptive,
+        target_latency=target_latency,
+        latency_stats=latency_stats,
+        metrics_file=metrics_file,
+        overflow=overflow,
+    )
+    # only plain commands and S3 uri can be sent to the daemon as JSON
+    is_plain = isinstance(request_like, str) or (
+        isinstance(request_like, list)
+        and all(isinstance(command, str) for command in request_like)
     )
+    if daemon and is_plain:
+        from ..agent.daemon import DaemonClient, DaemonUnavailableError
 
-    # run
-    responses = [
-        ensure_response_succeeded(request, request.send(), raises=raises)
-        for request in requests
-    ]
+        try:
+            DaemonClient().call("gm", kwargs, out=print, err=print_err)
+            return
+        except DaemonUnavailableError:
+            pass
+    if adaptive:
+        setup_logging()
+    run_gm(**kwargs)
 
-    # handle output
-    if s3uri_output is None:
-        print("\n".join([response.to_json() for response in responses]))
-    else:
-        SOAPResponse.batch_dump_to_s3(
-            s3_client=s3_client,
-            instances=responses,
-            s3uri=s3uri_output,
+
+def serve(
+    socket_path: T.Optional[str] = None,
+    metrics_port: T.Optional[int] = None,
+    metrics_host: str = "127.0.0.1",
+):
+    """
+    启动 ``acsoap serve`` daemon, 它持有预热好的 SOAP 连接池和 S3 client, 通过本地的
+    Unix socket 接收 :func:`gm` 请求. 请参考 :mod:`acore_soap_app.agent.daemon`.
+
+    :param socket_path: Unix socket 的路径, 默认为 ``$ACSOAP_SOCKET`` 或者
+        ``/tmp/acsoap.sock``.
+    :param metrics_port: 可选参数, 如果给定, 则在这个端口上提供 Prometheus 的
+        ``/metrics`` endpoint. 请参考 :class:`~acore_soap_app.metrics.MetricsServer`.
+    :param metrics_host: metrics endpoint 监听的地址, 默认只监听本机.
+    """
+    from ..agent.transport import SOAPTransport, DEFAULT_POOL_MAXSIZE
+    from ..agent.ratelimit import RateLimiter
+    from ..agent.daemon import AgentDaemon
+
+    ensure_ec2_environment()
+    setup_logging()
+    transport = SOAPTransport(pool_maxsize=DEFAULT_POOL_MAXSIZE)
+    get_warm_s3_client = functools.lru_cache(maxsize=1)(get_s3_client)
+    # create the AWS client before serving the first request
+    get_warm_s3_client()
+    # the gm calls with the same qps share one rate limiter, so that concurrent
+    # clients can't exceed the limit of the worldserver together
+    get_shared_rate_limiter = functools.lru_cache(maxsize=32)(RateLimiter)
+
+    def handle_gm(args: dict, out, err):
+        run_gm(
+            **args,
+            get_s3_client=get_warm_s3_client,
+            transport=transport,
+            get_rate_limiter=get_shared_rate_limiter,
+            out=out,
+            err=err,
         )
 
+    daemon = AgentDaemon(handlers={"gm": handle_gm}, socket_path=socket_path)
+    daemon.bind()
+    print_err(f"acsoap daemon is listening on {daemon.socket_path}")
+    metrics_server = None
+    if metrics_port is not None:
+        metrics.enable_metrics()
+        metrics_server = metrics.MetricsServer(
+            metrics.get_registry(), host=metrics_host, port=metrics_port
+        )
+        metrics_server.start()
+        print_err(
+            f"metrics are served on http://{metrics_host}:{metrics_server.port}/metrics"
+        )
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:  # pragma: no cover
+        pass
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+        transport.close()
+
 
 def _count_online_players(
     username: T.Optional[str] = None,
@@ -109,6 +439,9 @@ def _count_online_players(
             "server_is_online": True,
         }
     """
+    from ..agent.impl import SOAPRequest
+    from ..sdk.canned.impl import extract_online_players
+
     requests = SOAPRequest.batch_load(
         request_like=".server info",
         username=username,
@@ -117,7 +450,7 @@ def _count_online_players(
     request = requests[0]
     try:
         response = request.send()
-        connected_players, characters_in_world = canned.extract_online_players(
+        connected_players, characters_in_world = extract_online_players(
             response.message
         )
         return {
@@ -153,6 +486,7 @@ def measure_server_status(
     """
     from boto_session_manager import BotoSesManager
     from simple_aws_ec2.api import Ec2Instance
+    from acore_constants.api import TagKey
 
     data = _count_online_players(username=username, password=password)
     now = datetime.utcnow().replace(tzinfo=timezone.utc)
@@ -4,16 +4,12 @@
 SOAP Agent command line user interface.
 
 See :class:`Command` for details.
+
+``fire`` and :mod:`acore_soap_app.cli.impl` are imported lazily, so that each
+sub command only pays the import cost of what it uses.
 """
 
 import typing as T
-import fire
-
-from .impl import (
-    gm,
-    count_online_players,
-    measure_server_status,
-)
 
 
 class Canned:
@@ -35,6 +31,8 @@ class Canned:
 
             acsoap canned count-online-players
         """
+        from .impl import count_online_players
+
         count_online_players(
             username=user,
             password=pwd,
@@ -54,13 +52,14 @@ class Canned:
 
             acsoap canned measure-server-status
         """
+        from .impl import measure_server_status
+
         measure_server_status(
             username=user,
             password=pwd,
         )
 
 
-
 class Command:
     """
     Acore Soap Agent command line interface. All these commands can only be
@@ -83,6 +82,16 @@ class Command:
         pwd: T.Optional[str] = None,
         raises: bool = True,
         s3uri: T.Optional[str] = None,
+        workers: int = 1,
+        keep_body: bool = True,
+        qps: T.Optional[float] = None,
+        burst: T.Optional[float] = None,
+        adaptive: bool = False,
+        target_latency: float = 0.5,
+        latency_stats: bool = False,
+        metrics_file: T.Optional[str] = None,
+        overflow: T.Optional[str] = None,
+        daemon: bool = True,
     ):
         """
         Run single GM command. See :func:`acore_soap_app.cli.impl.gm` for implementation
@@ -98,21 +107,104 @@ class Command:
 
             acsoap gm ".server info" --s3uri s3://bucket/output.json
 
+            acsoap gm s3://bucket/input.json --workers 8
+
+            acsoap gm s3://bucket/input.json --workers 8 --qps 50 --burst 10
+
+            acsoap gm s3://bucket/input.json --workers 32 --adaptive --target_latency 0.2
+
+            acsoap gm s3://bucket/input.json --workers 8 --latency_stats
+
+            acsoap gm ".server info" --metrics_file /var/lib/node_exporter/acsoap.prom
+
+            acsoap gm ".server info" --nodaemon
+
+            acsoap gm s3://bucket/input.json --overflow s3://bucket/output.jsonl.gz
+
         :param cmd: the GM command to run
         :param user: in game GM account username, if not given, then use "admin"
         :param pwd: in game GM account password, if not given, then use "admin"
         :param raises: raise error if any of the GM command failed.
         :param s3uri: if None, then return the response as JSON, otherwise, save
             the response to S3.
+        :param workers: number of threads to run the batch concurrently,
+            responses are still returned in input order.
+        :param keep_body: if False, don't include the raw XML body in the
+            response JSON.
+        :param qps: if given, limit the number of GM commands per second sent
+            to the worldserver.
+        :param burst: the max burst size of the rate limit, default to ``qps``.
+        :param adaptive: if True, tune the concurrency between 1 and ``workers``
+            from the measured latency and fault rate.
+        :param target_latency: the acceptable mean latency in seconds when
+            ``adaptive`` is True.
+        :param latency_stats: if True, print the p50 / p95 / p99 latency of each
+            phase (build, http, parse, s3 ...) to stderr. It is not named
+            ``stats`` because ``-s`` is the short flag of ``--s3uri``.
+        :param metrics_file: if given, write the Prometheus metrics to this
+            file for the node_exporter textfile collector.
+        :param overflow: ``inline`` or a S3 uri. If given, keep the stdout under
+            the SSM output limit by compressing it, or by writing it to this
+            S3 uri and only printing the uri.
+        :param daemon: if True (default), send the request to the ``acsoap serve``
+            daemon when it is running, otherwise run it in this process.
         """
+        from .impl import gm
+
         gm(
             request_like=cmd,
             username=user,
             password=pwd,
             raises=raises,
             s3uri_output=s3uri,
+            workers=workers,
+            keep_body=keep_body,
+            qps=qps,
+            burst=burst,
+            adaptive=adaptive,
+            target_latency=target_latency,
+            latency_stats=latency_stats,
+            metrics_file=metrics_file,
+            overflow=overflow,
+            daemon=daemon,
+        )
+
+    def serve(
+        self,
+        socket: T.Optional[str] = None,
+        metrics_port: T.Optional[int] = None,
+        metrics_host: str = "127.0.0.1",
+    ):
+        """
+        Run the resident agent daemon, ``acsoap gm`` uses it automatically when
+        it is running. See :func:`acore_soap_app.cli.impl.serve` for
+        implementation details.
+
+        Example::
+
+            acsoap serve
+
+            acsoap serve --socket /tmp/acsoap.sock
+
+            acsoap serve --metrics_port 9101
+
+        :param socket: the Unix socket path, default to ``$ACSOAP_SOCKET`` or
+            ``/tmp/acsoap.sock``.
+        :param metrics_port: if given, serve the Prometheus ``/metrics``
+            endpoint on this port.
+        :param metrics_host: the address of the metrics endpoint, default to
+            ``127.0.0.1``.
+        """
+        from .impl import serve
+
+        serve(
+            socket_path=socket,
+            metrics_port=metrics_port,
+            metrics_host=metrics_host,
         )
 
 
 def run():
+    import fire
+
     fire.Fire(Command)
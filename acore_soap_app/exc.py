@@ -33,6 +33,13 @@ class RunCommandError(SystemError):
         return cls(msg)
 
 
+class SSMOutputTruncatedError(RunCommandError):
+    """
+    raises when the stdout of the SSM Run Command is truncated, SSM only
+    returns the first 24,000 characters of it.
+    """
+
+
 class SOAPResponseParseError(ValueError):
     """
     raises when failed to parse the soap response.
@@ -43,3 +50,23 @@ class SOAPCommandFailedError(ValueError):
     """
     raises when SOAP command failed
     """
+
+
+class CircuitOpenError(SystemError):
+    """
+    raises when the circuit breaker of the target is open, the call is rejected
+    without being sent. See :class:`~acore_soap_app.circuit_breaker.CircuitBreaker`.
+    """
+
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(
+            f"circuit of {key!r} is open, retry after {retry_after:.1f} seconds"
+        )
+        self.key = key
+        self.retry_after = retry_after
+
+
+class AgentDaemonError(SystemError):
+    """
+    raises when the ``acsoap serve`` daemon fails to handle a request.
+    """
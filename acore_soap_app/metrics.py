@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+
+"""
+Prometheus metrics for the agent and the SDK.
+
+我们运行着很多 worldserver, 需要用 Prometheus 抓取每个 SOAP endpoint 的健康状况和吞吐量.
+本模块实现了一个不依赖任何第三方库的 metrics registry, 支持 counter, gauge 和 histogram,
+并以 Prometheus text format (0.0.4) 导出:
+
+- :func:`write_textfile`: 原子地写入一个文件, 用于 node_exporter 的 textfile collector.
+- :class:`MetricsServer`: 一个在后台线程中运行的 HTTP endpoint, 提供 ``/metrics``.
+
+Metrics 默认是关闭的, 调用 :func:`enable_metrics` 之后, 以下位置才会更新 metrics:
+
+- :meth:`~acore_soap_app.agent.impl.SOAPRequest.send`: 请求数, 成功数, fault 数,
+  网络错误数, 延迟, 以及在途请求数, 以 ``host:port`` 为 label.
+- :meth:`~acore_soap_app.agent.impl.SOAPResponse.parse`: 解析失败的次数.
+- :func:`~acore_soap_app.sdk.core.run_soap_command`: SSM Run Command 的次数, 结果,
+  延迟, 以及在途数量, 以 ``server_id`` 为 label.
+- :mod:`acore_soap_app.timing` 中每个阶段的耗时.
+
+Usage example:
+
+.. code-block:: python
+
+    >>> from acore_soap_app.metrics import enable_metrics, write_textfile, MetricsServer
+    >>> registry = enable_metrics()
+    >>> ... # send some requests
+    >>> write_textfile(registry, "/var/lib/node_exporter/textfile/acsoap.prom")
+    >>> MetricsServer(registry, port=9101).start()
+"""
+
+import typing as T
+import os
+import math
+import threading
+
+from .timing import Collector, add_collector, remove_collector
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+#: Default latency buckets in seconds, from a fast local SOAP call to a slow
+#: SSM Run Command.
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+LabelValues = T.Tuple[str, ...]
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: T.Sequence[str], values: T.Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """
+    Base class of the metrics, thread-safe.
+
+    :param name: the metric name, e.g. ``acsoap_soap_requests_total``.
+    :param documentation: the ``# HELP`` text.
+    :param labelnames: the label names, the values are given as keyword
+        arguments when the metric is updated.
+    """
+
+    type: str = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: T.Sequence[str] = (),
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: T.Dict[str, str]) -> LabelValues:
+        if len(labels) != len(self.labelnames) or not all(
+            name in labels for name in self.labelnames
+        ):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> T.Iterator[T.Tuple[str, str, float]]:  # pragma: no cover
+        """
+        Yield ``(name_suffix, labels, value)`` tuples.
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing counter.
+    """
+
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: T.Dict[LabelValues, float] = dict()
+
+    def inc(self, amount: float = 1, **labels: str):
+        if amount < 0:
+            raise ValueError("counter can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield "", _format_labels(self.labelnames, key), value
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down.
+    """
+
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """
+    A histogram with cumulative buckets.
+
+    :param buckets: the upper bounds of the buckets, ``+Inf`` is added
+        automatically.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: T.Sequence[str] = (),
+        buckets: T.Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        buckets = sorted(buckets)
+        if not buckets or buckets[-1] != math.inf:
+            buckets.append(math.inf)
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts (not cumulative)..., sum]
+        self._values: T.Dict[LabelValues, T.List[float]] = dict()
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            try:
+                counts = self._values[key]
+            except KeyError:
+                counts = [0] * (len(self.buckets) + 1)
+                self._values[key] = counts
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def get_count(self, **labels: str) -> int:
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            return sum(counts[:-1]) if counts else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(
+                    self.labelnames + ("le",), key + (_format_value(bound),)
+                )
+                yield "_bucket", labels, cumulative
+            labels = _format_labels(self.labelnames, key)
+            yield "_sum", labels, counts[-1]
+            yield "_count", labels, cumulative
+
+
+MetricT = T.TypeVar("MetricT", bound=Metric)
+
+
+class MetricsRegistry:
+    """
+    A collection of metrics that are rendered together.
+    """
+
+    def __init__(self):
+        self._metrics: T.Dict[str, Metric] = dict()
+        self._lock = threading.Lock()
+
+    def register(self, metric: MetricT) -> MetricT:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name!r} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Metric:
+        return self._metrics[name]
+
+    def render(self) -> str:
+        """
+        Render all the metrics in the Prometheus text format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+
+def write_textfile(registry: MetricsRegistry, path: str):
+    """
+    Atomically write the metrics to ``path``, for the node_exporter textfile
+    collector. The file is written to a temp file in the same directory and
+    then renamed, so the collector never sees a partial file.
+    """
+    import tempfile
+
+    dir_path = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix=".acsoap-", suffix=".prom")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(registry.render())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _new_http_server(registry: MetricsRegistry, host: str, port: int):
+    # http.server is only imported when the endpoint is used
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):  # pragma: no cover
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+
+    return Server((host, port), RequestHandler)
+
+
+class MetricsServer:
+    """
+    Serve ``GET /metrics`` in a background thread.
+
+    :param registry: the registry to expose.
+    :param host: the address to bind, the default only accepts local scrapes.
+    :param port: the port to bind, 0 means a random free port.
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        host: str = "127.0.0.1",
+        port: int = 9101,
+    ):
+        self._server = _new_http_server(registry, host, port)
+        self._thread: T.Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> "MetricsServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "MetricsServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+# ------------------------------------------------------------------------------
+# acsoap metrics
+# ------------------------------------------------------------------------------
+class AgentMetrics:
+    """
+    The metrics updated by the agent, labeled by the ``host:port`` endpoint.
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.requests = registry.register(
+            Counter(
+                "acsoap_soap_requests_total",
+                "Number of SOAP requests sent.",
+                ["endpoint"],
+            )
+        )
+        self.responses = registry.register(
+            Counter(
+                "acsoap_soap_responses_total",
+                "Number of SOAP responses by outcome, succeeded or fault.",
+                ["endpoint", "outcome"],
+            )
+        )
+        self.errors = registry.register(
+            Counter(
+                "acsoap_soap_errors_total",
+                "Number of SOAP requests that failed without a response, "
+                "e.g. connection errors and timeouts.",
+                ["endpoint"],
+            )
+        )
+        self.parse_errors = registry.register(
+            Counter(
+                "acsoap_soap_parse_errors_total",
+                "Number of SOAP responses that cannot be parsed.",
+            )
+        )
+        self.latency = registry.register(
+            Histogram(
+                "acsoap_soap_request_duration_seconds",
+                "Latency of SOAP requests.",
+                ["endpoint"],
+            )
+        )
+        self.in_flight = registry.register(
+            Gauge(
+                "acsoap_soap_requests_in_flight",
+                "Number of SOAP requests in flight.",
+                ["endpoint"],
+            )
+        )
+
+
+class SDKMetrics:
+    """
+    The metrics updated by the SDK, labeled by ``server_id``.
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.commands = registry.register(
+            Counter(
+                "acsoap_sdk_commands_total",
+                "Number of run_soap_command calls sent through SSM by outcome, "
+                "succeeded, failed (some GM commands failed), submitted (async "
+                "mode) or error.",
+                ["server_id", "outcome"],
+            )
+        )
+        self.latency = registry.register(
+            Histogram(
+                "acsoap_sdk_command_duration_seconds",
+                "Latency of run_soap_command calls sent through SSM.",
+                ["server_id"],
+            )
+        )
+        self.in_flight = registry.register(
+            Gauge(
+                "acsoap_sdk_commands_in_flight",
+                "Number of run_soap_command calls in flight.",
+                ["server_id"],
+            )
+        )
+
+
+class PhaseCollector(Collector):
+    """
+    A :mod:`~acore_soap_app.timing` collector that feeds the phase timings
+    into a histogram.
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.histogram = registry.register(
+            Histogram(
+                "acsoap_phase_duration_seconds",
+                "Time spent in each phase, see acore_soap_app.timing.",
+                ["phase"],
+            )
+        )
+
+    def record(self, phase: str, seconds: float):
+        self.histogram.observe(seconds, phase=getattr(phase, "value", phase))
+
+
+#: None unless :func:`enable_metrics` is called, read them as module attributes
+#: (``metrics.agent_metrics``) because they are replaced by enable / disable.
+agent_metrics: T.Optional[AgentMetrics] = None
+sdk_metrics: T.Optional[SDKMetrics] = None
+_registry: T.Optional[MetricsRegistry] = None
+_phase_collector: T.Optional[PhaseCollector] = None
+_enable_lock = threading.Lock()
+
+
+def get_registry() -> T.Optional[MetricsRegistry]:
+    """
+    Return the registry of the acsoap metrics, None if they are not enabled.
+    """
+    return _registry
+
+
+def enable_metrics() -> MetricsRegistry:
+    """
+    Start updating the acsoap metrics and return the registry. Calling it
+    again returns the same registry.
+    """
+    global agent_metrics, sdk_metrics, _registry, _phase_collector
+    with _enable_lock:
+        if _registry is None:
+            registry = MetricsRegistry()
+            agent_metrics = AgentMetrics(registry)
+            sdk_metrics = SDKMetrics(registry)
+            _phase_collector = PhaseCollector(registry)
+            add_collector(_phase_collector)
+            _registry = registry
+        return _registry
+
+
+def disable_metrics():
+    """
+    Stop updating the metrics and drop the registry.
+    """
+    global agent_metrics, sdk_metrics, _registry, _phase_collector
+    with _enable_lock:
+        if _phase_collector is not None:
+            remove_collector(_phase_collector)
+        agent_metrics = None
+        sdk_metrics = None
+        _registry = None
+        _phase_collector = None
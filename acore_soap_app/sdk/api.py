@@ -9,7 +9,18 @@ Example:
 
     >>> from acore_soap_app.sdk.api import canned
     >>> from acore_soap_app.sdk.api import run_soap_command
+    >>> from acore_soap_app.sdk.api import run_fleet_soap_command
+    >>> from acore_soap_app.sdk.api import ResponseCache
+    >>> from acore_soap_app.sdk.api import InstanceResolver
+    >>> from acore_soap_app.sdk.api import PollingStrategy
 """
 
 from .core import run_soap_command
+from .fleet import run_fleet_soap_command
+from .fleet import iter_fleet_soap_command
+from .cache import ResponseCache
+from .resolver import InstanceResolver
+from .polling import PollingStrategy
+from .singleflight import SingleFlight
+from .singleflight import AsyncSingleFlight
 from .canned import api as canned
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""
+Opt-in TTL response cache for read-only GM commands.
+
+每次 :func:`~acore_soap_app.sdk.core.run_soap_command` 都是一次完整的 SSM Run Command
+往返, 需要好几秒. 对于 ``.server info`` 这类只读的命令, 短时间内的结果是可以复用的.
+:class:`ResponseCache` 以 ``(server_id, command, username, password, keep_body)``
+为 key 缓存成功的 :class:`~acore_soap_app.agent.impl.SOAPResponse`.
+
+- 只有在白名单 (``ttls``) 中的命令才会被缓存, 每个命令有自己的 TTL (秒).
+  会修改服务器状态的命令永远不会被缓存.
+- 缓存满了之后按照 LRU 的顺序淘汰.
+- :attr:`ResponseCache.hits`, :attr:`ResponseCache.misses` 记录了命中情况.
+
+Usage example:
+
+.. code-block:: python
+
+    >>> from acore_soap_app.sdk.api import ResponseCache, canned
+    >>> cache = ResponseCache()
+    >>> canned.get_online_players(bsm, "sbx-blue", cache=cache) # SSM round trip
+    >>> canned.get_online_players(bsm, "sbx-blue", cache=cache) # from cache
+    >>> cache.stats()
+    {'size': 1, 'hits': 1, 'misses': 1, 'evictions': 0}
+"""
+
+import typing as T
+import time
+import threading
+import collections
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from ..agent.impl import SOAPRequest, SOAPResponse
+
+
+#: Known read-only GM commands and their default TTL in seconds.
+DEFAULT_TTLS: T.Dict[str, float] = {
+    ".server info": 10,
+    ".server motd": 60,
+    ".gm list": 60,
+    ".account onlinelist": 10,
+}
+DEFAULT_MAXSIZE = 256
+
+CacheKey = T.Tuple[T.Tuple[str, str, T.Optional[str], T.Optional[str], bool], ...]
+
+
+def normalize_command(command: str) -> str:
+    """
+    Normalize the GM command for allowlist lookup, the whitespaces are
+    collapsed and the command is lower cased.
+    """
+    return " ".join(command.split()).lower()
+
+
+def make_request_key(
+    server_id: str,
+    requests: T.Iterable["SOAPRequest"],
+    keep_body: bool = True,
+) -> CacheKey:
+    """
+    Build a hashable key that identifies a batch of requests on a server,
+    the credentials are part of the key. ``keep_body=False`` 的 response 不包含
+    body, 所以 ``keep_body`` 也是 key 的一部分.
+    """
+    return tuple(
+        (
+            server_id,
+            normalize_command(request.command),
+            request.username,
+            request.password,
+            keep_body,
+        )
+        for request in requests
+    )
+
+
+def is_read_only(
+    requests: T.Iterable["SOAPRequest"],
+    commands: T.Container[str] = DEFAULT_TTLS,
+) -> bool:
+    """
+    Check if all the requests are in the read-only ``commands`` allowlist.
+    """
+    n = 0
+    for request in requests:
+        if normalize_command(request.command) not in commands:
+            return False
+        n += 1
+    return n > 0
+
+
+class ResponseCache:
+    """
+    A thread-safe LRU cache of the SOAP responses with per-command TTL.
+
+    :param ttls: the allowlist of read-only commands, a mapping from the
+        command to its TTL in seconds. Default is :data:`DEFAULT_TTLS`.
+    :param maxsize: the max number of cached entries.
+    :param clock: the function that returns the current time in seconds.
+    """
+
+    def __init__(
+        self,
+        ttls: T.Optional[T.Dict[str, float]] = None,
+        maxsize: int = DEFAULT_MAXSIZE,
+        clock: T.Callable[[], float] = time.monotonic,
+    ):
+        if maxsize < 1:
+            raise ValueError("maxsize must be greater than 0")
+        if ttls is None:
+            ttls = DEFAULT_TTLS
+        self.ttls = {normalize_command(k): v for k, v in ttls.items()}
+        self.maxsize = maxsize
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: T.OrderedDict[
+            CacheKey, T.Tuple[float, T.List["SOAPResponse"]]
+        ] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_ttl(self, command: str) -> T.Optional[float]:
+        """
+        Return the TTL of the command, None means the command is not cacheable.
+        """
+        return self.ttls.get(normalize_command(command))
+
+    def make_key(
+        self,
+        server_id: str,
+        requests: T.Iterable["SOAPRequest"],
+        keep_body: bool = True,
+    ) -> T.Tuple[T.Optional[CacheKey], T.Optional[float]]:
+        """
+        Build the cache key and the TTL of a batch of requests. If any of the
+        command is not in the allowlist, return ``(None, None)``.
+        """
+        requests = list(requests)
+        ttl = None
+        for request in requests:
+            command_ttl = self.get_ttl(request.command)
+            if command_ttl is None:
+                return None, None
+            ttl = command_ttl if ttl is None else min(ttl, command_ttl)
+        if not requests:
+            return None, None
+        return make_request_key(server_id, requests, keep_body), ttl
+
+    def get(self, key: CacheKey) -> T.Optional[T.List["SOAPResponse"]]:
+        """
+        Return the cached responses, or None if not found or expired.
+        """
+        with self._lock:
+            try:
+                expire_at, responses = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expire_at <= self.clock():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return list(responses)
+
+    def put(self, key: CacheKey, responses: T.List["SOAPResponse"], ttl: float):
+        """
+        Cache the responses for ``ttl`` seconds.
+        """
+        with self._lock:
+            self._data[key] = (self.clock() + ttl, list(responses))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, server_id: T.Optional[str] = None):
+        """
+        Remove all entries of a server, or all entries if ``server_id`` is None.
+        """
+        with self._lock:
+            if server_id is None:
+                self._data.clear()
+            else:
+                for key in [key for key in self._data if key[0][0] == server_id]:
+                    del self._data[key]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> T.Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
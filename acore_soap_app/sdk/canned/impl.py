@@ -12,6 +12,10 @@
 - server_id: 服务器的逻辑 ID, 命名规则为 ``${env_name}-${server_name}``. 例如 ``sbx-blue``.
 - raises: 当命令执行失败时是否抛出异常, 默认为 ``True``.
 
+只读的接口还有一个可选的 ``cache`` 参数, 请参考 :class:`~acore_soap_app.sdk.cache.ResponseCache`.
+所有的接口都有一个可选的 ``resolver`` 参数, 请参考
+:class:`~acore_soap_app.sdk.resolver.InstanceResolver`.
+
 Reference:
 
 - https://www.azerothcore.org/wiki/gm-commands
@@ -19,10 +23,14 @@ Reference:
 
 import typing as T
 import re
-from boto_session_manager import BotoSesManager
 
 from ...exc import SOAPResponseParseError, SOAPCommandFailedError
 from ..core import run_soap_command
+from ..cache import ResponseCache
+from ..resolver import InstanceResolver
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from boto_session_manager import BotoSesManager
 
 
 def extract_online_players(message: str) -> T.Tuple[int, int]:
@@ -42,9 +50,11 @@ def extract_online_players(message: str) -> T.Tuple[int, int]:
 
 
 def get_online_players(
-    bsm: BotoSesManager,
+    bsm: "BotoSesManager",
     server_id: str,
     raises: bool = True,
+    cache: T.Optional[ResponseCache] = None,
+    resolver: T.Optional[InstanceResolver] = None,
 ) -> T.Dict[str, int]:
     """
     :return: a dict with two keys: ``connected_players`` and ``characters_in_world``.
@@ -54,6 +64,8 @@ def get_online_players(
         server_id=server_id,
         request_like=".server info",
         raises=raises,
+        cache=cache,
+        resolver=resolver,
     )[0]
 
     connected_players, characters_in_world = extract_online_players(response.message)
@@ -65,23 +77,28 @@ def get_online_players(
 
 
 def is_server_online(
-    bsm: BotoSesManager,
+    bsm: "BotoSesManager",
     server_id: str,
     raises: bool = True,
+    cache: T.Optional[ResponseCache] = None,
+    resolver: T.Optional[InstanceResolver] = None,
 ) -> bool:
     """
     :return: a boolean value to indicate whether the server is online
     """
-    result = get_online_players(bsm, server_id, raises=raises)
+    result = get_online_players(
+        bsm, server_id, raises=raises, cache=cache, resolver=resolver
+    )
     return True
 
 
 def create_account(
-    bsm: BotoSesManager,
+    bsm: "BotoSesManager",
     server_id: str,
     username: str,
     password: str,
     raises: bool = True,
+    resolver: T.Optional[InstanceResolver] = None,
 ) -> bool:
     """
     :return: a boolean value to indicate whether the account is created successfully
@@ -91,18 +108,20 @@ def create_account(
         server_id=server_id,
         request_like=f".account create {username} {password}",
         raises=raises,
+        resolver=resolver,
     )[0]
     response.print()
     return response.succeeded
 
 
 def set_gm_level(
-    bsm: BotoSesManager,
+    bsm: "BotoSesManager",
     server_id: str,
     username: str,
     level: int,
     realm_id: int,
     raises: bool = True,
+    resolver: T.Optional[InstanceResolver] = None,
 ) -> bool:
     """
     :param username:
@@ -116,17 +135,19 @@ def set_gm_level(
         server_id=server_id,
         request_like=f".account set gmlevel {username} {level} {realm_id}",
         raises=raises,
+        resolver=resolver,
     )[0]
     response.print()
     return response.succeeded
 
 
 def set_password(
-    bsm: BotoSesManager,
+    bsm: "BotoSesManager",
     server_id: str,
     username: str,
     password: str,
     raises: bool = True,
+    resolver: T.Optional[InstanceResolver] = None,
 ) -> bool:
     """
     :param username:
@@ -140,16 +161,18 @@ def set_password(
         server_id=server_id,
         request_like=f".account set password {username} {password} {password}",
         raises=raises,
+        resolver=resolver,
     )[0]
     response.print()
     return response.succeeded
 
 
 def delete_account(
-    bsm: BotoSesManager,
+    bsm: "BotoSesManager",
     server_id: str,
     username: str,
     raises: bool = True,
+    resolver: T.Optional[InstanceResolver] = None,
 ) -> bool:
     """
     :param username:
@@ -161,15 +184,18 @@ def delete_account(
         server_id=server_id,
         request_like=f".account delete {username}",
         raises=raises,
+        resolver=resolver,
     )[0]
     response.print()
     return response.succeeded
 
 
 def gm_list(
-    bsm: BotoSesManager,
+    bsm: "BotoSesManager",
     server_id: str,
     raises: bool = True,
+    cache: T.Optional[ResponseCache] = None,
+    resolver: T.Optional[InstanceResolver] = None,
 ) -> T.List[T.Tuple[str, int]]:
     """
     :return: a boolean value to indicate whether the account is deleted successfully
@@ -179,6 +205,8 @@ def gm_list(
         server_id=server_id,
         request_like=f".gm list",
         raises=raises,
+        cache=cache,
+        resolver=resolver,
     )[0]
     if response.succeeded:
         results = list()
@@ -6,13 +6,41 @@
 
 import typing as T
 import time
+import shlex
 
-from boto_session_manager import BotoSesManager
-import aws_ssm_run_command.api as aws_ssm_run_command
-from acore_server_metadata.api import Server
+from ..agent.impl import (
+    SOAPRequest,
+    SOAPResponse,
+    INLINE_PREFIX,
+    SSM_STDOUT_LIMIT,
+    OVERFLOW_INLINE,
+)
+from ..exc import EC2IsNotRunningError, RunCommandError, SSMOutputTruncatedError
+from .. import metrics
+from ..circuit_breaker import CircuitBreaker
+from ..timing import Phase, timer
+from .cache import ResponseCache, make_request_key, is_read_only
+from .singleflight import SingleFlight
+from .resolver import InstanceResolver, lookup_instance_id, is_invalid_instance_error
+from .polling import PollingStrategy, wait_command_invocation
 
-from ..agent.api import SOAPRequest, SOAPResponse
-from ..exc import EC2IsNotRunningError, RunCommandError
+if T.TYPE_CHECKING:  # pragma: no cover
+    from boto_session_manager import BotoSesManager
+    import aws_ssm_run_command.api as aws_ssm_run_command
+
+
+def is_server_failure(e: BaseException) -> bool:
+    """
+    Check if the exception means that the game server is unreachable, the
+    EC2 is not running or the SSM Run Command timed out.
+    """
+    return isinstance(e, (EC2IsNotRunningError, TimeoutError))
+
+
+#: the max size of the ``acsoap gm`` command line sent in the SSM command, the
+#: batches that are larger than this are sent through S3. SSM limits the total
+#: size of the send_command parameters, this leaves a wide margin.
+MAX_INLINE_SIZE = 48 * 1024
 
 
 def build_cli_arg_for_gm(
@@ -22,32 +50,255 @@ def build_cli_arg_for_gm(
     raises: bool = True,
     s3uri_output: T.Optional[str] = None,
     path_cli: str = "/home/ubuntu/git_repos/acore_soap_app-project/.venv/bin/acsoap",
+    workers: int = 1,
+    keep_body: bool = True,
+    overflow: T.Optional[str] = None,
 ) -> str:
     """
     构造最终的 acsoap 命令行参数. 以便之后 pass 给
-    :meth:`acore_soap_app.cli.main.Command.gm` 命令.
+    :meth:`acore_soap_app.cli.main.Command.gm` 命令. 所有的参数值都经过 shell 转义,
+    GM 命令或密码中的引号, ``$`` 等字符会原样传给 ``acsoap``.
     """
     args = [
         path_cli,
         "gm",
-        f'"{command}"',
+        shlex.quote(command),
     ]
     if username is not None:
-        args.append(f"-u={username}")
+        args.append(f"-u={shlex.quote(username)}")
     if password is not None:
-        args.append(f"-p={password}")
+        args.append(f"-p={shlex.quote(password)}")
     if raises is not None:
         if raises:
             args.append(f"-r=True")
         else:
             args.append(f"-r=False")
     if s3uri_output is not None:
-        args.append(f"-s={s3uri_output}")
+        args.append(f"-s={shlex.quote(s3uri_output)}")
+    if workers > 1:
+        args.append(f"-w={workers}")
+    if keep_body is False:
+        args.append(f"--keep_body=False")
+    if overflow is not None:
+        args.append(f"-o={shlex.quote(overflow)}")
     return " ".join(args)
 
 
+def _build_commands(
+    bsm: "BotoSesManager",
+    requests: T.List[SOAPRequest],
+    username: T.Optional[str],
+    password: T.Optional[str],
+    raises: bool,
+    s3uri_input: T.Optional[str],
+    s3uri_output: T.Optional[str],
+    path_cli: str,
+    workers: int,
+    keep_body: bool,
+    overflow: T.Optional[str] = None,
+    max_inline_size: int = MAX_INLINE_SIZE,
+) -> T.List[str]:
+    """
+    构造 SSM Run Command 要执行的 ``acsoap gm`` 命令. 无论有多少个 request, 都只会启动
+    一个 ``acsoap`` 进程:
+
+    - 单个 request 直接作为 GM 命令传入.
+    - 多个 request 用 :meth:`~acore_soap_app.agent.impl.SOAPRequest.batch_dump_to_inline`
+      编码后作为一个参数传入.
+    - 如果编码后的命令超过了 ``max_inline_size``, 则先把 requests 上传到
+      ``s3uri_input``, 再让 ``acsoap`` 从 S3 读取. 此时如果没有指定 ``s3uri_input``
+      则抛出 ValueError.
+    """
+    kwargs = dict(
+        username=username,
+        password=password,
+        raises=raises,
+        s3uri_output=s3uri_output,
+        path_cli=path_cli,
+        keep_body=keep_body,
+        overflow=overflow,
+    )
+    # identify the run strategy by the payload size
+    if len(requests) == 1:
+        request = requests[0]
+        kwargs.update(username=request.username, password=request.password)
+        command = build_cli_arg_for_gm(command=request.command, **kwargs)
+    else:
+        command = build_cli_arg_for_gm(
+            command=SOAPRequest.batch_dump_to_inline(requests),
+            workers=workers,
+            **kwargs,
+        )
+    if len(command) <= max_inline_size:
+        return [command]
+
+    if s3uri_input is None:
+        raise ValueError(
+            f"the {len(requests)} requests take {len(command)} bytes in the SSM "
+            f"command, more than the {max_inline_size} bytes limit, "
+            f"'s3uri_input' must be specified"
+        )
+    SOAPRequest.batch_dump_to_s3(
+        s3_client=bsm.s3_client,
+        instances=requests,
+        s3uri=s3uri_input,
+    )
+    return [build_cli_arg_for_gm(command=s3uri_input, workers=workers, **kwargs)]
+
+
+def _parse_command_invocation(
+    bsm: "BotoSesManager",
+    command_invocation: "aws_ssm_run_command.better_boto.CommandInvocation",
+    s3uri_output: T.Optional[str],
+    n_requests: T.Optional[int] = None,
+) -> T.List[SOAPResponse]:
+    """
+    从执行完毕的 SSM Run Command 的输出 (或者 ``s3uri_output``) 中解析出 SOAPResponse.
+    stdout 可能是 ``acsoap gm --overflow`` 的三种输出之一 (请参考
+    :func:`~acore_soap_app.cli.impl.write_bounded_stdout`):
+
+    - 每行一个 JSON.
+    - 一行 ``b64gz:...`` 压缩后的 JSON Lines.
+    - 一行 S3 uri, 完整的结果在 S3 中, 会被自动下载.
+
+    :param n_requests: 发送的 request 的数量. 命令成功时每个 request 都有一个
+        response, 如果数量对不上, 说明输出被截断了.
+
+    :raises SSMOutputTruncatedError: 如果 stdout 达到了 SSM 的 24,000 个字符的上限,
+        或者 response 的数量少于 request 的数量.
+    """
+    if command_invocation.ResponseCode != 0:
+        raise RunCommandError.from_command_invocation(command_invocation)
+
+    # parse response
+    if s3uri_output is not None:
+        return SOAPResponse.batch_load_from_s3(
+            s3_client=bsm.s3_client, s3uri=s3uri_output
+        )
+
+    output = command_invocation.StandardOutputContent or ""
+    if len(output) >= SSM_STDOUT_LIMIT:
+        raise SSMOutputTruncatedError(
+            f"the stdout of command {command_invocation.CommandId!r} on "
+            f"{command_invocation.InstanceId!r} reaches the SSM limit of "
+            f"{SSM_STDOUT_LIMIT} characters and is truncated, "
+            f"use 's3uri_overflow' or 's3uri_output' for large outputs"
+        )
+    content = output.strip()
+    if content.startswith("s3://"):
+        responses = SOAPResponse.batch_load_from_s3(
+            s3_client=bsm.s3_client, s3uri=content
+        )
+    elif content.startswith(INLINE_PREFIX):
+        responses = list(SOAPResponse.batch_iter_from_inline(content))
+    else:
+        lines = output.splitlines()
+        responses = [SOAPResponse.from_json(json_str) for json_str in lines]
+    if (n_requests is not None) and (len(responses) != n_requests):
+        raise SSMOutputTruncatedError(
+            f"got {len(responses)} responses for {n_requests} requests "
+            f"from command {command_invocation.CommandId!r} on "
+            f"{command_invocation.InstanceId!r}, the output is incomplete"
+        )
+    return responses
+
+
+def _run_soap_command(
+    bsm: "BotoSesManager",
+    server_id: str,
+    requests: T.List[SOAPRequest],
+    username: T.Optional[str],
+    password: T.Optional[str],
+    raises: bool,
+    s3uri_input: T.Optional[str],
+    s3uri_output: T.Optional[str],
+    path_cli: str,
+    sync: bool,
+    delays: int,
+    timeout: int,
+    verbose: bool,
+    workers: int,
+    keep_body: bool,
+    resolver: T.Optional[InstanceResolver] = None,
+    s3uri_overflow: T.Optional[str] = None,
+    polling: T.Optional[PollingStrategy] = None,
+) -> T.Union[T.List[SOAPResponse], str]:
+    """
+    :func:`run_soap_command` 的底层实现, 真正地通过 SSM Run Command 执行已经加载好的
+    requests.
+    """
+    # the AWS dependencies are heavy, only import them when they are used
+    import aws_ssm_run_command.api as aws_ssm_run_command
+
+    # get ec2 instance id
+    if resolver is None:
+        instance_id = lookup_instance_id(bsm, server_id)
+    else:
+        instance_id = resolver.resolve(bsm, server_id)
+
+    # in sync mode the output is parsed by _parse_command_invocation, so the
+    # agent can compress it or spill it to S3 when it is too large
+    overflow = None
+    if sync and (s3uri_output is None):
+        overflow = OVERFLOW_INLINE if s3uri_overflow is None else s3uri_overflow
+    commands = _build_commands(
+        bsm=bsm,
+        requests=requests,
+        username=username,
+        password=password,
+        raises=raises,
+        s3uri_input=s3uri_input,
+        s3uri_output=s3uri_output,
+        path_cli=path_cli,
+        workers=workers,
+        keep_body=keep_body,
+        overflow=overflow,
+    )
+
+    # run command
+    def submit(instance_id: str):
+        with timer(Phase.SSM_SUBMIT):
+            return aws_ssm_run_command.better_boto.run_shell_script_async(
+                ssm_client=bsm.ssm_client,
+                commands=commands,
+                instance_ids=instance_id,
+            )
+
+    try:
+        command = submit(instance_id)
+    except Exception as e:
+        if (resolver is None) or (not is_invalid_instance_error(e)):
+            raise
+        # the cached instance is stopped or replaced, look it up again and
+        # retry once, the command was rejected so it is safe to resend
+        resolver.invalidate(server_id)
+        instance_id = resolver.resolve(bsm, server_id)
+        command = submit(instance_id)
+    command_id = command.CommandId
+    if sync is False:  # async mode, return immediately
+        return command_id
+
+    # sync mode, wait until command finished
+    if polling is None:
+        polling = PollingStrategy(max_delay=delays)
+    with timer(Phase.SSM_WAIT):
+        command_invocation = wait_command_invocation(
+            ssm_client=bsm.ssm_client,
+            command_id=command_id,
+            instance_id=instance_id,
+            timeout=timeout,
+            polling=polling,
+            n_requests=len(requests),
+            workers=workers,
+            verbose=verbose,
+        )
+    return _parse_command_invocation(
+        bsm, command_invocation, s3uri_output, n_requests=len(requests)
+    )
+
+
 def run_soap_command(
-    bsm: BotoSesManager,
+    bsm: "BotoSesManager",
     server_id: str,
     request_like: T.Union[
         str,
@@ -65,6 +316,14 @@ def run_soap_command(
     delays: int = 1,
     timeout: int = 10,
     verbose: bool = True,
+    workers: int = 1,
+    keep_body: bool = True,
+    cache: T.Optional[ResponseCache] = None,
+    singleflight: T.Optional[SingleFlight] = None,
+    circuit_breaker: T.Optional[CircuitBreaker] = None,
+    resolver: T.Optional[InstanceResolver] = None,
+    s3uri_overflow: T.Optional[str] = None,
+    polling: T.Optional[PollingStrategy] = None,
 ) -> T.Union[T.List[SOAPResponse], str]:
     """
     从任何地方, 通过 SSM Run Command, 远程执行 SOAP 命令.
@@ -85,17 +344,45 @@ def run_soap_command(
     :param password: 默认的密码, 只有当 request.password 为 None 的时候才会用到.
     :param raises: 默认为 True. 如果为 True, 则在遇到错误时抛出异常. 反之则将
         failed SOAP Response 原封不动地返回.
-    :param s3uri_input: 如果指定, 则将输入写入 S3. 常用于 Payload 比较大的情况.
-        如果你一次性发送的 request 大于 20 条, 则必须使用这个参数.
+    :param s3uri_input: 所有的 request 会被编码到同一个 ``acsoap gm`` 命令中. 如果编码后
+        的大小超过了 :data:`MAX_INLINE_SIZE`, 则将输入写入这个 S3 uri, 此时必须指定
+        这个参数.
     :param s3uri_output: 如果不指定, 则默认将输出作为 JSON 打印. 如果指定了 s3uri,
-        则将输出写入到 S3.
+        则将输出写入到 S3. ``s3uri_input`` 和 ``s3uri_output`` 都支持 ``.jsonl``
+        以及 ``.gz``, ``.zst`` 压缩扩展名, 例如 ``s3://bucket/output.jsonl.gz``.
     :param path_cli: EC2 上 acsoap 命令行工具的绝对路径.
     :param sync: 同步和异步模式, 默认为同步模式
         - 如果以同步模式运行, 则会等待 SSM Run Command 完成
         - 如果以异步模式运行, 则会立刻返回一个 SSM Run Command 的 command id.
-    :param delays: 同步模式下的等待间隔
+    :param delays: 同步模式下轮询的最大间隔 (秒), 轮询的间隔从很短开始指数增长,
+        直到这个值. 请参考 :class:`~acore_soap_app.sdk.polling.PollingStrategy`.
     :param timeout: 同步模式下的超时限制
     :param verbose: 同步模式下是否显示进度条
+    :param workers: 有多个 request 时, EC2 上的 acsoap 用多少个线程并发执行这批命令.
+    :param keep_body: 默认为 True. 如果为 False, 则返回的 SOAPResponse 中不包含原始的
+        XML body, 这样可以减少 SSM 输出的大小以及内存占用.
+    :param cache: 可选的 :class:`~acore_soap_app.sdk.cache.ResponseCache`. 只在同步模式下,
+        并且所有的命令都在只读命令白名单中时生效. 命中缓存时不会访问任何 AWS API.
+        只有全部成功的结果才会被缓存.
+    :param singleflight: 可选的 :class:`~acore_soap_app.sdk.singleflight.SingleFlight`.
+        只在同步模式下, 并且所有的命令都是只读命令时生效. 多个线程同时发起相同的请求时,
+        只会执行一次 SSM Run Command, 所有的调用者都拿到相同的结果.
+    :param circuit_breaker: 可选的 :class:`~acore_soap_app.circuit_breaker.CircuitBreaker`,
+        以 ``server_id`` 为 key. 默认 EC2 没有运行或者 SSM Run Command 超时都算作失败
+        (请参考 :func:`is_server_failure`), 可以用 ``CircuitBreaker(is_failure=...)``
+        覆盖. 熔断之后会立刻抛出 :class:`~acore_soap_app.exc.CircuitOpenError`,
+        而不会再等待超时.
+    :param resolver: 可选的 :class:`~acore_soap_app.sdk.resolver.InstanceResolver`.
+        缓存 ``server_id`` 对应的 EC2 instance id, 命中时跳过查询 EC2 和 RDS 的 API 调用.
+        如果不指定, 则每次都会重新查询.
+    :param s3uri_overflow: 只在同步模式并且没有指定 ``s3uri_output`` 时生效. SSM 只返回
+        stdout 的前 24,000 个字符, 所以 EC2 上的 acsoap 在输出过大时会先压缩输出, 如果
+        压缩后仍然过大, 则把结果写入这个 S3 uri, SDK 会自动从 S3 读取. 如果不指定,
+        则只压缩, 仍然过大时抛出 :class:`~acore_soap_app.exc.SSMOutputTruncatedError`.
+        截断的检测总是开启的.
+    :param polling: 可选的 :class:`~acore_soap_app.sdk.polling.PollingStrategy`,
+        同步模式下如何轮询 SSM Run Command 是否执行完毕. 如果指定, 则 ``delays``
+        被忽略. 默认为 ``PollingStrategy(max_delay=delays)``.
     """
     # load requests
     requests = SOAPRequest.batch_load(
@@ -105,85 +392,72 @@ def run_soap_command(
         s3_client=bsm.s3_client,
     )
 
-    # get ec2 instance id
-    server = Server(id=server_id)
-    server.refresh(ec2_client=bsm.ec2_client, rds_client=bsm.rds_client)
-    if server.is_running() is False:
-        raise EC2IsNotRunningError(f"EC2 {server_id!r} is not running")
-    instance_id = server.ec2_inst.id
-
-    # identify the run strategy
-    if len(requests) >= 20:
-        if s3uri_input is None:
-            raise ValueError(
-                "'s3uri_input' must be specified when the number of requests is greater than 20"
-            )
-        is_s3_input = True
-    else:
-        is_s3_input = s3uri_input is not None
+    # try the response cache
+    cache_key, cache_ttl = None, None
+    if (cache is not None) and sync:
+        cache_key, cache_ttl = cache.make_key(server_id, requests, keep_body)
+        if cache_key is not None:
+            responses = cache.get(cache_key)
+            if responses is not None:
+                return responses
 
-    if is_s3_input:
-        SOAPRequest.batch_dump_to_s3(
-            s3_client=bsm.s3_client,
-            instances=requests,
-            s3uri=s3uri_input,
-        )
-        commands = [
-            build_cli_arg_for_gm(
-                command=s3uri_input,
+    def run() -> T.Union[T.List[SOAPResponse], str]:
+        if circuit_breaker is not None:
+            circuit_breaker.before_call(server_id)
+        sdk_metrics = metrics.sdk_metrics
+        if sdk_metrics is not None:
+            sdk_metrics.in_flight.inc(server_id=server_id)
+            start = time.perf_counter()
+        try:
+            responses = _run_soap_command(
+                bsm=bsm,
+                server_id=server_id,
+                requests=requests,
                 username=username,
                 password=password,
                 raises=raises,
+                s3uri_input=s3uri_input,
                 s3uri_output=s3uri_output,
                 path_cli=path_cli,
+                sync=sync,
+                delays=delays,
+                timeout=timeout,
+                verbose=verbose,
+                workers=workers,
+                keep_body=keep_body,
+                resolver=resolver,
+                s3uri_overflow=s3uri_overflow,
+                polling=polling,
             )
-        ]
-    else:
-        commands = [
-            build_cli_arg_for_gm(
-                command=request.command,
-                username=request.username,
-                password=request.password,
-                raises=raises,
-                s3uri_output=s3uri_output,
-                path_cli=path_cli,
-            )
-            for request in requests
-        ]
+        except Exception as e:
+            if circuit_breaker is not None:
+                circuit_breaker.on_error(server_id, e, is_server_failure)
+            if sdk_metrics is not None:
+                sdk_metrics.commands.inc(server_id=server_id, outcome="error")
+            raise
+        finally:
+            if sdk_metrics is not None:
+                sdk_metrics.in_flight.dec(server_id=server_id)
+                sdk_metrics.latency.observe(
+                    time.perf_counter() - start, server_id=server_id
+                )
+        if circuit_breaker is not None:
+            circuit_breaker.on_success(server_id)
+        if sdk_metrics is not None:
+            if isinstance(responses, str):  # async mode, the command id
+                outcome = "submitted"
+            elif all(r.succeeded for r in responses):
+                outcome = "succeeded"
+            else:
+                outcome = "failed"
+            sdk_metrics.commands.inc(server_id=server_id, outcome=outcome)
+        if cache_key is not None and all(r.succeeded for r in responses):
+            cache.put(cache_key, responses, cache_ttl)
+        return responses
 
-    # run command
-    command = aws_ssm_run_command.better_boto.run_shell_script_async(
-        ssm_client=bsm.ssm_client,
-        commands=commands,
-        instance_ids=instance_id,
-    )
-    command_id = command.CommandId
-    if sync is False:  # async mode, return immediately
-        return command_id
+    # coalesce identical in-flight read-only requests
+    if (singleflight is not None) and sync and is_read_only(requests):
+        key = (make_request_key(server_id, requests, keep_body), raises)
+        return list(singleflight.do(key, run))
 
-    # sync mode, wait until command succeeded
-    time.sleep(1)
-
-    # get command response
-    command_invocation = aws_ssm_run_command.better_boto.wait_until_send_command_succeeded(
-        ssm_client=bsm.ssm_client,
-        command_id=command_id,
-        instance_id=instance_id,
-        raises=False,
-        delays=delays,
-        timeout=timeout,
-        verbose=verbose,
-    )
-    if command_invocation.ResponseCode != 0:
-        raise RunCommandError.from_command_invocation(command_invocation)
-
-    # parse response
-    if s3uri_output is None:
-        output = command_invocation.StandardOutputContent
-        lines = output.splitlines()
-        responses = [SOAPResponse.from_json(json_str) for json_str in lines]
-    else:
-        responses = SOAPResponse.batch_load_from_s3(
-            s3_client=bsm.s3_client, s3uri=s3uri_output
-        )
-    return responses
+    return run()
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""
+Run the same GM commands on many servers with one SSM Run Command.
+
+:func:`~acore_soap_app.sdk.core.run_soap_command` 一次只能对一个 ``server_id`` 执行,
+对整个服务器集群广播消息, 或者巡检所有服务器的 ``.server info`` 就需要 N 次 send command
+以及 N 个串行的等待循环. 而 SSM 的 ``send_command`` 本身就支持多个 instance id:
+
+1. 用一次 EC2 (和 RDS) 的 describe 批量查询所有服务器的 instance id, 请参考
+   :func:`~acore_soap_app.sdk.resolver.lookup_instance_ids`.
+2. 对所有正在运行的实例只发送一个 SSM command (每个 command 最多
+   :data:`MAX_INSTANCES_PER_COMMAND` 个实例, 超过的会分批发送).
+3. 并发地轮询每个实例的 command invocation, 哪个服务器先执行完就先返回哪个.
+
+每个服务器的结果要么是 :class:`~acore_soap_app.agent.impl.SOAPResponse` 的列表,
+要么是一个异常, 一个服务器的失败不会影响其他服务器.
+
+Usage example:
+
+.. code-block:: python
+
+    >>> from acore_soap_app.sdk.api import run_fleet_soap_command, iter_fleet_soap_command
+    >>> results = run_fleet_soap_command(bsm, ["sbx-blue", "sbx-green"], ".server info")
+    >>> results["sbx-blue"][0].message
+    >>> isinstance(results["sbx-green"], Exception)
+    >>> # handle the results as the servers finish
+    >>> for server_id, result in iter_fleet_soap_command(bsm, server_ids, ".server info"):
+    ...     print(server_id, result)
+"""
+
+import typing as T
+import time
+import collections
+import concurrent.futures
+
+from ..agent.impl import SOAPRequest, SOAPResponse, OVERFLOW_INLINE
+from .. import metrics
+from ..timing import Phase, timer
+from .core import _build_commands, _parse_command_invocation
+from .resolver import InstanceResolver, lookup_instance_ids, is_invalid_instance_error
+from .polling import PollingStrategy, FINISHED_STATUSES, is_invocation_not_ready
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from boto_session_manager import BotoSesManager
+
+#: the max number of instance ids in one ``send_command`` API call
+MAX_INSTANCES_PER_COMMAND = 50
+#: the max number of threads that poll the command invocations
+MAX_POLL_WORKERS = 16
+
+FleetResult = T.Union[T.List[SOAPResponse], Exception]
+
+
+def iter_fleet_soap_command(
+    bsm: "BotoSesManager",
+    server_ids: T.Iterable[str],
+    request_like: T.Union[
+        str,
+        T.List[str],
+        SOAPRequest,
+        T.List[SOAPRequest],
+    ],
+    username: T.Optional[str] = None,
+    password: T.Optional[str] = None,
+    raises: bool = True,
+    s3uri_input: T.Optional[str] = None,
+    path_cli: str = "/home/ubuntu/git_repos/acore_soap_app-project/.venv/bin/acsoap",
+    delays: float = 1,
+    timeout: float = 10,
+    workers: int = 1,
+    keep_body: bool = True,
+    resolver: T.Optional[InstanceResolver] = None,
+    polling: T.Optional[PollingStrategy] = None,
+) -> T.Iterator[T.Tuple[str, FleetResult]]:
+    """
+    在多个服务器上执行相同的 GM 命令, 按照完成的先后顺序 yield ``(server_id, result)``.
+    ``result`` 是 SOAPResponse 的列表, 或者是以下异常之一:
+
+    - :class:`~acore_soap_app.exc.EC2IsNotRunningError`: 服务器没有在运行.
+    - :class:`~acore_soap_app.exc.RunCommandError`: ``acsoap gm`` 执行失败, 或者
+      输出被 SSM 截断了 (:class:`~acore_soap_app.exc.SSMOutputTruncatedError`).
+    - :class:`TimeoutError`: 在 ``timeout`` 秒内没有执行完.
+    - 其他 AWS API 的错误, 或者无法解析的输出.
+
+    :param server_ids: 服务器的逻辑 ID 列表, 重复的会被忽略.
+    :param delays: 轮询的最大间隔 (秒).
+    :param timeout: 从发送命令开始, 最多等待多少秒.
+    :param resolver: 可选的 :class:`~acore_soap_app.sdk.resolver.InstanceResolver`,
+        如果不指定, 则每次都批量查询 EC2 和 RDS.
+    :param polling: 可选的 :class:`~acore_soap_app.sdk.polling.PollingStrategy`,
+        每一轮并发轮询之前的等待时间. 默认为 ``PollingStrategy(max_delay=delays)``.
+
+    其他参数请参考 :func:`~acore_soap_app.sdk.core.run_soap_command`. 由于所有服务器共用
+    同一个命令, 所以不支持 ``s3uri_output`` 和 ``s3uri_overflow``, 结果总是从 SSM 的
+    stdout 中读取, 输出过大时会被压缩.
+    """
+    # the AWS dependencies are heavy, only import them when they are used
+    import aws_ssm_run_command.api as aws_ssm_run_command
+
+    requests = SOAPRequest.batch_load(
+        request_like=request_like,
+        username=username,
+        password=password,
+        s3_client=bsm.s3_client,
+    )
+    server_ids = list(dict.fromkeys(server_ids))
+    if not server_ids:
+        return
+
+    sdk_metrics = metrics.sdk_metrics
+    start = time.perf_counter()
+
+    def done(server_id: str, result: FleetResult) -> T.Tuple[str, FleetResult]:
+        if sdk_metrics is not None:
+            if isinstance(result, Exception):
+                outcome = "error"
+            elif all(r.succeeded for r in result):
+                outcome = "succeeded"
+            else:
+                outcome = "failed"
+            sdk_metrics.commands.inc(server_id=server_id, outcome=outcome)
+            sdk_metrics.latency.observe(
+                time.perf_counter() - start, server_id=server_id
+            )
+        return server_id, result
+
+    # resolve all the servers in bulk
+    try:
+        if resolver is None:
+            resolved = lookup_instance_ids(bsm, server_ids)
+        else:
+            resolved = resolver.resolve_many(bsm, server_ids)
+    except Exception as e:
+        # e.g. ServerNotUniqueError, none of the servers can be targeted
+        for server_id in server_ids:
+            yield done(server_id, e)
+        return
+
+    # instance id -> server id
+    targets: T.Dict[str, str] = dict()
+    for server_id, instance_id in resolved.items():
+        if isinstance(instance_id, Exception):
+            yield done(server_id, instance_id)
+        else:
+            targets[instance_id] = server_id
+    if not targets:
+        return
+
+    commands = _build_commands(
+        bsm=bsm,
+        requests=requests,
+        username=username,
+        password=password,
+        raises=raises,
+        s3uri_input=s3uri_input,
+        s3uri_output=None,
+        path_cli=path_cli,
+        workers=workers,
+        keep_body=keep_body,
+        overflow=OVERFLOW_INLINE,
+    )
+
+    # one send command per MAX_INSTANCES_PER_COMMAND instances
+    pending: T.Dict[str, str] = dict()  # instance id -> command id
+    instance_ids = list(targets)
+    chunks = collections.deque(
+        instance_ids[i : i + MAX_INSTANCES_PER_COMMAND]
+        for i in range(0, len(instance_ids), MAX_INSTANCES_PER_COMMAND)
+    )
+    while chunks:
+        chunk = chunks.popleft()
+        try:
+            with timer(Phase.SSM_SUBMIT):
+                command = aws_ssm_run_command.better_boto.run_shell_script_async(
+                    ssm_client=bsm.ssm_client,
+                    commands=commands,
+                    instance_ids=chunk,
+                )
+        except Exception as e:
+            if is_invalid_instance_error(e):
+                if len(chunk) > 1:
+                    # SSM doesn't tell which instance is invalid, split the
+                    # chunk to find it, the healthy ones are sent again
+                    middle = len(chunk) // 2
+                    chunks.appendleft(chunk[middle:])
+                    chunks.appendleft(chunk[:middle])
+                    continue
+                if resolver is not None:
+                    # the cached instance is stopped or replaced
+                    resolver.invalidate(targets[chunk[0]])
+            for instance_id in chunk:
+                yield done(targets[instance_id], e)
+            continue
+        for instance_id in chunk:
+            pending[instance_id] = command.CommandId
+    if not pending:
+        return
+
+    def poll(command_id: str, instance_id: str):
+        return aws_ssm_run_command.better_boto.CommandInvocation.get(
+            ssm_client=bsm.ssm_client,
+            command_id=command_id,
+            instance_id=instance_id,
+        )
+
+    if polling is None:
+        polling = PollingStrategy(max_delay=delays)
+    poll_delays = polling.iter_delays(len(requests), workers)
+    deadline = time.monotonic() + timeout
+    max_workers = min(len(pending), MAX_POLL_WORKERS)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            with timer(Phase.SSM_WAIT):
+                remaining = deadline - time.monotonic()
+                time.sleep(max(min(next(poll_delays), remaining), 0))
+            futures = {
+                pool.submit(poll, command_id, instance_id): instance_id
+                for instance_id, command_id in pending.items()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                instance_id = futures[future]
+                server_id = targets[instance_id]
+                try:
+                    command_invocation = future.result()
+                except Exception as e:
+                    if is_invocation_not_ready(e):
+                        continue
+                    del pending[instance_id]
+                    yield done(server_id, e)
+                    continue
+                if command_invocation.Status not in FINISHED_STATUSES:
+                    continue
+                del pending[instance_id]
+                try:
+                    result = _parse_command_invocation(
+                        bsm, command_invocation, None, n_requests=len(requests)
+                    )
+                except Exception as e:
+                    # e.g. RunCommandError or a malformed output
+                    result = e
+                yield done(server_id, result)
+            if not pending:
+                return
+            if time.monotonic() >= deadline:
+                for instance_id in list(pending):
+                    del pending[instance_id]
+                    server_id = targets[instance_id]
+                    yield done(
+                        server_id,
+                        TimeoutError(
+                            f"SSM command on {server_id!r} ({instance_id}) is not "
+                            f"finished in {timeout} seconds"
+                        ),
+                    )
+                return
+
+
+def run_fleet_soap_command(
+    bsm: "BotoSesManager",
+    server_ids: T.Iterable[str],
+    request_like: T.Union[
+        str,
+        T.List[str],
+        SOAPRequest,
+        T.List[SOAPRequest],
+    ],
+    on_result: T.Optional[T.Callable[[str, FleetResult], None]] = None,
+    **kwargs,
+) -> T.Dict[str, FleetResult]:
+    """
+    在多个服务器上执行相同的 GM 命令, 等待所有服务器完成, 返回 ``server_id`` 到结果的
+    字典, 顺序和 ``server_ids`` 一致. 请参考 :func:`iter_fleet_soap_command`.
+
+    :param on_result: 可选的回调函数, 每个服务器完成时立刻以 ``(server_id, result)``
+        调用, 用于在所有服务器完成之前处理部分结果.
+    :param kwargs: 请参考 :func:`iter_fleet_soap_command`.
+    """
+    server_ids = list(dict.fromkeys(server_ids))
+    results = dict()
+    for server_id, result in iter_fleet_soap_command(
+        bsm=bsm,
+        server_ids=server_ids,
+        request_like=request_like,
+        **kwargs,
+    ):
+        results[server_id] = result
+        if on_result is not None:
+            on_result(server_id, result)
+    return {server_id: results[server_id] for server_id in server_ids}
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+Adaptive polling of the SSM Run Command invocation.
+
+之前同步模式的 :func:`~acore_soap_app.sdk.core.run_soap_command` 总是先
+``time.sleep(1)`` (避免 ``InvocationDoesNotExist``), 然后以固定的 ``delays`` 间隔轮询
+``GetCommandInvocation``. 一个 300 毫秒就执行完的命令也要等一秒多, 而执行时间很长的
+批量任务又会产生很多无用的 API 调用. :class:`PollingStrategy` 改为:
+
+- 第一次轮询的等待时间很短, 并且加上预期的执行时间 (request 的数量除以 ``workers``,
+  乘以 ``per_request``). 大批量的任务在预期的时间之前不会轮询, ``per_request``
+  应该是一个偏小的估计.
+- 之后的间隔从 ``initial_delay`` 开始以 ``multiplier`` 指数增长, 但不超过 ``max_delay``.
+- 每个间隔都会随机缩短最多 ``jitter`` 的比例, 避免大量客户端同时轮询.
+- 命令刚发送时 invocation 可能还不存在, ``InvocationDoesNotExist`` 错误被当作
+  "还在执行中", 继续按照退避的间隔轮询, 不需要一个固定的 sleep.
+
+Usage example:
+
+.. code-block:: python
+
+    >>> from acore_soap_app.sdk.api import PollingStrategy, run_soap_command
+    >>> polling = PollingStrategy(initial_delay=0.1, max_delay=2)
+    >>> run_soap_command(bsm, "sbx-blue", ".server info", polling=polling)
+"""
+
+import typing as T
+import sys
+import time
+import random
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    import aws_ssm_run_command.api as aws_ssm_run_command
+
+DEFAULT_INITIAL_DELAY = 0.2
+DEFAULT_MAX_DELAY = 1.0
+DEFAULT_MULTIPLIER = 1.5
+DEFAULT_JITTER = 0.2
+#: a lower bound of the execution time of one GM command on the EC2 in seconds
+DEFAULT_PER_REQUEST = 0.005
+
+#: the final status of a command invocation
+FINISHED_STATUSES = {"Success", "Cancelled", "TimedOut", "Failed"}
+
+
+def is_invocation_not_ready(e: BaseException) -> bool:
+    """
+    Whether the error is the SSM ``InvocationDoesNotExist`` error, the
+    invocation is not visible right after ``send_command``.
+    """
+    response = getattr(e, "response", None)
+    if not isinstance(response, dict):
+        return False
+    return response.get("Error", {}).get("Code") == "InvocationDoesNotExist"
+
+
+class PollingStrategy:
+    """
+    Exponential backoff with jitter for polling the command invocation.
+
+    :param initial_delay: the delay before the first poll, in seconds.
+    :param max_delay: the cap of the delays, except the expected execution
+        time of the batch added to the first delay.
+    :param multiplier: the growth factor of the delay after each poll.
+    :param jitter: every delay is shortened by a random ratio in ``[0, jitter)``.
+    :param per_request: a lower bound of the execution time of one request,
+        the first delay is extended by the expected time of the batch.
+    :param rand: the function that returns a random float in ``[0, 1)``.
+    """
+
+    def __init__(
+        self,
+        initial_delay: float = DEFAULT_INITIAL_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        multiplier: float = DEFAULT_MULTIPLIER,
+        jitter: float = DEFAULT_JITTER,
+        per_request: float = DEFAULT_PER_REQUEST,
+        rand: T.Callable[[], float] = random.random,
+    ):
+        if initial_delay < 0:
+            raise ValueError("initial_delay must not be negative")
+        if max_delay < 0:
+            raise ValueError("max_delay must not be negative")
+        if multiplier < 1:
+            raise ValueError("multiplier must be at least 1")
+        if not (0 <= jitter < 1):
+            raise ValueError("jitter must be between 0 and 1")
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.per_request = per_request
+        self.rand = rand
+
+    def expected_duration(self, n_requests: int = 1, workers: int = 1) -> float:
+        """
+        The expected execution time of a batch on the EC2.
+        """
+        rounds = -(-n_requests // max(workers, 1))  # ceil division
+        return self.per_request * rounds
+
+    def iter_delays(self, n_requests: int = 1, workers: int = 1) -> T.Iterator[float]:
+        """
+        Yield the delays before each poll, forever.
+        """
+        expected = self.expected_duration(n_requests, workers)
+        delay = self.initial_delay
+        while True:
+            delay = min(delay, self.max_delay)
+            yield expected + delay * (1 - self.jitter * self.rand())
+            expected = 0
+            delay *= self.multiplier
+
+
+def wait_command_invocation(
+    ssm_client,
+    command_id: str,
+    instance_id: str,
+    timeout: float = 10,
+    polling: T.Optional[PollingStrategy] = None,
+    n_requests: int = 1,
+    workers: int = 1,
+    verbose: bool = False,
+    sleep: T.Callable[[float], None] = time.sleep,
+    clock: T.Callable[[], float] = time.monotonic,
+) -> "aws_ssm_run_command.better_boto.CommandInvocation":
+    """
+    Poll the command invocation with the ``polling`` strategy until it is
+    finished. Unlike ``wait_until_send_command_succeeded``, a failed invocation
+    is returned instead of raised.
+
+    :param timeout: how long to wait in seconds since the call.
+    :param n_requests: the number of requests in the command, see
+        :meth:`PollingStrategy.iter_delays`.
+    :param workers: the number of threads ``acsoap`` runs the batch with.
+    :param verbose: print the progress to stdout.
+
+    :raises TimeoutError: if the invocation is not finished in ``timeout`` seconds.
+    """
+    # the AWS dependencies are heavy, only import them when they are used
+    import aws_ssm_run_command.api as aws_ssm_run_command
+
+    if polling is None:
+        polling = PollingStrategy()
+    start = clock()
+    deadline = start + timeout
+    try:
+        for attempt, delay in enumerate(polling.iter_delays(n_requests, workers), 1):
+            remaining = deadline - clock()
+            if remaining <= 0:
+                raise TimeoutError(
+                    f"SSM command {command_id!r} on {instance_id!r} is not "
+                    f"finished in {timeout} seconds"
+                )
+            sleep(min(delay, remaining))
+            if verbose:  # pragma: no cover
+                sys.stdout.write(
+                    f"\ron {attempt} th attempt, elapsed {clock() - start:.1f} seconds ..."
+                )
+                sys.stdout.flush()
+            try:
+                command_invocation = aws_ssm_run_command.better_boto.CommandInvocation.get(
+                    ssm_client=ssm_client,
+                    command_id=command_id,
+                    instance_id=instance_id,
+                )
+            except Exception as e:
+                if is_invocation_not_ready(e):
+                    continue
+                raise
+            if command_invocation.Status in FINISHED_STATUSES:
+                return command_invocation
+    finally:
+        if verbose:  # pragma: no cover
+            sys.stdout.write("\n")
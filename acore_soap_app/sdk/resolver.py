@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+"""
+Opt-in TTL cache of the server_id to EC2 instance id resolution.
+
+每次 :func:`~acore_soap_app.sdk.core.run_soap_command` 在真正发送 SSM Run Command 之前,
+都要先用 ``acore_server_metadata`` 查询一次 EC2 和一次 RDS, 只是为了拿到 instance id
+以及确认服务器正在运行. 对于高频调用的 canned 接口, 这两次 AWS API 往返占了很大一部分开销.
+:class:`InstanceResolver` 把 **正在运行** 的服务器的 instance id 缓存 ``ttl`` 秒.
+
+- 没有在运行的服务器永远不会被缓存, 每次都会重新查询, 直到它恢复运行.
+- 遇到 :class:`~acore_soap_app.exc.EC2IsNotRunningError` 或者 SSM 返回
+  ``InvalidInstanceId`` 错误 (例如实例被停止或替换了) 时, 缓存会被立刻清除.
+- ``ec2_only=True`` 时只查询 EC2, 完全跳过 RDS 的查询. 适用于确定数据库总是和 EC2
+  一起启停的环境, 如果数据库没有运行, 会得到 GM 命令执行失败而不是
+  :class:`~acore_soap_app.exc.EC2IsNotRunningError`.
+
+Usage example:
+
+.. code-block:: python
+
+    >>> from acore_soap_app.sdk.api import InstanceResolver, canned
+    >>> resolver = InstanceResolver(ttl=300, ec2_only=True)
+    >>> canned.get_online_players(bsm, "sbx-blue", resolver=resolver) # EC2 lookup
+    >>> canned.get_online_players(bsm, "sbx-blue", resolver=resolver) # no lookup
+    >>> resolver.stats()
+    {'size': 1, 'hits': 1, 'misses': 1, 'invalidations': 0}
+"""
+
+import typing as T
+import time
+import threading
+
+from ..exc import EC2IsNotRunningError
+from ..timing import Phase, timer
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from boto_session_manager import BotoSesManager
+
+
+DEFAULT_TTL = 60
+DEFAULT_MAXSIZE = 256
+
+
+def lookup_instance_id(
+    bsm: "BotoSesManager",
+    server_id: str,
+    ec2_only: bool = False,
+) -> str:
+    """
+    Query AWS and return the EC2 instance id of a running server.
+
+    :param ec2_only: if True, only check the EC2 instance and skip the RDS
+        describe call.
+
+    :raises EC2IsNotRunningError: if the server is not running.
+    """
+    from acore_server_metadata.api import Server
+
+    server = Server(id=server_id)
+    with timer(Phase.SERVER_LOOKUP):
+        if ec2_only:
+            server.ec2_inst = Server.get_ec2(bsm.ec2_client, server_id)
+            is_running = server.is_ec2_running()
+        else:
+            server.refresh(ec2_client=bsm.ec2_client, rds_client=bsm.rds_client)
+            is_running = server.is_running()
+    if is_running is False:
+        raise EC2IsNotRunningError(f"EC2 {server_id!r} is not running")
+    return server.ec2_inst.id
+
+
+def lookup_instance_ids(
+    bsm: "BotoSesManager",
+    server_ids: T.Iterable[str],
+    ec2_only: bool = False,
+) -> T.Dict[str, T.Union[str, Exception]]:
+    """
+    The bulk version of :func:`lookup_instance_id`, it calls the EC2 (and RDS)
+    describe API only once for all the servers.
+
+    :return: a mapping from server_id to its instance id, or the error, e.g.
+        :class:`~acore_soap_app.exc.EC2IsNotRunningError`.
+    """
+    server_ids = list(dict.fromkeys(server_ids))
+    results: T.Dict[str, T.Union[str, Exception]] = dict()
+    with timer(Phase.SERVER_LOOKUP):
+        if ec2_only:
+            from simple_aws_ec2.api import Ec2Instance, EC2InstanceStatusEnum
+            from acore_constants.api import TagKey
+            from acore_server_metadata.api import ServerNotUniqueError
+
+            ec2_inst_list = Ec2Instance.query(
+                ec2_client=bsm.ec2_client,
+                filters=[
+                    dict(Name=f"tag:{TagKey.SERVER_ID}", Values=server_ids),
+                    dict(
+                        Name="instance-state-name",
+                        Values=[EC2InstanceStatusEnum.running.value],
+                    ),
+                ],
+            ).all()
+            for ec2_inst in ec2_inst_list:
+                server_id = ec2_inst.tags[TagKey.SERVER_ID]
+                if server_id in results:
+                    results[server_id] = ServerNotUniqueError(
+                        f"Found multiple running EC2 instance with id {server_id}"
+                    )
+                else:
+                    results[server_id] = ec2_inst.id
+        else:
+            from acore_server_metadata.api import Server
+
+            servers = Server.batch_get_server(
+                ids=server_ids,
+                ec2_client=bsm.ec2_client,
+                rds_client=bsm.rds_client,
+            )
+            for server_id, server in servers.items():
+                if server.is_running():
+                    results[server_id] = server.ec2_inst.id
+    for server_id in server_ids:
+        if server_id not in results:
+            results[server_id] = EC2IsNotRunningError(
+                f"EC2 {server_id!r} is not running"
+            )
+    return results
+
+
+def is_invalid_instance_error(e: BaseException) -> bool:
+    """
+    Whether the error is the SSM ``InvalidInstanceId`` error, it means the
+    instance is not running, not managed by SSM or doesn't exist anymore.
+    """
+    response = getattr(e, "response", None)
+    if not isinstance(response, dict):
+        return False
+    return response.get("Error", {}).get("Code") == "InvalidInstanceId"
+
+
+class InstanceResolver:
+    """
+    Thread-safe TTL cache of ``server_id -> instance_id`` for running servers.
+
+    :param ttl: how long in seconds a resolved instance id is trusted.
+    :param ec2_only: skip the RDS describe call, see :func:`lookup_instance_id`.
+    :param maxsize: the max number of servers to remember, the one that
+        expires first is evicted when it is full.
+    :param clock: the function that returns the current time in seconds.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_TTL,
+        ec2_only: bool = False,
+        maxsize: int = DEFAULT_MAXSIZE,
+        clock: T.Callable[[], float] = time.monotonic,
+    ):
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.ttl = ttl
+        self.ec2_only = ec2_only
+        self.maxsize = maxsize
+        self.clock = clock
+        self._data: T.Dict[str, T.Tuple[float, str]] = dict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, server_id: str) -> T.Optional[str]:
+        """
+        Return the cached instance id, None if it is not cached or expired.
+        """
+        with self._lock:
+            item = self._data.get(server_id)
+            if item is None:
+                self.misses += 1
+                return None
+            expire, instance_id = item
+            if expire <= self.clock():
+                del self._data[server_id]
+                self.misses += 1
+                return None
+            self.hits += 1
+            return instance_id
+
+    def put(self, server_id: str, instance_id: str):
+        with self._lock:
+            self._data[server_id] = (self.clock() + self.ttl, instance_id)
+            if len(self._data) > self.maxsize:
+                oldest = min(self._data, key=lambda key: self._data[key][0])
+                del self._data[oldest]
+
+    def resolve(
+        self,
+        bsm: "BotoSesManager",
+        server_id: str,
+    ) -> str:
+        """
+        Return the instance id of a running server, from the cache if possible.
+
+        :raises EC2IsNotRunningError: if the server is not running, the cache
+            entry is invalidated.
+        """
+        instance_id = self.get(server_id)
+        if instance_id is not None:
+            return instance_id
+        try:
+            instance_id = lookup_instance_id(bsm, server_id, ec2_only=self.ec2_only)
+        except EC2IsNotRunningError:
+            self.invalidate(server_id)
+            raise
+        self.put(server_id, instance_id)
+        return instance_id
+
+    def resolve_many(
+        self,
+        bsm: "BotoSesManager",
+        server_ids: T.Iterable[str],
+    ) -> T.Dict[str, T.Union[str, Exception]]:
+        """
+        The bulk version of :meth:`resolve`, the servers that are not cached
+        are looked up together with :func:`lookup_instance_ids`.
+
+        :return: a mapping from server_id to its instance id or the error.
+        """
+        results: T.Dict[str, T.Union[str, Exception]] = dict()
+        missing = list()
+        for server_id in dict.fromkeys(server_ids):
+            instance_id = self.get(server_id)
+            if instance_id is None:
+                missing.append(server_id)
+            else:
+                results[server_id] = instance_id
+        if missing:
+            found = lookup_instance_ids(bsm, missing, ec2_only=self.ec2_only)
+            for server_id, instance_id in found.items():
+                if isinstance(instance_id, str):
+                    self.put(server_id, instance_id)
+                else:
+                    self.invalidate(server_id)
+                results[server_id] = instance_id
+        return results
+
+    def invalidate(self, server_id: T.Optional[str] = None):
+        """
+        Forget a server, or all the servers if ``server_id`` is None.
+        """
+        with self._lock:
+            if server_id is None:
+                self.invalidations += len(self._data)
+                self._data.clear()
+            elif self._data.pop(server_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> T.Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
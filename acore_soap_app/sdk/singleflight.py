@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+Single-flight coalescing of identical in-flight calls.
+
+当多个调用者在同一时刻对同一个 ``server_id`` 发起相同的只读请求时 (例如多个 worker 同时
+查询 ``.server info``), 只有第一个调用者 (leader) 会真正执行, 其他调用者 (follower)
+会等待并拿到同一个结果 (或者同一个异常). 执行结束后这个 key 就被释放, 之后的调用会重新执行.
+这和 :class:`~acore_soap_app.sdk.cache.ResponseCache` 是互补的: cache 复用已经完成的结果,
+single-flight 合并还在进行中的请求.
+
+- :class:`SingleFlight` 用于多线程.
+- :class:`AsyncSingleFlight` 用于 asyncio.
+
+Usage example:
+
+.. code-block:: python
+
+    >>> from acore_soap_app.sdk.api import SingleFlight, run_soap_command
+    >>> sf = SingleFlight()
+    >>> # in many threads
+    >>> run_soap_command(bsm, "sbx-blue", ".server info", singleflight=sf)
+    >>> sf.stats()
+    {'calls': 8, 'executions': 1, 'coalesced': 7, 'in_flight': 0}
+"""
+
+import typing as T
+import asyncio
+import threading
+
+KeyT = T.Hashable
+ResultT = T.TypeVar("ResultT")
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "n_followers")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: T.Optional[BaseException] = None
+        self.n_followers = 0
+
+
+class _Stats:
+    """
+    The shared counters of :class:`SingleFlight` and :class:`AsyncSingleFlight`.
+    """
+
+    calls: int
+    executions: int
+    coalesced: int
+
+    def _reset_stats(self):
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def stats(self) -> T.Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls),
+        }
+
+
+class SingleFlight(_Stats):
+    """
+    Thread-safe single-flight group.
+
+    - :attr:`calls`: the total number of :meth:`do` calls.
+    - :attr:`executions`: the number of calls that actually ran ``func``.
+    - :attr:`coalesced`: the number of calls that shared another call's result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: T.Dict[KeyT, _Call] = dict()
+        self._reset_stats()
+
+    def do(self, key: KeyT, func: T.Callable[[], ResultT]) -> ResultT:
+        """
+        Run ``func`` unless an identical call with the same ``key`` is in
+        flight, in which case wait for it and return its result. The exception
+        raised by the leader is re-raised in all the followers.
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.n_followers += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+                leader = True
+
+        if leader:
+            try:
+                call.result = func()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.event.set()
+        else:
+            call.event.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class AsyncSingleFlight(_Stats):
+    """
+    Single-flight group for asyncio, must be used within one event loop.
+
+    Usage example:
+
+    .. code-block:: python
+
+        >>> sf = AsyncSingleFlight()
+        >>> async def server_info():
+        ...     return await loop.run_in_executor(
+        ...         None, functools.partial(run_soap_command, bsm, "sbx-blue", ".server info")
+        ...     )
+        >>> await asyncio.gather(*[sf.do(key, server_info) for _ in range(8)])
+    """
+
+    def __init__(self):
+        self._calls: T.Dict[KeyT, asyncio.Future] = dict()
+        self._reset_stats()
+
+    async def do(
+        self,
+        key: KeyT,
+        func: T.Callable[[], T.Awaitable[ResultT]],
+    ) -> ResultT:
+        """
+        Await ``func()`` unless an identical call with the same ``key`` is in
+        flight, in which case wait for it and return its result.
+
+        A cancelled follower doesn't affect the leader; if the leader is
+        cancelled, the followers get :class:`asyncio.CancelledError` too.
+        """
+        self.calls += 1
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.executions += 1
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark the exception as retrieved if there is no follower
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+
+"""
+A local stand-in for the AzerothCore worldserver SOAP endpoint.
+
+没有真实的 worldserver 就无法测试和 benchmark :meth:`~acore_soap_app.agent.impl.SOAPRequest.send`,
+``acsoap gm`` 以及限流, 熔断, 自适应并发等功能. :class:`FakeSOAPServer` 是一个基于标准库
+``http.server`` 的本地 HTTP 服务器, 它:
+
+- 接收 ``executeCommand`` envelope, 检查 Basic Auth, 认证失败返回 401.
+- 根据命令前缀 (最长前缀优先) 返回 ``<result>`` 或者 ``<faultstring>`` envelope,
+  格式和 ``tests/agent/`` 中从真实服务器上抓取的 fixture 一致.
+- 可以配置延迟, 返回 fault 的概率, 直接断开连接的概率, 以及同时处理的请求数上限.
+  真实的 worldserver 一次只处理一个 SOAP 请求, 所以 ``max_concurrency`` 默认为 1.
+
+默认绑定一个随机端口, 用 :meth:`FakeSOAPServer.make_request` 创建指向它的请求. 如果要测试
+使用默认 endpoint 的代码 (例如 ``acsoap gm``), 可以用 ``FakeSOAPServer(host="localhost", port=7878)``.
+
+Usage example:
+
+.. code-block:: python
+
+    >>> from acore_soap_app.tests.fake_soap_server import FakeSOAPServer
+    >>> with FakeSOAPServer(latency=0.005) as server:
+    ...     response = server.make_request(".server info").send()
+    ...     server.stats()
+"""
+
+import typing as T
+import re
+import time
+import base64
+import random
+import threading
+import contextlib
+import dataclasses
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ..agent.parser import unescape_xml
+
+_pattern_command = re.compile(r"<command>([^<]*)</command>")
+
+_ENVELOPE_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+    'xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/" '
+    'xmlns:xsi="http://www.w3.org/1999/XMLSchema-instance" '
+    'xmlns:xsd="http://www.w3.org/1999/XMLSchema" '
+    'xmlns:ns1="urn:AC"><SOAP-ENV:Body>'
+)
+_ENVELOPE_TAIL = "</SOAP-ENV:Body></SOAP-ENV:Envelope>\n"
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+@dataclasses.dataclass
+class Reply:
+    """
+    The reply of the fake server to a GM command.
+
+    :param message: the text in ``<result>`` or ``<faultstring>``.
+    :param succeeded: if False, reply with a SOAP fault.
+    """
+
+    message: str
+    succeeded: bool = True
+
+    def to_xml(self) -> str:
+        """
+        Render the SOAP envelope the way AzerothCore does, every line of the
+        message ends with ``&#xD;``.
+        """
+        lines = "".join(f"{_escape(line)}&#xD;\n" for line in self.message.split("\n"))
+        if self.succeeded:
+            return (
+                f"{_ENVELOPE_HEAD}<ns1:executeCommandResponse><result>{lines}"
+                f"</result></ns1:executeCommandResponse>{_ENVELOPE_TAIL}"
+            )
+        detail = "".join(f"{_escape(line)}\n" for line in self.message.split("\n"))
+        return (
+            f"{_ENVELOPE_HEAD}<SOAP-ENV:Fault><faultcode>SOAP-ENV:Client</faultcode>"
+            f"<faultstring>{lines}</faultstring><detail>{detail}</detail>"
+            f"</SOAP-ENV:Fault>{_ENVELOPE_TAIL}"
+        )
+
+
+ReplyLike = T.Union[Reply, T.Callable[[str], Reply]]
+
+
+def _nth_arg(command: str, n: int) -> str:
+    args = command.split()
+    return args[n] if len(args) > n else ""
+
+
+#: Default canned replies by command prefix.
+DEFAULT_REPLIES: T.Dict[str, ReplyLike] = {
+    ".server info": Reply(
+        "AzerothCore rev. 0000000000000+ 2023-01-01 00:00:00 +0000 (master branch) "
+        "(Unix, RelWithDebInfo, Static)\n"
+        "Connected players: 0. Characters in world: 0.\n"
+        "Connection peak: 0.\n"
+        "Server uptime: 1 minute(s) 0 second(s)\n"
+        "Update time diff: 10ms. Last 500 diffs summary:\n"
+        "|- Mean: 10ms\n"
+        "|- Median: 10ms\n"
+        "|- Percentiles (95, 99, max): 11ms, 12ms, 15ms"
+    ),
+    ".gm list": Reply("There are no Game Masters on this server."),
+    ".account onlinelist": Reply("There are no players online."),
+    ".account create": lambda command: Reply(
+        f"Account created: {_nth_arg(command, 2)}"
+    ),
+    ".account delete": lambda command: Reply(
+        f"Account not exist: {_nth_arg(command, 2).upper()}",
+        succeeded=False,
+    ),
+    ".account set password": lambda command: Reply("The password was changed"),
+    ".account set gmlevel": lambda command: Reply(
+        f"You change security level of account {_nth_arg(command, 3).upper()} "
+        f"to {_nth_arg(command, 4)}."
+    ),
+    ".account": Reply(
+        "### USAGE: .account ...\n"
+        "Possible subcommands:\n"
+        "|- account create\n"
+        "|- account delete\n"
+        "|- account lock ...\n"
+        "|- account onlinelist\n"
+        "|- account remove ...\n"
+        "|- account set ...",
+        succeeded=False,
+    ),
+}
+
+DEFAULT_REPLY = Reply("There is no such command.", succeeded=False)
+
+UNAUTHORIZED_REPLY = Reply("HTTP Error: 401 Unauthorized", succeeded=False)
+INTERNAL_ERROR_REPLY = Reply("Internal server error", succeeded=False)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server: "_Server"
+    # keep-alive, so that the pooled transport can be measured
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are written separately, without this every
+    # keep-alive request stalls on the delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pragma: no cover
+        pass
+
+    def _reply(self, status: int, reply: Reply):
+        body = reply.to_xml().encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        fake: "FakeSOAPServer" = self.server.fake
+        length = int(self.headers.get("Content-Length", 0))
+        data = self.rfile.read(length).decode("utf-8")
+
+        if self.headers.get("Authorization") != fake.authorization:
+            fake._count("unauthorized")
+            self._reply(401, UNAUTHORIZED_REPLY)
+            return
+
+        match = _pattern_command.search(data)
+        command = unescape_xml(match.group(1)) if match else None
+        if command is None:
+            fake._count("bad_request")
+            self._reply(400, Reply("Bad request", succeeded=False))
+            return
+
+        with fake._semaphore:
+            fake._enter(command)
+            try:
+                latency, outcome = fake._roll()
+                if latency:
+                    time.sleep(latency)
+            finally:
+                fake._exit()
+
+        if outcome == "drop":
+            fake._count("dropped")
+            self.close_connection = True
+            return
+        if outcome == "error":
+            fake._count("errors")
+            self._reply(500, INTERNAL_ERROR_REPLY)
+            return
+        reply = fake.get_reply(command)
+        if reply.succeeded:
+            fake._count("succeeded")
+            self._reply(200, reply)
+        else:
+            fake._count("failed")
+            self._reply(500, reply)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    fake: "FakeSOAPServer"
+
+
+class FakeSOAPServer:
+    """
+    A local fake worldserver SOAP endpoint that runs in a background thread.
+
+    :param host: the host to bind.
+    :param port: the port to bind, 0 means a random free port.
+    :param username: the expected Basic Auth username.
+    :param password: the expected Basic Auth password.
+    :param replies: a mapping from command prefix to :class:`Reply` or a
+        function that takes the command and returns a :class:`Reply`, the
+        longest matching prefix wins. Default is :data:`DEFAULT_REPLIES`.
+    :param default_reply: the reply to the commands that don't match any
+        prefix, default is :data:`DEFAULT_REPLY`.
+    :param latency: the processing time of each command in seconds, either a
+        number or a ``(min, max)`` range to draw uniformly from.
+    :param error_rate: the probability to reply with an internal error fault.
+    :param drop_rate: the probability to close the connection without a reply,
+        the client sees a connection error.
+    :param max_concurrency: the max number of commands processed at the same
+        time, the others wait in line. None means no limit.
+    :param seed: the random seed for latency, errors and drops.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        username: str = "admin",
+        password: str = "admin",
+        replies: T.Optional[T.Dict[str, ReplyLike]] = None,
+        default_reply: ReplyLike = DEFAULT_REPLY,
+        latency: T.Union[float, T.Tuple[float, float]] = 0.0,
+        error_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        max_concurrency: T.Optional[int] = 1,
+        seed: T.Optional[int] = None,
+    ):
+        if replies is None:
+            replies = DEFAULT_REPLIES
+        self.username = username
+        self.password = password
+        self.authorization = "Basic " + base64.b64encode(
+            f"{username}:{password}".encode("utf-8")
+        ).decode("ascii")
+        # sorted by length so that the longest prefix is matched first
+        self.replies = sorted(replies.items(), key=lambda kv: len(kv[0]), reverse=True)
+        self.default_reply = default_reply
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.max_concurrency = max_concurrency
+        if max_concurrency is None:
+            self._semaphore = contextlib.nullcontext()
+        else:
+            self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        #: all the received GM commands in order
+        self.commands: T.List[str] = list()
+        self.counters: T.Dict[str, int] = {
+            "succeeded": 0,
+            "failed": 0,
+            "errors": 0,
+            "dropped": 0,
+            "unauthorized": 0,
+            "bad_request": 0,
+        }
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._server = _Server((host, port), _RequestHandler)
+        self._server.fake = self
+        self._thread: T.Optional[threading.Thread] = None
+
+    @property
+    def host(self) -> str:
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def get_reply(self, command: str) -> Reply:
+        """
+        Return the reply to the command, see the ``replies`` parameter.
+        """
+        stripped = command.strip()
+        reply = self.default_reply
+        for prefix, reply_like in self.replies:
+            if stripped.startswith(prefix):
+                reply = reply_like
+                break
+        if isinstance(reply, Reply):
+            return reply
+        return reply(stripped)
+
+    def _roll(self) -> T.Tuple[float, str]:
+        with self._lock:
+            if isinstance(self.latency, tuple):
+                latency = self._random.uniform(*self.latency)
+            else:
+                latency = self.latency
+            x = self._random.random()
+        if x < self.drop_rate:
+            return latency, "drop"
+        if x < self.drop_rate + self.error_rate:
+            return latency, "error"
+        return latency, "ok"
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _enter(self, command: str):
+        with self._lock:
+            self.commands.append(command)
+            self.in_flight += 1
+            if self.in_flight > self.max_in_flight:
+                self.max_in_flight = self.in_flight
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self) -> T.Dict[str, int]:
+        """
+        Return the reply counters, the number of received commands and the max
+        number of commands processed at the same time.
+        """
+        with self._lock:
+            return dict(
+                requests=len(self.commands),
+                max_in_flight=self.max_in_flight,
+                **self.counters,
+            )
+
+    def make_request(self, command: str, **kwargs):
+        """
+        Create a :class:`~acore_soap_app.agent.impl.SOAPRequest` that targets
+        this server.
+        """
+        from ..agent.impl import SOAPRequest
+
+        kwargs.setdefault("username", self.username)
+        kwargs.setdefault("password", self.password)
+        return SOAPRequest(command=command, host=self.host, port=self.port, **kwargs)
+
+    def start(self) -> "FakeSOAPServer":
+        """
+        Serve in a background daemon thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "FakeSOAPServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+A stubbed SSM client on a virtual clock, for testing and benchmarking how the
+SDK polls the SSM Run Command invocation.
+
+moto 的 ``get_command_invocation`` 总是立刻返回 ``Success``, 没法模拟真实的执行时间.
+:class:`FakeSSMClient` 只实现 ``get_command_invocation``:
+
+- 前 ``visible_after`` 秒内抛出 ``InvocationDoesNotExist`` 错误, 和命令刚发送时一样.
+- 之后直到 ``duration`` 秒返回 ``InProgress``, 然后返回 ``Success``.
+
+时间是虚拟的, 把 :meth:`FakeSSMClient.sleep` 和 :meth:`FakeSSMClient.clock` 交给
+:func:`~acore_soap_app.sdk.polling.wait_command_invocation`, 等待不会真正消耗时间.
+
+Usage example:
+
+.. code-block:: python
+
+    >>> from acore_soap_app.tests.fake_ssm_client import FakeSSMClient
+    >>> ssm_client = FakeSSMClient(duration=0.3)
+    >>> wait_command_invocation(
+    ...     ssm_client, "c-1", "i-1", sleep=ssm_client.sleep, clock=ssm_client.clock
+    ... )
+    >>> ssm_client.now, ssm_client.calls
+"""
+
+from botocore.exceptions import ClientError
+
+
+class FakeSSMClient:
+    """
+    :param duration: the seconds since the start that the command finishes.
+    :param visible_after: the seconds since the start that the invocation
+        becomes visible.
+    :param output: the stdout of the finished command.
+    """
+
+    def __init__(
+        self,
+        duration: float = 1.0,
+        visible_after: float = 0.1,
+        output: str = "",
+    ):
+        self.duration = duration
+        self.visible_after = visible_after
+        self.output = output
+        self.now = 0.0
+        self.calls = 0
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+    def clock(self) -> float:
+        return self.now
+
+    def get_command_invocation(self, CommandId: str, InstanceId: str) -> dict:
+        self.calls += 1
+        if self.now < self.visible_after:
+            raise ClientError(
+                {"Error": {"Code": "InvocationDoesNotExist"}}, "GetCommandInvocation"
+            )
+        response = dict(CommandId=CommandId, InstanceId=InstanceId)
+        if self.now < self.duration:
+            response.update(Status="InProgress", ResponseCode=-1)
+        else:
+            response.update(
+                Status="Success",
+                ResponseCode=0,
+                StandardOutputContent=self.output,
+            )
+        return response
@@ -45,6 +45,7 @@ class BaseMockTest:
 
     @classmethod
     def setup_moto(cls):
+        cls._mock_list = list()
         if cls.use_mock:
             for mock_abc in cls.mock_list:
                 mocker = mock_abc()
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-phase timing instrumentation.
+
+一个需要 40 秒的批量任务, 时间到底花在了哪里? 本模块在 agent 和 SDK 的关键路径上用
+:func:`timer` 记录每个阶段 (:class:`Phase`) 的耗时, 并交给所有已注册的 :class:`Collector`:
+
+- ``build``: 构造 SOAP 请求的 payload.
+- ``throttle``: 等待 rate limiter.
+- ``http``: HTTP 请求, 包括建立连接, 发送, 以及等待并接收响应.
+- ``parse``: 解析 SOAP 响应.
+- ``s3_upload`` / ``s3_download``: 读写 S3 (对于流式读取, 只包含发起请求的时间).
+- ``server_lookup``: SDK 查询 EC2 / RDS 的状态.
+- ``ssm_submit`` / ``ssm_wait``: SDK 提交 SSM Run Command, 以及等待其完成.
+
+没有注册任何 collector 的时候, :func:`timer` 几乎没有开销. 内置的
+:class:`HistogramCollector` 为每个阶段计算 p50 / p95 / p99. 每个阶段最多在内存中保存
+``max_samples`` 个样本, 在此之内百分位数是精确的. 超过之后用 reservoir sampling 保留一个
+均匀的随机样本, 百分位数变成近似值 (``max`` 和 ``count``, ``total``, ``mean`` 仍然是精确的),
+换来的是在 ``acsoap serve`` 这种长时间运行的进程中内存不会无限增长. collector 是进程级别的,
+在 daemon 中同时执行的多个请求会记录到同一个 collector 中.
+
+Usage example:
+
+.. code-block:: python
+
+    >>> from acore_soap_app.timing import collect
+    >>> with collect() as collector:
+    ...     run_soap_command(bsm, "sbx-blue", ".server info")
+    >>> print(collector.format_summary())
+"""
+
+import typing as T
+import math
+import time
+import enum
+import random
+import threading
+import contextlib
+
+
+class Phase(str, enum.Enum):
+    BUILD = "build"
+    THROTTLE = "throttle"
+    HTTP = "http"
+    PARSE = "parse"
+    S3_UPLOAD = "s3_upload"
+    S3_DOWNLOAD = "s3_download"
+    SERVER_LOOKUP = "server_lookup"
+    SSM_SUBMIT = "ssm_submit"
+    SSM_WAIT = "ssm_wait"
+
+
+class Collector:
+    """
+    Base class of the timing collectors, :meth:`record` may be called from
+    many threads at the same time.
+    """
+
+    def record(self, phase: str, seconds: float):  # pragma: no cover
+        raise NotImplementedError
+
+
+#: the max number of samples kept in memory by each :class:`Histogram`
+DEFAULT_MAX_SAMPLES = 10000
+
+
+class Histogram:
+    """
+    Keep up to ``max_samples`` samples in memory, the percentiles are exact
+    until then. After that a uniform random sample of all the values is kept
+    (reservoir sampling), and the percentiles are estimates. The count,
+    total and max are always exact. Not thread-safe on its own.
+
+    :param max_samples: the max number of samples kept in memory.
+    :param rand: the function that returns a random float in ``[0, 1)``.
+    """
+
+    def __init__(
+        self,
+        max_samples: int = DEFAULT_MAX_SAMPLES,
+        rand: T.Callable[[], float] = random.random,
+    ):
+        if max_samples < 1:
+            raise ValueError("max_samples must be greater than 0")
+        self.max_samples = max_samples
+        self.rand = rand
+        self.samples: T.List[float] = list()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._sorted = True
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        if self.count == 1 or value > self.max:
+            self.max = value
+        if len(self.samples) < self.max_samples:
+            if self.samples and value < self.samples[-1]:
+                self._sorted = False
+            self.samples.append(value)
+            return
+        # keep each of the values seen so far with the same probability
+        i = int(self.rand() * self.count)
+        if i < self.max_samples:
+            self.samples[i] = value
+            self._sorted = False
+
+    def percentile(self, q: float) -> float:
+        """
+        Return the ``q`` (0 ~ 100) percentile with the nearest-rank method.
+        """
+        if not self.samples:
+            return 0.0
+        if q >= 100:
+            return self.max
+        if not self._sorted:
+            self.samples.sort()
+            self._sorted = True
+        rank = max(math.ceil(q / 100 * len(self.samples)), 1)
+        return self.samples[rank - 1]
+
+    def summary(self) -> T.Dict[str, float]:
+        count = self.count
+        return {
+            "count": count,
+            "total": self.total,
+            "mean": self.total / count if count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class HistogramCollector(Collector):
+    """
+    Thread-safe collector with one :class:`Histogram` per phase.
+
+    :param max_samples: the max number of samples kept for each phase.
+    """
+
+    def __init__(self, max_samples: int = DEFAULT_MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.histograms: T.Dict[str, Histogram] = dict()
+        self._lock = threading.Lock()
+
+    def record(self, phase: str, seconds: float):
+        phase = getattr(phase, "value", phase)  # Phase -> str
+        with self._lock:
+            try:
+                histogram = self.histograms[phase]
+            except KeyError:
+                histogram = Histogram(max_samples=self.max_samples)
+                self.histograms[phase] = histogram
+            histogram.add(seconds)
+
+    def summary(self) -> T.Dict[str, T.Dict[str, float]]:
+        """
+        Return the count, total, mean, p50, p95, p99 and max (in seconds) of
+        each phase, in the order of :class:`Phase`.
+        """
+        with self._lock:
+            order = {phase.value: i for i, phase in enumerate(Phase)}
+            phases = sorted(
+                self.histograms, key=lambda p: (order.get(p, len(order)), p)
+            )
+            return {phase: self.histograms[phase].summary() for phase in phases}
+
+    def format_summary(self) -> str:
+        """
+        Render the summary as a text table, the latencies are in milliseconds.
+        """
+        lines = [
+            f"{'phase':<14}{'count':>8}{'total(s)':>10}"
+            f"{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+        ]
+        for phase, s in self.summary().items():
+            lines.append(
+                f"{phase:<14}{s['count']:>8}{s['total']:>10.3f}"
+                + "".join(
+                    f"{s[key] * 1000:>9.2f}"
+                    for key in ["mean", "p50", "p95", "p99", "max"]
+                )
+            )
+        return "\n".join(lines)
+
+
+# copy on write, so that record() can iterate without a lock
+_collectors: T.Tuple[Collector, ...] = tuple()
+_collectors_lock = threading.Lock()
+
+
+def add_collector(collector: Collector):
+    global _collectors
+    with _collectors_lock:
+        _collectors = _collectors + (collector,)
+
+
+def remove_collector(collector: Collector):
+    global _collectors
+    with _collectors_lock:
+        _collectors = tuple(c for c in _collectors if c is not collector)
+
+
+def record(phase: str, seconds: float):
+    """
+    Send a timing to all the registered collectors.
+    """
+    for collector in _collectors:
+        collector.record(phase, seconds)
+
+
+class _Timer:
+    __slots__ = ("phase", "start")
+
+    def __init__(self, phase: str):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # failed calls are recorded too, they took time as well
+        record(self.phase, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def timer(phase: str) -> T.ContextManager:
+    """
+    Time the ``with`` block as ``phase``, it does nothing if there is no
+    collector.
+    """
+    if _collectors:
+        return _Timer(phase)
+    return _null_timer
+
+
+@contextlib.contextmanager
+def collect(collector: T.Optional[Collector] = None):
+    """
+    Register a collector (a new :class:`HistogramCollector` by default) for
+    the duration of the ``with`` block.
+    """
+    if collector is None:
+        collector = HistogramCollector()
+    add_collector(collector)
+    try:
+        yield collector
+    finally:
+        remove_collector(collector)
@@ -1,25 +1,456 @@
 # -*- coding: utf-8 -*-
 
+import typing as T
+import io
+import gzip
+import json
+import zlib
 
-def get_object(s3_client, s3uri: str) -> str:
+from .timing import Phase, timer
+
+# S3 multipart upload requires every part except the last one >= 5MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+JSON_LINES_SUFFIXES = (".jsonl", ".ndjson")
+
+GZIP = "gzip"
+ZSTD = "zstd"
+COMPRESSION_SUFFIXES = {
+    ".gz": GZIP,
+    ".gzip": GZIP,
+    ".zst": ZSTD,
+    ".zstd": ZSTD,
+}
+_CONTENT_ENCODINGS = {
+    "gzip": GZIP,
+    "x-gzip": GZIP,
+    "zstd": ZSTD,
+}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+_READ_CHUNK_SIZE = 256 * 1024
+
+
+def split_s3uri(s3uri: str) -> T.Tuple[str, str]:
     """
-    从 S3 中读取一个对象, 并返回其文本内容.
+    将 ``s3://bucket/key`` 拆分成 bucket 和 key.
     """
     parts = s3uri.split("/", 3)
-    bucket, key = parts[2], parts[3]
-    response = s3_client.get_object(Bucket=bucket, Key=key)
-    return response["Body"].read().decode("utf-8")
+    return parts[2], parts[3]
+
+
+def get_compression(s3uri: str) -> T.Optional[str]:
+    """
+    根据文件扩展名判断压缩格式. ``.gz`` 为 gzip, ``.zst`` 为 zstd, 否则返回 None.
+    """
+    for suffix, compression in COMPRESSION_SUFFIXES.items():
+        if s3uri.endswith(suffix):
+            return compression
+    return None
+
+
+def strip_compression_suffix(s3uri: str) -> str:
+    """
+    去掉压缩格式的扩展名, 例如 ``data.jsonl.gz`` -> ``data.jsonl``.
+    """
+    for suffix in COMPRESSION_SUFFIXES:
+        if s3uri.endswith(suffix):
+            return s3uri[: -len(suffix)]
+    return s3uri
+
+
+def is_json_lines(s3uri: str) -> bool:
+    """
+    根据文件扩展名判断是否是 JSON Lines 格式. 压缩格式的扩展名会被忽略, 例如
+    ``data.jsonl.gz`` 也是 JSON Lines.
+    """
+    return strip_compression_suffix(s3uri).endswith(JSON_LINES_SUFFIXES)
+
+
+def _get_zstandard():
+    # only imported when a zstd object is read or written, it is not needed
+    # by the ``acsoap gm`` startup
+    try:
+        import zstandard
+    except ImportError:  # pragma: no cover
+        raise ImportError(
+            "zstd compression requires the 'zstandard' package, "
+            "please run 'pip install zstandard'"
+        )
+    return zstandard
+
+
+def _resolve_compression(s3uri: str, response: dict) -> T.Optional[str]:
+    """
+    先根据扩展名, 再根据对象的 ``ContentEncoding`` 判断压缩格式.
+    """
+    compression = get_compression(s3uri)
+    if compression is None:
+        content_encoding = response.get("ContentEncoding") or ""
+        compression = _CONTENT_ENCODINGS.get(content_encoding.strip().lower())
+    return compression
+
+
+def compress(data: bytes, compression: T.Optional[str]) -> bytes:
+    """
+    Compress the data with the given compression, None means no compression.
+    """
+    if compression is None:
+        return data
+    elif compression == GZIP:
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    elif compression == ZSTD:
+        return _get_zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    else:
+        raise ValueError(f"unknown compression: {compression!r}")
+
+
+def _new_compressor(compression: T.Optional[str]):
+    if compression is None:
+        return None
+    elif compression == GZIP:
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    elif compression == ZSTD:
+        return _get_zstandard().ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    else:
+        raise ValueError(f"unknown compression: {compression!r}")
+
+
+def _new_decompressor(compression: T.Optional[str]):
+    if compression is None:
+        return None
+    elif compression == GZIP:
+        return zlib.decompressobj(31)
+    elif compression == ZSTD:
+        return _get_zstandard().ZstdDecompressor().decompressobj()
+    else:
+        raise ValueError(f"unknown compression: {compression!r}")
+
+
+def _decompress_chunk(decompressor, compression: str, chunk: bytes):
+    """
+    Decompress a chunk that may span multiple gzip members or zstd frames,
+    e.g. files concatenated by ``cat``. A decompressor stops at the end of
+    the first one and keeps the rest in ``unused_data``, so a new one is
+    started for it. Return the decompressor to use for the next chunk and
+    the decompressed data.
+    """
+    data = b""
+    while chunk:
+        if decompressor.eof:
+            decompressor = _new_decompressor(compression)
+        data += decompressor.decompress(chunk)
+        chunk = decompressor.unused_data if decompressor.eof else b""
+    return decompressor, data
+
+
+def decompress(data: bytes, compression: T.Optional[str]) -> bytes:
+    """
+    Decompress the data with the given compression, None means no compression.
+    """
+    if compression is None:
+        return data
+    elif compression == GZIP:
+        return gzip.decompress(data)
+    else:
+        # the zstd frame written by a stream compressor doesn't have the
+        # content size, so we have to use the decompressobj
+        decompressor = _new_decompressor(compression)
+        decompressor, data = _decompress_chunk(decompressor, compression, data)
+        return data + decompressor.flush()
+
+
+def get_object(s3_client, s3uri: str) -> str:
+    """
+    从 S3 中读取一个对象, 并返回其文本内容. 如果对象是压缩过的 (根据扩展名或者
+    ``ContentEncoding`` 判断), 则自动解压.
+    """
+    bucket, key = split_s3uri(s3uri)
+    with timer(Phase.S3_DOWNLOAD):
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        data = response["Body"].read()
+    return decompress(data, _resolve_compression(s3uri, response)).decode("utf-8")
 
 
 def put_object(s3_client, s3uri: str, body: str):
     """
-    将一个 JSON 对象保存到 S3 中.
+    将一个 JSON 对象保存到 S3 中. 如果扩展名是 ``.gz`` 或 ``.zst``, 则自动压缩,
+    并设置对应的 ``ContentEncoding``.
     """
-    parts = s3uri.split("/", 3)
-    bucket, key = parts[2], parts[3]
-    return s3_client.put_object(
+    bucket, key = split_s3uri(s3uri)
+    compression = get_compression(s3uri)
+    kwargs = dict(
         Bucket=bucket,
         Key=key,
-        Body=body,
+        Body=compress(body.encode("utf-8"), compression),
         ContentType="application/json",
     )
+    if compression is not None:
+        kwargs["ContentEncoding"] = compression
+    with timer(Phase.S3_UPLOAD):
+        return s3_client.put_object(**kwargs)
+
+
+class _RawStream(io.RawIOBase):
+    """
+    Adapt the boto3 ``StreamingBody`` to a raw binary stream, so that it can
+    be wrapped by :class:`io.BufferedReader` and :class:`io.TextIOWrapper`.
+    If a ``compression`` is given, the data is decompressed on the fly.
+    """
+
+    def __init__(self, body, compression: T.Optional[str] = None):
+        self._body = body
+        self._compression = compression
+        self._decompressor = _new_decompressor(compression)
+        self._pending = b""
+        self._offset = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def _read_decompressed(self, size: int) -> bytes:
+        while self._offset >= len(self._pending):
+            chunk = self._body.read(_READ_CHUNK_SIZE)
+            if chunk:
+                self._decompressor, self._pending = _decompress_chunk(
+                    self._decompressor, self._compression, chunk
+                )
+            else:
+                self._pending = self._decompressor.flush()
+            self._offset = 0
+            if not chunk:
+                break
+        data = self._pending[self._offset : self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def readinto(self, b) -> int:
+        if self._decompressor is None:
+            data = self._body.read(len(b))
+        else:
+            data = self._read_decompressed(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+    def close(self):
+        self._body.close()
+        super().close()
+
+
+def open_object(s3_client, s3uri: str) -> T.TextIO:
+    """
+    以流的方式打开一个 S3 对象, 返回一个可以逐行读取的文本文件对象. 如果对象是压缩过的,
+    则在读取的同时解压.
+    """
+    bucket, key = split_s3uri(s3uri)
+    with timer(Phase.S3_DOWNLOAD):
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+    raw = _RawStream(
+        response["Body"],
+        compression=_resolve_compression(s3uri, response),
+    )
+    buffer = io.BufferedReader(raw, buffer_size=1024 * 1024)
+    return io.TextIOWrapper(buffer, encoding="utf-8")
+
+
+def iter_json_lines(lines: T.Iterable[str]) -> T.Iterator[T.Any]:
+    """
+    逐行解析 JSON Lines, 忽略空行.
+    """
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_json_objects(s3_client, s3uri: str) -> T.Iterator[T.Any]:
+    """
+    以流的方式从 S3 中读取多个 JSON 对象. 支持以下几种格式:
+
+    - JSON Lines: 每行一个 JSON 对象. 如果扩展名是 ``.jsonl`` 或 ``.ndjson``,
+        或者第一行本身就是一个完整的 JSON object, 就视为 JSON Lines. 这种格式是真正流式
+        读取的, 内存占用和文件大小无关.
+    - JSON 数组: 返回数组中的每一个元素.
+    - 单个 JSON 对象 (可以跨多行): 只返回这一个对象.
+    """
+    with open_object(s3_client, s3uri) as f:
+        if is_json_lines(s3uri):
+            yield from iter_json_lines(f)
+            return
+
+        first_line = ""
+        for first_line in f:
+            if first_line.strip():
+                break
+        stripped = first_line.lstrip()
+        if stripped.startswith("{"):
+            try:
+                first = json.loads(first_line)
+            except json.JSONDecodeError:
+                # a single JSON object across multiple lines
+                yield json.loads(first_line + f.read())
+                return
+            yield first
+            yield from iter_json_lines(f)
+        elif stripped:
+            data = json.loads(first_line + f.read())
+            if isinstance(data, list):
+                yield from data
+            else:
+                yield data
+
+
+class S3ObjectWriter:
+    """
+    增量地把数据写入 S3 对象. 数据会先在内存中缓冲, 每当缓冲区大于 ``part_size`` 时就作为
+    multipart upload 的一个 part 上传. 如果总数据量小于 ``part_size``, 则在 :meth:`close`
+    的时候用一次 ``put_object`` 完成上传. 内存占用的上限大约是 ``part_size``.
+
+    如果在写入过程中出现异常 (在 with 语句中), 未完成的 multipart upload 会被取消,
+    S3 中不会留下不完整的对象.
+
+    如果指定了 ``compression`` (``"gzip"`` 或 ``"zstd"``), 写入的数据会被流式压缩,
+    ``part_size`` 指的是压缩后的大小.
+
+    Usage example:
+
+    .. code-block:: python
+
+        >>> with S3ObjectWriter(s3_client, "s3://bucket/output.jsonl") as writer:
+        ...     for line in lines:
+        ...         writer.write(line.encode("utf-8"))
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        s3uri: str,
+        content_type: str = "application/json",
+        part_size: int = DEFAULT_PART_SIZE,
+        compression: T.Optional[str] = None,
+    ):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes")
+        self.s3_client = s3_client
+        self.bucket, self.key = split_s3uri(s3uri)
+        self.content_type = content_type
+        self.part_size = part_size
+        self.compression = compression
+        self._compressor = _new_compressor(compression)
+        self._buffer = bytearray()
+        self._upload_id: T.Optional[str] = None
+        self._parts: T.List[dict] = list()
+
+    def _object_kwargs(self) -> dict:
+        kwargs = dict(
+            Bucket=self.bucket,
+            Key=self.key,
+            ContentType=self.content_type,
+        )
+        if self.compression is not None:
+            kwargs["ContentEncoding"] = self.compression
+        return kwargs
+
+    def _upload_part(self, data: bytes):
+        with timer(Phase.S3_UPLOAD):
+            if self._upload_id is None:
+                response = self.s3_client.create_multipart_upload(
+                    **self._object_kwargs()
+                )
+                self._upload_id = response["UploadId"]
+            part_number = len(self._parts) + 1
+            response = self.s3_client.upload_part(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+                PartNumber=part_number,
+                Body=data,
+            )
+        self._parts.append(dict(PartNumber=part_number, ETag=response["ETag"]))
+
+    def write(self, data: bytes):
+        """
+        Append bytes to the object.
+        """
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._buffer += data
+        if len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer))
+            self._buffer.clear()
+
+    def close(self):
+        """
+        Upload the remaining data and finish the upload.
+        """
+        if self._compressor is not None:
+            self._buffer += self._compressor.flush()
+        if self._upload_id is None:
+            with timer(Phase.S3_UPLOAD):
+                self.s3_client.put_object(
+                    Body=bytes(self._buffer), **self._object_kwargs()
+                )
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            with timer(Phase.S3_UPLOAD):
+                self.s3_client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self._upload_id,
+                    MultipartUpload=dict(Parts=self._parts),
+                )
+        self._buffer.clear()
+
+    def abort(self):
+        """
+        Cancel the upload, nothing will be written to S3.
+        """
+        if self._upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+            )
+        self._buffer.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_json_objects(
+    s3_client,
+    s3uri: str,
+    json_strs: T.Iterable[str],
+    part_size: int = DEFAULT_PART_SIZE,
+):
+    """
+    增量地将多个已经序列化好的 JSON 字符串写入到 S3. 如果扩展名是 ``.jsonl`` 或
+    ``.ndjson``, 则使用 JSON Lines 格式, 否则使用 JSON 数组格式. 如果再加上 ``.gz``
+    或 ``.zst`` 扩展名 (例如 ``output.jsonl.gz``), 则同时进行压缩.
+    """
+    json_lines = is_json_lines(s3uri)
+    with S3ObjectWriter(
+        s3_client,
+        s3uri,
+        content_type="application/x-ndjson" if json_lines else "application/json",
+        part_size=part_size,
+        compression=get_compression(s3uri),
+    ) as writer:
+        if json_lines:
+            for json_str in json_strs:
+                writer.write(json_str.encode("utf-8") + b"\n")
+        else:
+            writer.write(b"[")
+            for ith, json_str in enumerate(json_strs):
+                if ith:
+                    writer.write(b", ")
+                writer.write(json_str.encode("utf-8"))
+            writer.write(b"]")
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the memory footprint of 100k :class:`~acore_soap_app.agent.impl.SOAPRequest`
+and :class:`~acore_soap_app.agent.impl.SOAPResponse` objects, the legacy
+``__dict__`` based dataclass vs the slotted one, with and without the raw body.
+
+Usage::
+
+    python benchmarks/bench_agent_memory.py
+"""
+
+import typing as T
+import gc
+import dataclasses
+import tracemalloc
+
+from acore_soap_app.paths import dir_unit_test
+from acore_soap_app.agent.impl import SOAPRequest, SOAPResponse
+
+body = dir_unit_test.joinpath("agent", "success.xml").read_text(encoding="utf-8")
+
+
+@dataclasses.dataclass
+class LegacySOAPRequest:
+    command: str = dataclasses.field()
+    username: T.Optional[str] = dataclasses.field(default=None)
+    password: T.Optional[str] = dataclasses.field(default=None)
+    host: T.Optional[str] = dataclasses.field(default=None)
+    port: T.Optional[int] = dataclasses.field(default=None)
+
+
+@dataclasses.dataclass
+class LegacySOAPResponse:
+    body: str = dataclasses.field()
+    message: str = dataclasses.field()
+    succeeded: bool = dataclasses.field()
+
+
+def measure(factory: T.Callable[[int], T.Any], n: int) -> int:
+    """
+    Return the number of bytes allocated to build ``n`` objects.
+    """
+    gc.collect()
+    tracemalloc.start()
+    objects = [factory(i) for i in range(n)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return current
+
+
+def main(n: int = 100_000):
+    # every object owns its own body string, like responses coming off the wire
+    cases = [
+        (
+            "SOAPRequest (legacy)",
+            lambda i: LegacySOAPRequest(command=f".account create user{i} pwd"),
+        ),
+        (
+            "SOAPRequest (slots)",
+            lambda i: SOAPRequest(command=f".account create user{i} pwd"),
+        ),
+        (
+            "SOAPResponse (legacy)",
+            lambda i: LegacySOAPResponse(
+                body=body.replace("test", f"user{i}"),
+                message=f"Account created: user{i}",
+                succeeded=True,
+            ),
+        ),
+        (
+            "SOAPResponse (slots)",
+            lambda i: SOAPResponse.parse(body.replace("test", f"user{i}")),
+        ),
+        (
+            "SOAPResponse (slots, no body)",
+            lambda i: SOAPResponse.parse(
+                body.replace("test", f"user{i}"), keep_body=False
+            ),
+        ),
+    ]
+    print(f"{'case':<32} {'MB per 100k':>12} {'bytes / object':>16}")
+    for name, factory in cases:
+        size = measure(factory, n)
+        print(f"{name:<32} {size / 1024 / 1024 * 100_000 / n:>12.1f} {size / n:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark :meth:`acore_soap_app.agent.impl.SOAPResponse.parse` throughput,
+the fast path parser vs the ElementTree parser, on the XML fixtures in
+``tests/agent/``.
+
+Usage::
+
+    python benchmarks/bench_agent_parser.py
+"""
+
+import timeit
+
+from acore_soap_app.paths import dir_unit_test
+from acore_soap_app.agent.impl import SOAPResponse
+
+dir_fixture = dir_unit_test / "agent"
+
+
+def bench(func, body: str, number: int) -> float:
+    """
+    Return the throughput in ops / second, best of 5 runs.
+    """
+    elapsed = min(timeit.repeat(lambda: func(body), number=number, repeat=5))
+    return number / elapsed
+
+
+def main(number: int = 20000):
+    print(f"{'fixture':<32} {'element tree':>16} {'fast path':>16} {'speedup':>8}")
+    for path in sorted(dir_fixture.glob("*.xml")):
+        body = path.read_text(encoding="utf-8")
+        slow = bench(SOAPResponse._parse_element_tree, body, number)
+        fast = bench(SOAPResponse.parse, body, number)
+        print(
+            f"{path.name:<32} {slow:>12,.0f} op/s {fast:>12,.0f} op/s "
+            f"{fast / slow:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark serializing 100k :class:`~acore_soap_app.agent.impl.SOAPResponse`
+objects, the legacy ``dataclasses.asdict`` based implementation vs the
+generated serializers in :mod:`acore_soap_app.agent.codec`.
+
+Usage::
+
+    python benchmarks/bench_agent_serialization.py
+"""
+
+import json
+import time
+import dataclasses
+
+from acore_soap_app.paths import dir_unit_test
+from acore_soap_app.agent.impl import SOAPResponse
+
+body = dir_unit_test.joinpath("agent", "success.xml").read_text(encoding="utf-8")
+
+
+def legacy_to_dict(obj) -> dict:
+    return {k: v for k, v in dataclasses.asdict(obj).items() if v is not None}
+
+
+def legacy_to_json(obj) -> str:
+    return json.dumps(legacy_to_dict(obj))
+
+
+def legacy_from_dict(cls, dct: dict):
+    return cls(**dct)
+
+
+def timer(func, objects) -> float:
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for obj in objects:
+            func(obj)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(n: int = 100_000):
+    responses = [SOAPResponse.parse(body) for _ in range(n)]
+    dicts = [response.to_dict() for response in responses]
+    cases = [
+        ("to_dict", legacy_to_dict, SOAPResponse.to_dict, responses),
+        ("to_json", legacy_to_json, SOAPResponse.to_json, responses),
+        (
+            "from_dict",
+            lambda dct: legacy_from_dict(SOAPResponse, dct),
+            SOAPResponse.from_dict,
+            dicts,
+        ),
+    ]
+    print(f"{n:,} SOAPResponse objects")
+    print(f"{'method':<12} {'legacy':>10} {'generated':>10} {'speedup':>8}")
+    for name, legacy, generated, objects in cases:
+        t1 = timer(legacy, objects)
+        t2 = timer(generated, objects)
+        print(f"{name:<12} {t1:>9.3f}s {t2:>9.3f}s {t1 / t2:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
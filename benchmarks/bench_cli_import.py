@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the import time of the ``acsoap`` CLI with ``python -X importtime``.
+
+Every GM command sent over SSM Run Command is a new ``acsoap gm`` process, so
+this startup cost is paid once per command. Each scenario is imported in a
+fresh interpreter ``--repeat`` times, the median of the cumulative import time
+of the modules that are not already loaded by the interpreter startup is
+compared with its budget. The script also checks that none of the heavy
+dependencies that the scenario doesn't need is imported.
+
+It exits with status 1 if any scenario is over budget or imports a forbidden
+module, so it can be used as a regression check in CI.
+
+Usage::
+
+    python benchmarks/bench_cli_import.py
+    python benchmarks/bench_cli_import.py --repeat 20 --factor 1.5
+"""
+
+import typing as T
+import sys
+import argparse
+import statistics
+import subprocess
+import dataclasses
+
+#: the heavy third party dependencies
+HEAVY_MODULES = [
+    "requests",
+    "boto3",
+    "botocore",
+    "boto_session_manager",
+    "simple_aws_ec2",
+    "aws_ssm_run_command",
+    "acore_server_metadata",
+    "acore_constants",
+    "zstandard",
+]
+
+
+@dataclasses.dataclass
+class Scenario:
+    name: str
+    code: str
+    budget: float  # milliseconds
+    forbidden: T.List[str]
+
+
+SCENARIOS = [
+    Scenario(
+        name="import acore_soap_app",
+        code="import acore_soap_app",
+        budget=20,
+        forbidden=HEAVY_MODULES,
+    ),
+    Scenario(
+        name="import acore_soap_app.cli.main",
+        code="import acore_soap_app.cli.main",
+        budget=20,
+        forbidden=HEAVY_MODULES + ["fire"],
+    ),
+    Scenario(
+        # what ``acsoap gm`` loads when the ``acsoap serve`` daemon is running
+        name="acsoap gm (daemon)",
+        code="import fire, acore_soap_app.cli.main, acore_soap_app.cli.impl",
+        budget=200,
+        forbidden=HEAVY_MODULES,
+    ),
+    Scenario(
+        # what ``acsoap gm`` loads when it runs the command in-process
+        name="acsoap gm (in-process)",
+        code=(
+            "import fire, acore_soap_app.cli.impl, acore_soap_app.agent.batch, "
+            "acore_soap_app.agent.ratelimit"
+        ),
+        budget=400,
+        forbidden=[m for m in HEAVY_MODULES if m != "requests"],
+    ),
+]
+
+
+def parse_importtime(stderr: str) -> T.List[T.Tuple[int, str, int]]:
+    """
+    Parse the ``-X importtime`` output into ``(depth, module, cumulative_us)``.
+    """
+    rows = list()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((depth, name.strip(), int(cumulative)))
+    return rows
+
+
+def run_importtime(code: str) -> T.List[T.Tuple[int, str, int]]:
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(res.stderr)
+
+
+def measure(code: str, startup: T.Set[str]) -> T.Tuple[float, T.Set[str]]:
+    """
+    Return the cumulative import time in milliseconds of the top level imports
+    that are not done by the interpreter startup, and all imported modules.
+    """
+    rows = run_importtime(code)
+    total = sum(
+        cumulative
+        for depth, name, cumulative in rows
+        if depth == 0 and name not in startup
+    )
+    return total / 1000, {name for _, name, _ in rows}
+
+
+def main(repeat: int = 10, factor: float = 1.0) -> bool:
+    startup = {name for _, name, _ in run_importtime("pass")}
+    ok = True
+    print(f"{'scenario':<36} {'median':>10} {'budget':>10}  status")
+    for scenario in SCENARIOS:
+        timings = list()
+        modules = set()
+        for _ in range(repeat):
+            elapsed, modules = measure(scenario.code, startup)
+            timings.append(elapsed)
+        median = statistics.median(timings)
+        budget = scenario.budget * factor
+        loaded = sorted(
+            m for m in scenario.forbidden if m in modules and m not in startup
+        )
+        status = "ok"
+        if median > budget:
+            status = "OVER BUDGET"
+            ok = False
+        if loaded:
+            status = f"FORBIDDEN IMPORTS: {', '.join(loaded)}"
+            ok = False
+        print(f"{scenario.name:<36} {median:>7.1f} ms {budget:>7.1f} ms  {status}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--factor",
+        type=float,
+        default=1.0,
+        help="multiply all the budgets, e.g. 2.0 on a slow machine",
+    )
+    args = parser.parse_args()
+    sys.exit(0 if main(repeat=args.repeat, factor=args.factor) else 1)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark how long the SDK waits for a SSM Run Command, fixed vs adaptive polling.
+
+Each scenario is a command that finishes after about ``duration`` seconds
+(+/- 20%), simulated by :class:`~acore_soap_app.tests.fake_ssm_client.FakeSSMClient`
+on a virtual clock, so the benchmark runs instantly. The invocation becomes
+visible after a random delay of up to ``--max-visible-after`` seconds. For each polling
+strategy it reports the mean overhead, the time between the command finishes
+and the SDK sees the result, and the mean number of ``GetCommandInvocation``
+calls over ``--trials`` runs:
+
+- ``fixed``: the old behavior, ``time.sleep(1)`` then poll every ``delays``
+  (1) seconds.
+- ``adaptive``: the default :class:`~acore_soap_app.sdk.polling.PollingStrategy`
+  with ``max_delay=delays``.
+
+It exits with status 1 if the adaptive strategy waits longer than the fixed
+one by more than ``--tolerance`` seconds in any scenario.
+
+Usage::
+
+    python benchmarks/bench_ssm_polling.py
+    python benchmarks/bench_ssm_polling.py --trials 1000 --seed 1
+"""
+
+import typing as T
+import sys
+import random
+import argparse
+import statistics
+import dataclasses
+
+from acore_soap_app.sdk.polling import PollingStrategy, wait_command_invocation
+from acore_soap_app.tests.fake_ssm_client import FakeSSMClient
+
+
+@dataclasses.dataclass
+class Scenario:
+    name: str
+    duration: float  # seconds
+    n_requests: int = 1
+    workers: int = 1
+
+
+SCENARIOS = [
+    Scenario(name="single command 0.3s", duration=0.3),
+    Scenario(name="single command 0.8s", duration=0.8),
+    Scenario(name="single command 1.5s", duration=1.5),
+    Scenario(name="batch 200 x 1 worker 3s", duration=3, n_requests=200),
+    Scenario(name="batch 1000 x 8 workers 2s", duration=2, n_requests=1000, workers=8),
+    Scenario(name="batch 5000 x 1 worker 30s", duration=30, n_requests=5000),
+]
+
+
+def make_strategies(rand: T.Callable[[], float]) -> T.Dict[str, PollingStrategy]:
+    return {
+        "fixed": PollingStrategy(
+            initial_delay=1, max_delay=1, jitter=0, per_request=0
+        ),
+        "adaptive": PollingStrategy(max_delay=1, rand=rand),
+    }
+
+
+def run_trial(
+    scenario: Scenario,
+    polling: PollingStrategy,
+    duration: float,
+    visible_after: float,
+) -> T.Tuple[float, int]:
+    """
+    Return the overhead in seconds and the number of API calls.
+    """
+    ssm_client = FakeSSMClient(duration=duration, visible_after=visible_after)
+    wait_command_invocation(
+        ssm_client,
+        "c-1",
+        "i-1",
+        timeout=duration + 60,
+        polling=polling,
+        n_requests=scenario.n_requests,
+        workers=scenario.workers,
+        sleep=ssm_client.sleep,
+        clock=ssm_client.clock,
+    )
+    return ssm_client.now - duration, ssm_client.calls
+
+
+def main(
+    trials: int = 200,
+    seed: int = 0,
+    max_visible_after: float = 0.5,
+    tolerance: float = 0.05,
+) -> bool:
+    rng = random.Random(seed)
+    strategies = make_strategies(rng.random)
+    ok = True
+    print(f"{'scenario':<28} {'strategy':<10} {'overhead':>9} {'calls':>7}")
+    for scenario in SCENARIOS:
+        durations = [scenario.duration * rng.uniform(0.8, 1.2) for _ in range(trials)]
+        visible_afters = [
+            min(rng.uniform(0, max_visible_after), duration) for duration in durations
+        ]
+        overheads = dict()
+        for name, polling in strategies.items():
+            results = [
+                run_trial(scenario, polling, duration, visible_after)
+                for duration, visible_after in zip(durations, visible_afters)
+            ]
+            overhead = statistics.mean(seconds for seconds, _ in results)
+            calls = statistics.mean(n for _, n in results)
+            overheads[name] = overhead
+            print(f"{scenario.name:<28} {name:<10} {overhead:>8.2f}s {calls:>7.1f}")
+        if overheads["adaptive"] > overheads["fixed"] + tolerance:
+            print(f"{scenario.name:<28} REGRESSION: adaptive waits longer")
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--trials", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--max-visible-after",
+        type=float,
+        default=0.5,
+        help="the max seconds before the invocation is visible",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.05,
+        help="the allowed extra overhead in seconds of the adaptive strategy",
+    )
+    args = parser.parse_args()
+    ok = main(
+        trials=args.trials,
+        seed=args.seed,
+        max_visible_after=args.max_visible_after,
+        tolerance=args.tolerance,
+    )
+    sys.exit(0 if ok else 1)
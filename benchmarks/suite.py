@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end benchmark suite for the agent and SDK hot paths, runs offline.
+
+- ``parse.*``: :meth:`~acore_soap_app.agent.impl.SOAPResponse.parse` on the XML
+  fixtures in ``tests/agent/``.
+- ``serialize.*``: :meth:`~acore_soap_app.agent.impl.Base.to_dict` and
+  :meth:`~acore_soap_app.agent.impl.Base.to_json`.
+- ``batch_load.*``: :meth:`~acore_soap_app.agent.impl.SOAPRequest.batch_load`
+  on a large list and on JSON / JSON Lines S3 inputs (mocked by moto).
+- ``gm.*``: :func:`acore_soap_app.cli.impl.run_gm` batch throughput against a
+  local :class:`~acore_soap_app.tests.fake_soap_server.FakeSOAPServer`.
+- ``run_soap_command.*``: :func:`acore_soap_app.sdk.core.run_soap_command`
+  overhead (server lookup + SSM send command) with EC2, RDS and SSM mocked
+  by moto, with and without an
+  :class:`~acore_soap_app.sdk.resolver.InstanceResolver`.
+
+Every benchmark reports the throughput in operations per second of the best
+of ``--repeat`` runs. The results can be written to a JSON file and compared
+with a stored baseline, the script exits with status 1 if any benchmark is
+slower than the baseline by more than ``--tolerance``. The baseline depends on
+the machine, regenerate it with ``--save-baseline`` when it changes.
+
+Usage::
+
+    python benchmarks/suite.py
+    python benchmarks/suite.py -k parse -k serialize
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --baseline benchmarks/baseline.json --tolerance 0.25
+    python benchmarks/suite.py --save-baseline benchmarks/baseline.json
+"""
+
+import typing as T
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+import statistics
+import dataclasses
+from pathlib import Path
+from datetime import datetime, timezone
+
+from acore_soap_app import __version__
+from acore_soap_app.paths import dir_unit_test
+
+dir_here = Path(__file__).absolute().parent
+path_baseline = dir_here / "baseline.json"
+
+dir_fixture = dir_unit_test / "agent"
+
+#: ``setup(scale)`` is a context manager that yields ``(n_ops, func)``, the
+#: elapsed time of ``func()`` is divided by ``n_ops``.
+Setup = T.Callable[[float], T.ContextManager[T.Tuple[int, T.Callable[[], T.Any]]]]
+
+
+@dataclasses.dataclass
+class Benchmark:
+    name: str
+    setup: Setup
+
+
+BENCHMARKS: T.List[Benchmark] = list()
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark, the decorated generator function becomes its setup.
+    """
+
+    def decorator(func):
+        BENCHMARKS.append(Benchmark(name=name, setup=contextlib.contextmanager(func)))
+        return func
+
+    return decorator
+
+
+# ------------------------------------------------------------------------------
+# Benchmarks
+# ------------------------------------------------------------------------------
+def _make_parse_benchmark(path: Path):
+    from acore_soap_app.agent.impl import SOAPResponse
+
+    body = path.read_text(encoding="utf-8")
+
+    @benchmark(f"parse.{path.stem}")
+    def setup(scale: float):
+        n = int(20000 * scale)
+
+        def func():
+            for _ in range(n):
+                SOAPResponse.parse(body)
+
+        yield n, func
+
+
+for _path in sorted(dir_fixture.glob("*.xml")):
+    _make_parse_benchmark(_path)
+
+
+def _make_serialize_benchmark(method: str):
+    @benchmark(f"serialize.{method}")
+    def setup(scale: float):
+        from acore_soap_app.agent.impl import SOAPResponse
+
+        body = dir_fixture.joinpath("success.xml").read_text(encoding="utf-8")
+        responses = [SOAPResponse.parse(body) for _ in range(int(50000 * scale))]
+        serialize = getattr(SOAPResponse, method)
+
+        def func():
+            for response in responses:
+                serialize(response)
+
+        yield len(responses), func
+
+
+for _method in ["to_dict", "to_json"]:
+    _make_serialize_benchmark(_method)
+
+
+@benchmark("batch_load.list")
+def setup_batch_load_list(scale: float):
+    from acore_soap_app.agent.impl import SOAPRequest
+
+    commands = [f".account create user{i} pwd{i}" for i in range(int(100000 * scale))]
+    yield len(commands), lambda: SOAPRequest.batch_load(commands)
+
+
+@contextlib.contextmanager
+def mock_aws(*services: str):
+    """
+    Start the moto mocks of the given services with fake credentials.
+    """
+    import moto
+
+    env = {
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+    }
+    old_env = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    mocks = [getattr(moto, f"mock_{service}")() for service in services]
+    for mock in mocks:
+        mock.start()
+    try:
+        from boto_session_manager import BotoSesManager
+
+        yield BotoSesManager(region_name="us-east-1")
+    finally:
+        for mock in mocks:
+            mock.stop()
+        for key, value in old_env.items():
+            if value is None:
+                os.environ.pop(key)
+            else:
+                os.environ[key] = value
+
+
+def _make_batch_load_s3_benchmark(key: str):
+    @benchmark(f"batch_load.s3_{key.replace('.', '_')}")
+    def setup(scale: float):
+        from acore_soap_app.agent.impl import SOAPRequest
+
+        requests = [
+            SOAPRequest(command=f".account create user{i} pwd{i}")
+            for i in range(int(20000 * scale))
+        ]
+        s3uri = f"s3://bucket/input/{key}"
+        with mock_aws("s3") as bsm:
+            bsm.s3_client.create_bucket(Bucket="bucket")
+            SOAPRequest.batch_dump_to_s3(
+                s3_client=bsm.s3_client, instances=requests, s3uri=s3uri
+            )
+            yield len(requests), lambda: SOAPRequest.batch_load(
+                s3uri, s3_client=bsm.s3_client
+            )
+
+
+for _key in ["requests.json", "requests.jsonl", "requests.jsonl.gz"]:
+    _make_batch_load_s3_benchmark(_key)
+
+
+def _make_gm_benchmark(workers: int):
+    @benchmark(f"gm.batch.workers_{workers}")
+    def setup(scale: float):
+        from acore_soap_app.agent.transport import SOAPTransport
+        from acore_soap_app.cli.impl import run_gm
+        from acore_soap_app.tests.fake_soap_server import FakeSOAPServer
+
+        with FakeSOAPServer(max_concurrency=None) as server:
+            requests = [
+                server.make_request(f".account create user{i} pwd{i}")
+                for i in range(int(2000 * scale))
+            ]
+            transport = SOAPTransport(pool_maxsize=workers)
+            lines = list()
+
+            def func():
+                lines.clear()
+                run_gm(
+                    requests,
+                    workers=workers,
+                    keep_body=False,
+                    transport=transport,
+                    out=lines.append,
+                    err=print,
+                )
+                assert len(lines) == len(requests)
+
+            yield len(requests), func
+            transport.close()
+
+
+for _workers in [1, 8]:
+    _make_gm_benchmark(_workers)
+
+
+def _make_run_soap_command_benchmark(name: str, resolver_kwargs: T.Optional[dict]):
+    @benchmark(f"run_soap_command.{name}")
+    def setup(scale: float):
+        from acore_constants.api import TagKey
+        from acore_soap_app.sdk.core import run_soap_command
+        from acore_soap_app.sdk.resolver import InstanceResolver
+
+        resolver = None
+        if resolver_kwargs is not None:
+            resolver = InstanceResolver(**resolver_kwargs)
+        server_id = "sbx-blue"
+        with mock_aws("ec2", "rds", "ssm", "sts") as bsm:
+            image_id = bsm.ec2_client.describe_images()["Images"][0]["ImageId"]
+            bsm.ec2_client.run_instances(
+                ImageId=image_id,
+                MinCount=1,
+                MaxCount=1,
+                TagSpecifications=[
+                    dict(
+                        ResourceType="instance",
+                        Tags=[dict(Key=TagKey.SERVER_ID, Value=server_id)],
+                    )
+                ],
+            )
+            bsm.rds_client.create_db_instance(
+                DBInstanceIdentifier=server_id,
+                DBInstanceClass="db.t3.micro",
+                Engine="mysql",
+                MasterUsername="admin",
+                MasterUserPassword="password",
+                AllocatedStorage=20,
+                Tags=[dict(Key=TagKey.SERVER_ID, Value=server_id)],
+            )
+            n = max(int(20 * scale), 1)
+
+            def func():
+                for _ in range(n):
+                    # async mode returns the command id right after sending
+                    run_soap_command(
+                        bsm, server_id, [".server info"], sync=False, resolver=resolver
+                    )
+
+            yield n, func
+
+
+# submit: look up EC2 and RDS every time, resolver: cached instance id
+_make_run_soap_command_benchmark("submit", None)
+_make_run_soap_command_benchmark("submit_resolver", dict(ttl=3600))
+_make_run_soap_command_benchmark("submit_resolver_ec2_only", dict(ec2_only=True))
+
+
+# ------------------------------------------------------------------------------
+# Runner
+# ------------------------------------------------------------------------------
+def run_benchmark(
+    bench: Benchmark,
+    scale: float,
+    repeat: int,
+) -> T.Dict[str, float]:
+    with bench.setup(scale) as (n, func):
+        func()  # warm up
+        timings = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        "n": n,
+        "ops_per_sec": n / best,
+        "best": best,
+        "median": statistics.median(timings),
+    }
+
+
+def compare(
+    results: T.Dict[str, dict],
+    baseline: T.Dict[str, dict],
+) -> T.Dict[str, T.Optional[float]]:
+    """
+    Return the relative throughput change of each benchmark vs the baseline,
+    None if the benchmark is not in the baseline.
+    """
+    changes = dict()
+    for name, result in results.items():
+        try:
+            base = baseline[name]["ops_per_sec"]
+        except KeyError:
+            changes[name] = None
+        else:
+            changes[name] = result["ops_per_sec"] / base - 1
+    return changes
+
+
+def main(
+    keywords: T.Optional[T.List[str]] = None,
+    scale: float = 1.0,
+    repeat: int = 5,
+    output: T.Optional[Path] = None,
+    baseline: T.Optional[Path] = None,
+    save_baseline: T.Optional[Path] = None,
+    tolerance: float = 0.2,
+) -> bool:
+    benchmarks = [
+        bench
+        for bench in BENCHMARKS
+        if (not keywords) or any(keyword in bench.name for keyword in keywords)
+    ]
+    baseline_results = dict()
+    if baseline is not None:
+        baseline_results = json.loads(baseline.read_text())["results"]
+
+    ok = True
+    results = dict()
+    print(f"{'benchmark':<36} {'ops/sec':>14} {'baseline':>14} {'change':>8}")
+    for bench in benchmarks:
+        result = run_benchmark(bench, scale=scale, repeat=repeat)
+        results[bench.name] = result
+        change = compare({bench.name: result}, baseline_results)[bench.name]
+        if change is None:
+            base, status = "", ""
+        else:
+            base = f"{baseline_results[bench.name]['ops_per_sec']:,.0f}"
+            status = f"{change:+.0%}"
+            if change < -tolerance:
+                status += "  REGRESSION"
+                ok = False
+        print(f"{bench.name:<36} {result['ops_per_sec']:>14,.0f} {base:>14} {status:>8}")
+
+    data = {
+        "meta": {
+            "version": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": datetime.now(timezone.utc).isoformat(),
+            "scale": scale,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+    for path in [output, save_baseline]:
+        if path is not None:
+            path.write_text(json.dumps(data, indent=4) + "\n")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "-k",
+        dest="keywords",
+        action="append",
+        help="only run the benchmarks whose name contains this keyword",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="multiply the number of operations of each benchmark",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        nargs="?",
+        const=path_baseline,
+        help=f"compare with a baseline JSON, default to {path_baseline.name}",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        type=Path,
+        nargs="?",
+        const=path_baseline,
+        help=f"write the results as the new baseline, default to {path_baseline.name}",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="max acceptable throughput drop vs the baseline, default 0.2 (20%%)",
+    )
+    args = parser.parse_args()
+    sys.exit(
+        0
+        if main(
+            keywords=args.keywords,
+            scale=args.scale,
+            repeat=args.repeat,
+            output=args.output,
+            baseline=args.baseline,
+            save_baseline=args.save_baseline,
+            tolerance=args.tolerance,
+        )
+        else 1
+    )
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import time
+import random
+import asyncio
+import threading
+from pathlib import Path
+
+import pytest
+
+from acore_soap_app.agent.impl import SOAPRequest
+from acore_soap_app.agent.async_client import AsyncSOAPClient
+
+dir_here = Path(__file__).absolute().parent
+success_xml = (dir_here / "success.xml").read_text()
+
+
+class HttpResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeTransport:
+    """
+    Echo the command back in the ``<result>`` element after a random delay,
+    and record the max number of concurrent calls.
+    """
+
+    rate_limiter = None
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def post(self, host, port, username, password, data, timeout=None, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay * random.random())
+            command = data.decode("utf-8").split("<command>")[1].split("</command>")[0]
+            if command == "slow":
+                time.sleep(0.5)
+            return HttpResponse(
+                success_xml.replace("Account created: test", command)
+            )
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def close(self):
+        pass
+
+
+class TestAsyncSOAPClient:
+    def test_send_many(self):
+        transport = FakeTransport()
+        requests = SOAPRequest.batch_load([f"cmd{i}" for i in range(50)])
+
+        async def main():
+            async with AsyncSOAPClient(transport=transport, concurrency=5) as client:
+                response = await client.send(SOAPRequest(command="hello"))
+                assert response.message == "hello"
+                return await client.send_many(requests)
+
+        responses = asyncio.run(main())
+        assert [response.message for response in responses] == [
+            f"cmd{i}" for i in range(50)
+        ]
+        assert 1 < transport.max_in_flight <= 5
+
+    def test_timeout(self):
+        transport = FakeTransport(delay=0)
+        requests = SOAPRequest.batch_load(["cmd1", "slow", "cmd2"])
+
+        async def main():
+            async with AsyncSOAPClient(transport=transport, concurrency=2) as client:
+                results = await client.send_many(
+                    requests, timeout=0.1, return_exceptions=True
+                )
+                assert results[0].message == "cmd1"
+                assert isinstance(results[1], asyncio.TimeoutError)
+                assert results[2].message == "cmd2"
+
+                with pytest.raises(asyncio.TimeoutError):
+                    await client.send_many(requests, timeout=0.1)
+
+        asyncio.run(main())
+
+    def test_bad_concurrency(self):
+        with pytest.raises(ValueError):
+            AsyncSOAPClient(concurrency=0)
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.agent.async_client", preview=False)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import time
+import random
+import socket
+import threading
+from pathlib import Path
+
+import pytest
+
+from acore_soap_app.agent.impl import SOAPRequest
+from acore_soap_app.agent.batch import BatchExecutor
+from acore_soap_app.agent.ratelimit import RateLimiter
+from acore_soap_app.agent.transport import (
+    SOAPTransport,
+    get_default_transport,
+    set_default_transport,
+)
+from acore_soap_app.circuit_breaker import CircuitBreaker
+from acore_soap_app.exc import SOAPCommandFailedError
+
+dir_here = Path(__file__).absolute().parent
+success_xml = (dir_here / "success.xml").read_text()
+fail_xml = (dir_here / "fail2_account_not_exists.xml").read_text()
+
+
+class HttpResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeTransport:
+    """
+    Echo the command back, commands starting with ``fail`` return a fault,
+    ``error`` raises a connection error.
+    """
+
+    rate_limiter = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = list()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def post(self, host, port, username, password, data, timeout=None, **kwargs):
+        command = data.decode("utf-8").split("<command>")[1].split("</command>")[0]
+        with self.lock:
+            self.commands.append(command)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(0.005 * random.random())
+            if command.startswith("error"):
+                raise ConnectionError(command)
+            if command.startswith("fail"):
+                return HttpResponse(fail_xml.replace("Account not exist: TEST", command))
+            return HttpResponse(success_xml.replace("Account created: test", command))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def make_requests(commands):
+    return SOAPRequest.batch_load(commands)
+
+
+class TestBatchExecutor:
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_all_succeeded(self, workers):
+        transport = FakeTransport()
+        executor = BatchExecutor(workers=workers, transport=transport)
+        commands = [f"cmd{i}" for i in range(40)]
+        results = list(executor.run(make_requests(commands)))
+        assert [response.message for _, response in results] == commands
+        assert [request.command for request, _ in results] == commands
+        assert executor.n_sent == 40
+        assert executor.n_skipped == 0
+        assert transport.max_in_flight <= workers
+
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_raises(self, workers):
+        transport = FakeTransport()
+        executor = BatchExecutor(workers=workers, transport=transport)
+        commands = [f"cmd{i}" for i in range(10)] + ["fail"] + [
+            f"cmd{i}" for i in range(10, 100)
+        ]
+        messages = list()
+        with pytest.raises(SOAPCommandFailedError):
+            for _, response in executor.run(make_requests(commands)):
+                messages.append(response.message)
+        assert messages == commands[:10]
+        assert executor.n_skipped > 0
+        assert executor.n_sent + executor.n_skipped == len(commands)
+        assert len(transport.commands) == executor.n_sent
+
+        # the rest of a stream is not read, the skipped count is unknown
+        iterator = iter(make_requests(commands))
+        with pytest.raises(SOAPCommandFailedError) as e:
+            list(executor.run(iterator))
+        assert executor.n_skipped is None
+        assert "the rest of the requests are skipped" in str(e.value)
+        # at most a window of requests after the failed one are read
+        assert len(list(iterator)) >= len(commands) - 11 - workers * 2
+
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_not_raises(self, workers):
+        executor = BatchExecutor(workers=workers, raises=False, transport=FakeTransport())
+        commands = ["cmd1", "fail", "cmd2"]
+        results = list(executor.run(make_requests(commands)))
+        assert [response.succeeded for _, response in results] == [True, False, True]
+        assert executor.n_skipped == 0
+
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_error(self, workers):
+        executor = BatchExecutor(workers=workers, raises=False, transport=FakeTransport())
+        commands = ["cmd1", "error"] + [f"cmd{i}" for i in range(50)]
+        with pytest.raises(ConnectionError):
+            list(executor.run(make_requests(commands)))
+        assert executor.n_skipped > 0
+        assert executor.n_sent + executor.n_skipped == len(commands)
+
+    def test_large_pool(self):
+        # a larger pool keeps the rate limiter and the circuit breaker
+        rate_limiter = RateLimiter(rate=1000)
+        circuit_breaker = CircuitBreaker(failure_threshold=100)
+        default_transport = get_default_transport()
+        set_default_transport(
+            SOAPTransport(
+                rate_limiter=rate_limiter,
+                circuit_breaker=circuit_breaker,
+                connect_timeout=1,
+            )
+        )
+        try:
+            executor = BatchExecutor(workers=16)
+        finally:
+            set_default_transport(default_transport)
+        transport = executor.transport
+        assert transport.pool_maxsize == 16
+        assert transport.rate_limiter is rate_limiter
+        assert transport.circuit_breaker is circuit_breaker
+        assert transport.connect_timeout == 1
+
+        with socket.socket() as sock:  # nothing is listening on the port
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        requests = [
+            SOAPRequest(command=f"cmd{i}", host="127.0.0.1", port=port)
+            for i in range(3)
+        ]
+        with pytest.raises(Exception):
+            list(executor.run(requests))
+        assert rate_limiter.stats()["acquired"] >= 1
+        # the pool created by the executor is closed
+        assert transport._sessions == {}
+
+    def test_bad_workers(self):
+        with pytest.raises(ValueError):
+            BatchExecutor(workers=0)
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.agent.batch", preview=False)
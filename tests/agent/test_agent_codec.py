@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import typing as T
+import json
+import dataclasses
+from pathlib import Path
+
+import pytest
+
+from acore_soap_app.agent.impl import Base, SOAPRequest, SOAPResponse
+from acore_soap_app.agent.codec import get_codec
+
+dir_here = Path(__file__).absolute().parent
+
+
+@dataclasses.dataclass
+class Tag:
+    key: str = dataclasses.field()
+    value: str = dataclasses.field()
+
+
+@dataclasses.dataclass
+class Item(Base):
+    id: int = dataclasses.field()
+    name: T.Optional[str] = dataclasses.field(default=None)
+    price: T.Optional[float] = dataclasses.field(default=None)
+    enabled: bool = dataclasses.field(default=True)
+    tags: T.List[Tag] = dataclasses.field(default_factory=list)
+    meta: T.Dict[str, T.Any] = dataclasses.field(default_factory=dict)
+
+
+def legacy_to_dict(obj) -> dict:
+    return {k: v for k, v in dataclasses.asdict(obj).items() if v is not None}
+
+
+def legacy_to_json(obj) -> str:
+    return json.dumps(legacy_to_dict(obj))
+
+
+objects = [
+    SOAPRequest(command=".server info"),
+    SOAPRequest(command='.announce "你好" \\ <&>', username="u", password="p", host="h", port=1),
+    SOAPResponse.parse((dir_here / "success.xml").read_text()),
+    SOAPResponse.parse((dir_here / "fail1_wrong_command.xml").read_text()),
+    SOAPResponse.parse((dir_here / "success.xml").read_text(), keep_body=False),
+    Item(id=1),
+    Item(id=2, name="sword", price=1.5, enabled=False),
+    Item(id=3, tags=[Tag("a", "b")], meta={"x": [1, 2, {"y": None}], "z": 0.1}),
+]
+
+
+@pytest.mark.parametrize("obj", objects)
+def test_same_as_legacy(obj):
+    assert obj.to_dict() == legacy_to_dict(obj)
+    assert obj.to_json() == legacy_to_json(obj)
+    assert obj.__class__.from_json(obj.to_json()).to_dict() == obj.to_dict()
+
+
+def test_to_dict_copies_nested_value():
+    item = Item(id=1, tags=[Tag("a", "b")])
+    dct = item.to_dict()
+    dct["tags"][0]["key"] = "c"
+    assert item.tags[0].key == "a"
+
+
+def test_from_dict():
+    assert SOAPResponse.from_dict({"message": "hello", "succeeded": True}) == SOAPResponse(
+        body=None, message="hello", succeeded=True
+    )
+    assert Item.from_dict({"id": 1}) == Item(id=1)
+    assert Item.from_dict({"id": 1}).tags is not Item.from_dict({"id": 1}).tags
+    with pytest.raises(TypeError):
+        SOAPRequest.from_dict({"command": "a", "not_a_field": 1})
+    with pytest.raises(TypeError):
+        SOAPRequest.from_dict({"username": "a"})
+
+
+def test_get_codec():
+    codec = get_codec(SOAPRequest)
+    assert get_codec(SOAPRequest) is codec
+    assert "def to_json(self):" in codec.source
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.agent.codec", preview=False)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+import threading
+from pathlib import Path
+
+import pytest
+
+from acore_soap_app.agent.impl import SOAPRequest
+from acore_soap_app.agent.batch import BatchExecutor
+from acore_soap_app.agent.concurrency import AIMDController
+from acore_soap_app.exc import SOAPCommandFailedError
+
+dir_here = Path(__file__).absolute().parent
+success_xml = (dir_here / "success.xml").read_text()
+fail_xml = (dir_here / "fail2_account_not_exists.xml").read_text()
+
+
+class TestAIMDController:
+    def test_decide(self, caplog):
+        controller = AIMDController(
+            floor=2,
+            ceiling=5,
+            target_latency=0.1,
+            max_fault_rate=0.2,
+            window=2,
+        )
+        assert controller.limit == 2
+        with caplog.at_level(logging.INFO, logger="acore_soap_app.agent.concurrency"):
+            for _ in range(10):
+                controller.record(0.01)
+        # additive increase, up to the ceiling
+        assert controller.limit == 5
+        assert [h[1] for h in controller.history] == [3, 4, 5, 5, 5]
+        assert "increase concurrency 2 -> 3" in caplog.text
+
+        # multiplicative decrease on high latency, down to the floor
+        controller.record(0.5)
+        controller.record(0.5)
+        assert controller.limit == 2
+        controller.record(0.5)
+        controller.record(0.5)
+        assert controller.limit == 2
+
+        # multiplicative decrease on high fault rate
+        controller.limit = 4
+        controller.record(0.01, faulted=True)
+        controller.record(0.01)
+        assert controller.limit == 2
+        assert controller.stats() == {
+            "limit": 2,
+            "min_limit": 2,
+            "max_limit": 5,
+            "increases": 5,
+            "decreases": 3,
+        }
+
+    def test_history_size(self):
+        controller = AIMDController(ceiling=100, window=1, history_size=3)
+        for _ in range(10):
+            controller.record(0.01)
+        assert [h[1] for h in controller.history] == [9, 10, 11]
+        assert controller.stats()["increases"] == 10
+
+    def test_validate(self):
+        with pytest.raises(ValueError):
+            AIMDController(floor=0)
+        with pytest.raises(ValueError):
+            AIMDController(floor=4, ceiling=2)
+        with pytest.raises(ValueError):
+            AIMDController(decrease=1)
+        assert AIMDController(floor=1, ceiling=4, initial=10).limit == 4
+
+    def test_gate(self):
+        controller = AIMDController(floor=1, ceiling=2)
+        controller.acquire()
+        acquired = threading.Event()
+
+        def target():
+            controller.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        assert acquired.wait(0.05) is False
+        controller.release()
+        assert acquired.wait(1) is True
+        thread.join()
+
+
+class HttpResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class LoadTransport:
+    """
+    Simulate a worldserver whose latency grows with the number of concurrent
+    requests.
+    """
+
+    rate_limiter = None
+
+    def __init__(self, unit: float = 0.002):
+        self.unit = unit
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def post(self, host, port, username, password, data, timeout=None, **kwargs):
+        command = data.decode("utf-8").split("<command>")[1].split("</command>")[0]
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            latency = self.unit * self.in_flight
+        try:
+            time.sleep(latency)
+            if command.startswith("fail"):
+                return HttpResponse(fail_xml)
+            return HttpResponse(success_xml.replace("Account created: test", command))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class TestAdaptiveBatchExecutor:
+    def test_run(self):
+        transport = LoadTransport()
+        controller = AIMDController(
+            floor=1,
+            ceiling=16,
+            target_latency=transport.unit * 4,
+            window=5,
+        )
+        executor = BatchExecutor(transport=transport, adaptive=controller)
+        assert executor.workers == 16
+        commands = [f"cmd{i}" for i in range(300)]
+        results = list(executor.run(SOAPRequest.batch_load(commands)))
+
+        assert [response.message for _, response in results] == commands
+        assert transport.max_in_flight <= 16
+        assert controller.in_flight == 0
+        assert any(new > old for old, new, _, _ in controller.history)
+        assert any(new < old for old, new, _, _ in controller.history)
+
+    def test_raises(self):
+        transport = LoadTransport()
+        controller = AIMDController(floor=2, ceiling=4)
+        executor = BatchExecutor(transport=transport, raises=True, adaptive=controller)
+        commands = [f"cmd{i}" for i in range(20)] + ["fail"] + [f"cmd{i}" for i in range(100)]
+        with pytest.raises(SOAPCommandFailedError):
+            list(executor.run(SOAPRequest.batch_load(commands)))
+        assert executor.n_sent + executor.n_skipped == len(commands)
+        assert executor.n_skipped > 0
+        assert controller.in_flight == 0
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.agent.concurrency", preview=False)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import stat
+import socket
+
+import pytest
+
+from acore_soap_app.agent.daemon import (
+    AgentDaemon,
+    DaemonClient,
+    DaemonUnavailableError,
+    get_socket_path,
+)
+from acore_soap_app.exc import SOAPCommandFailedError, AgentDaemonError
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="Unix socket is not supported on Windows"
+)
+
+
+def handle_echo(args: dict, out, err):
+    for line in args["lines"]:
+        out(line)
+    err("done")
+
+
+def handle_fail(args: dict, out, err):
+    out("partial")
+    raise SOAPCommandFailedError("request failed")
+
+
+def handle_bug(args: dict, out, err):
+    raise KeyError("oops")
+
+
+def handle_hang(args: dict, out, err):
+    time.sleep(args["seconds"])
+
+
+handlers = {
+    "echo": handle_echo,
+    "fail": handle_fail,
+    "bug": handle_bug,
+    "hang": handle_hang,
+}
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / "acsoap.sock")
+
+
+def test_get_socket_path(monkeypatch):
+    monkeypatch.setenv("ACSOAP_SOCKET", "/tmp/test.sock")
+    assert get_socket_path() == "/tmp/test.sock"
+    assert get_socket_path("/tmp/a.sock") == "/tmp/a.sock"
+
+
+def test_daemon(socket_path):
+    client = DaemonClient(socket_path)
+    assert client.is_alive() is False
+    with pytest.raises(DaemonUnavailableError):
+        client.call("echo", {"lines": []}, out=print, err=print)
+
+    with AgentDaemon(handlers, socket_path=socket_path):
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        assert client.is_alive() is True
+
+        out, err = list(), list()
+        client.call("echo", {"lines": ["a", "b"]}, out=out.append, err=err.append)
+        assert out == ["a", "b"]
+        assert err == ["done"]
+
+        out = list()
+        with pytest.raises(SOAPCommandFailedError, match="request failed"):
+            client.call("fail", {}, out=out.append, err=print)
+        assert out == ["partial"]
+
+        with pytest.raises(AgentDaemonError, match="KeyError"):
+            client.call("bug", {}, out=print, err=print)
+        with pytest.raises(AgentDaemonError, match="KeyError"):
+            client.call("not-exists", {}, out=print, err=print)
+
+        # only one daemon per socket
+        with pytest.raises(AgentDaemonError):
+            AgentDaemon(handlers, socket_path=socket_path).bind()
+
+    assert os.path.exists(socket_path) is False
+
+
+def test_connect_errors(tmp_path, socket_path):
+    # not a socket
+    path = tmp_path / "file"
+    path.write_text("")
+    assert DaemonClient(str(path)).is_alive() is False
+    # any other OSError, e.g. the path is too long
+    assert DaemonClient(str(tmp_path / ("x" * 200))).is_alive() is False
+
+    with AgentDaemon(handlers, socket_path=socket_path):
+        client = DaemonClient(socket_path, read_timeout=0.1)
+        with pytest.raises(AgentDaemonError, match="no response"):
+            client.call("hang", {"seconds": 0.5}, out=print, err=print)
+
+
+def test_heartbeat(socket_path):
+    # a slow request without output doesn't time out while the daemon is alive
+    with AgentDaemon(handlers, socket_path=socket_path, heartbeat_interval=0.05):
+        client = DaemonClient(socket_path, read_timeout=0.2)
+        out, err = list(), list()
+        client.call("hang", {"seconds": 0.6}, out=out.append, err=err.append)
+        assert out == [] and err == []
+        # the connection is still usable after the heartbeats
+        client.call("echo", {"lines": ["a"]}, out=out.append, err=err.append)
+        assert out == ["a"]
+
+
+def test_stale_socket(socket_path):
+    # a socket file left by a dead daemon
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(socket_path)
+    sock.close()
+    assert os.path.exists(socket_path)
+
+    with AgentDaemon(handlers, socket_path=socket_path):
+        out = list()
+        DaemonClient(socket_path).call("echo", {"lines": ["a"]}, out=out.append, err=print)
+        assert out == ["a"]
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.agent.daemon", preview=False)
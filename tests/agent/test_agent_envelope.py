@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import xml.etree.ElementTree as ET
+
+from acore_soap_app.agent.envelope import (
+    path_xml,
+    ENVELOPE_PREFIX,
+    ENVELOPE_SUFFIX,
+    escape_command,
+    encode_request,
+)
+from acore_soap_app.agent.impl import SOAPRequest
+
+
+def test_compile_envelope():
+    assert b"\n" not in ENVELOPE_PREFIX
+    assert b"  " not in ENVELOPE_PREFIX
+    assert ENVELOPE_PREFIX.endswith(b"<command>")
+    assert ENVELOPE_SUFFIX.startswith(b"</command>")
+
+
+def test_escape_command():
+    assert escape_command(".server info") == ".server info"
+    assert escape_command("a&b<c>d") == "a&amp;b&lt;c&gt;d"
+
+
+def test_encode_request():
+    for command in [
+        ".server info",
+        ".account create test p@ss&<word>",
+        ".announce 你好",
+    ]:
+        payload = encode_request(command)
+        assert isinstance(payload, bytes)
+        root = ET.fromstring(payload)
+        assert [elem.text for elem in root.iter("command")] == [command]
+        # semantically the same as the original template
+        expected = ET.fromstring(
+            path_xml.read_text(encoding="utf-8").format(command=escape_command(command))
+        )
+        assert [(e.tag, (e.text or "").strip()) for e in root.iter()] == [
+            (e.tag, (e.text or "").strip()) for e in expected.iter()
+        ]
+
+    assert SOAPRequest(command=".server info").encode() == encode_request(".server info")
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.agent.envelope", preview=False)
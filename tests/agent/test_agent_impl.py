@@ -78,6 +78,34 @@ class TestSOAPRequest(BaseMockTest):
         )
         assert requests1 == requests
 
+        # JSON Lines
+        SOAPRequest.batch_dump_to_s3(
+            s3_client=self.bsm.s3_client,
+            instances=iter(requests),
+            s3uri="s3://mybucket/requests.jsonl",
+        )
+        json_str = get_object(self.bsm.s3_client, s3uri="s3://mybucket/requests.jsonl")
+        assert json_str.count("\n") == 2
+        requests1 = list(
+            SOAPRequest.batch_iter(
+                "s3://mybucket/requests.jsonl",
+                s3_client=self.bsm.s3_client,
+            )
+        )
+        assert requests1 == requests
+
+        # compressed
+        for s3uri in [
+            "s3://mybucket/requests.json.gz",
+            "s3://mybucket/requests.jsonl.gz",
+        ]:
+            SOAPRequest.batch_dump_to_s3(
+                s3_client=self.bsm.s3_client,
+                instances=requests,
+                s3uri=s3uri,
+            )
+            assert SOAPRequest.batch_load(s3uri, s3_client=self.bsm.s3_client) == requests
+
     def _test_batch_load(self):
         SOAPRequest.batch_load("command")
         SOAPRequest.batch_load(["command1", "command2"])
@@ -88,10 +116,34 @@ class TestSOAPRequest(BaseMockTest):
         SOAPRequest.batch_load(SOAPRequest("command"))
         SOAPRequest.batch_load([SOAPRequest("command1"), SOAPRequest("command2")])
 
+    def _test_batch_inline(self):
+        requests = [
+            SOAPRequest(command='.announce "hello"', username="gm"),
+            SOAPRequest(command=".server info"),
+        ]
+        inline = SOAPRequest.batch_dump_to_inline(requests)
+        assert inline.startswith("b64gz:")
+        # safe in a double quoted shell argument
+        assert set(inline[len("b64gz:") :]) <= set(
+            "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_="
+        )
+        assert SOAPRequest.batch_dump_to_inline(requests) == inline
+        requests1 = SOAPRequest.batch_load(inline, username="admin")
+        assert [r.command for r in requests1] == [r.command for r in requests]
+        assert [r.username for r in requests1] == ["gm", "admin"]
+
+        responses = [
+            SOAPResponse(body="<xml/>", message="ok", succeeded=True),
+            SOAPResponse(body=None, message="failed", succeeded=False),
+        ]
+        inline = SOAPResponse.batch_dump_to_inline(responses)
+        assert list(SOAPResponse.batch_iter_from_inline(inline)) == responses
+
     def test(self):
         self._test_endpoint()
         self._test_batch_load_dump()
         self._test_batch_load()
+        self._test_batch_inline()
 
 
 class TestSoapResponse:
@@ -111,6 +163,33 @@ class TestSoapResponse:
         with pytest.raises(SOAPResponseParseError):
             SOAPResponse.parse("<a>hello</a>")
 
+    def test_keep_body(self):
+        res = SOAPResponse.parse(path_success_xml.read_text(), keep_body=False)
+        assert res.body is None
+        assert res.succeeded is True
+        assert "body" not in res.to_dict()
+        assert SOAPResponse.from_json(res.to_json()) == res
+
+
+class TestSlots:
+    def test(self):
+        request = SOAPRequest(command=".server info")
+        response = SOAPResponse.parse(path_success_xml.read_text())
+        for obj in [request, response]:
+            assert not hasattr(obj, "__dict__")
+            with pytest.raises(AttributeError):
+                obj.not_a_field = 1
+        assert SOAPRequest.__slots__ == (
+            "command",
+            "username",
+            "password",
+            "host",
+            "port",
+        )
+        assert dataclasses.is_dataclass(SOAPRequest)
+        assert SOAPRequest(command="a") == SOAPRequest(command="a")
+        assert repr(request).startswith("SOAPRequest(command=")
+
 
 if __name__ == "__main__":
     from acore_soap_app.tests import run_cov_test
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+from pathlib import Path
+
+import pytest
+
+from acore_soap_app.agent.impl import SOAPResponse
+from acore_soap_app.agent.parser import unescape_xml, fast_parse
+
+dir_here = Path(__file__).absolute().parent
+
+ENVELOPE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ns1="urn:AC">'
+    "<SOAP-ENV:Body><ns1:executeCommandResponse>{}</ns1:executeCommandResponse>"
+    "</SOAP-ENV:Body></SOAP-ENV:Envelope>"
+)
+
+
+def test_unescape_xml():
+    assert unescape_xml("a&#xD;\nb") == "a\r\nb"
+    assert unescape_xml("a\r\nb\rc") == "a\nb\nc"
+    assert unescape_xml("&lt;&gt;&amp;&quot;&apos;&#65;&#x42;") == "<>&\"'AB"
+    assert unescape_xml("&amp;lt;") == "&lt;"
+    assert unescape_xml("&nbsp;") is None
+    assert unescape_xml("a & b") is None
+    # not legal XML characters
+    assert unescape_xml("&#0;") is None
+    assert unescape_xml("&#xFFFE;") is None
+    assert unescape_xml("&#x110000;") is None
+    assert unescape_xml("&#x9;&#x1F600;") == "\t\U0001F600"
+
+
+@pytest.mark.parametrize(
+    "body",
+    [path.read_text() for path in sorted(dir_here.glob("*.xml"))]
+    + [
+        ENVELOPE.format("<result>Players: &lt;3&gt; &amp; more&#xD;\n</result>"),
+        ENVELOPE.format("<result>a; b</result>"),
+        ENVELOPE.format("<result></result>"),
+        ENVELOPE.format("<result/>"),
+        ENVELOPE.format("<result>   </result>"),
+        ENVELOPE.format(
+            "<SOAP-ENV:Fault><faultstring></faultstring></SOAP-ENV:Fault>"
+        ),
+        # the <result> wins even if a <faultstring> comes first
+        ENVELOPE.format(
+            "<SOAP-ENV:Fault><faultstring>fault</faultstring></SOAP-ENV:Fault>"
+            "<result>ok</result>"
+        ),
+    ],
+)
+def test_fast_parse_same_as_element_tree(body):
+    assert fast_parse(body) is not None
+    res1 = SOAPResponse.parse(body)
+    res2 = SOAPResponse._parse_element_tree(body)
+    assert res1 == res2
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        "<a>hello</a>",
+        ENVELOPE.format("<result><![CDATA[x < y]]></result>"),
+        ENVELOPE.format('<result xsi:type="xsd:string">hello</result>'),
+        ENVELOPE.format("<result>a &unknown; b</result>"),
+    ],
+)
+def test_fast_parse_fallback(body):
+    assert fast_parse(body) is None
+
+
+def test_invalid_char_reference():
+    # rejected by the XML parser, the fast path must not accept it
+    body = ENVELOPE.format("<result>a&#0;b</result>")
+    assert fast_parse(body) is None
+    with pytest.raises(Exception) as e1:
+        SOAPResponse._parse_element_tree(body)
+    with pytest.raises(Exception) as e2:
+        SOAPResponse.parse(body)
+    assert type(e1.value) is type(e2.value)
+
+
+def test_parse_fallback():
+    body = ENVELOPE.format("<result><![CDATA[x < y]]></result>")
+    res = SOAPResponse.parse(body)
+    assert res.succeeded is True
+    assert res.message == "x < y"
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.agent.parser", preview=False)
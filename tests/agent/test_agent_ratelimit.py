@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from acore_soap_app.agent.impl import SOAPRequest
+from acore_soap_app.agent.ratelimit import TokenBucket, RateLimiter
+from acore_soap_app.agent.transport import SOAPTransport
+from acore_soap_app.agent.async_client import AsyncSOAPClient
+
+dir_here = Path(__file__).absolute().parent
+success_xml = (dir_here / "success.xml").read_text()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+class TestTokenBucket:
+    def test(self):
+        clock = Clock()
+        bucket = TokenBucket(rate=10, burst=2, clock=clock)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == pytest.approx(0.1)
+        assert bucket.reserve() == pytest.approx(0.2)
+        clock.now = 10
+        # the bucket never holds more than burst tokens
+        assert bucket.reserve(2) == 0
+        assert bucket.reserve(1) == pytest.approx(0.1)
+
+
+class TestRateLimiter:
+    def test_weight(self):
+        limiter = RateLimiter(rate=1, weights={".reload": 10, ".reload all": 50})
+        assert limiter.get_weight(".server info") == 1
+        assert limiter.get_weight(None) == 1
+        assert limiter.get_weight(".reload config") == 10
+        assert limiter.get_weight("  .reload all") == 50
+
+    def test_acquire(self):
+        clock = Clock()
+        limiter = RateLimiter(rate=10, burst=1, clock=clock, sleep=clock.sleep)
+        assert limiter.acquire("localhost", 7878, ".server info") == 0
+        assert limiter.acquire("localhost", 7878, ".server info") == pytest.approx(0.1)
+        assert clock.now == pytest.approx(0.1)
+        # each endpoint has its own bucket
+        assert limiter.acquire("localhost", 7879, ".server info") == 0
+        # expensive command costs more tokens
+        assert limiter.acquire("localhost", 7878, ".reload all") == pytest.approx(1.0)
+        stats = limiter.stats()
+        assert stats["acquired"] == 4
+        assert stats["throttled"] == 2
+        assert stats["total_wait"] == pytest.approx(1.1)
+        assert stats["max_wait"] == pytest.approx(1.0)
+        assert stats["mean_wait"] == pytest.approx(1.1 / 4)
+
+        with pytest.raises(ValueError):
+            RateLimiter(rate=0)
+        with pytest.raises(ValueError):
+            RateLimiter(rate=1, burst=0)
+
+    def test_acquire_async(self):
+        limiter = RateLimiter(rate=100, burst=1)
+
+        async def main():
+            return [await limiter.acquire_async("localhost", 7878) for _ in range(3)]
+
+        waits = asyncio.run(main())
+        assert waits[0] == 0
+        assert waits[2] > 0
+
+
+class HttpResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeSession:
+    def post(self, url, data, timeout):
+        return HttpResponse(success_xml)
+
+
+class Transport(SOAPTransport):
+    """
+    Skip the HTTP call, but keep the rate limiting logic of :meth:`post`.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = list()
+
+    def get_session(self, host, port, username, password):
+        return FakeSession()
+
+    def post(self, *args, **kwargs):
+        self.calls.append(kwargs)
+        return super().post(*args, **kwargs)
+
+
+class TestTransportIntegration:
+    def test_send(self):
+        clock = Clock()
+        limiter = RateLimiter(rate=10, burst=1, clock=clock, sleep=clock.sleep)
+        transport = Transport(rate_limiter=limiter)
+        for _ in range(3):
+            SOAPRequest(command=".server info").send(transport=transport)
+        assert limiter.stats()["acquired"] == 3
+        assert clock.now == pytest.approx(0.2)
+
+        SOAPRequest(command=".server info").send(transport=transport, throttle=False)
+        assert limiter.stats()["acquired"] == 3
+
+    def test_async_client(self):
+        limiter = RateLimiter(rate=200, burst=1)
+        transport = Transport(rate_limiter=limiter)
+
+        async def main():
+            async with AsyncSOAPClient(transport=transport, concurrency=4) as client:
+                return await client.send_many(SOAPRequest.batch_load(["a", "b", "c"]))
+
+        responses = asyncio.run(main())
+        assert all(response.succeeded for response in responses)
+        # the tokens are acquired in the event loop, not in the worker threads
+        assert limiter.stats()["acquired"] == 3
+        assert limiter.stats()["throttled"] == 2
+        assert all(call["throttle"] is False for call in transport.calls)
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.agent.ratelimit", preview=False)
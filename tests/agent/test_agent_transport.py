@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from pathlib import Path
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from acore_soap_app.agent.impl import SOAPRequest
+from acore_soap_app.agent.ratelimit import RateLimiter
+from acore_soap_app.agent.transport import (
+    SOAPTransport,
+    get_default_transport,
+    set_default_transport,
+)
+
+dir_here = Path(__file__).absolute().parent
+path_success_xml = dir_here / "success.xml"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    headers_list = list()
+    client_ports = set()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        Handler.headers_list.append(dict(self.headers))
+        Handler.client_ports.add(self.client_address[1])
+        body = path_success_xml.read_bytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestSOAPTransport:
+    server: HTTPServer = None
+
+    @classmethod
+    def setup_class(cls):
+        cls.server = HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_get_session(self):
+        transport = SOAPTransport()
+        s1 = transport.get_session("localhost", 7878, "admin", "admin")
+        s2 = transport.get_session("localhost", 7878, "admin", "admin")
+        s3 = transport.get_session("localhost", 7878, "test", "test")
+        assert s1 is s2
+        assert s1 is not s3
+        assert s1.headers["Authorization"] == "Basic YWRtaW46YWRtaW4="
+        transport.close()
+
+        transport = SOAPTransport(keep_alive=False)
+        session = transport.get_session("localhost", 7878, "admin", "admin")
+        assert session.headers["Connection"] == "close"
+
+    def test_send(self):
+        Handler.headers_list.clear()
+        Handler.client_ports.clear()
+        port = self.server.server_address[1]
+        with SOAPTransport(read_timeout=5) as transport:
+            for _ in range(3):
+                request = SOAPRequest(command=".server info", host="127.0.0.1", port=port)
+                response = request.send(transport=transport)
+                assert response.succeeded is True
+                assert "Account created: test" in response.message
+        assert len(Handler.headers_list) == 3
+        assert Handler.headers_list[0]["Authorization"] == "Basic YWRtaW46YWRtaW4="
+        # all three requests reuse the same keep-alive connection
+        assert len(Handler.client_ports) == 1
+
+    def test_default_transport(self):
+        transport = get_default_transport()
+        assert get_default_transport() is transport
+        new_transport = SOAPTransport(pool_maxsize=1)
+        set_default_transport(new_transport)
+        assert get_default_transport() is new_transport
+        set_default_transport(transport)
+
+    def test_with_rate_limiter(self):
+        transport = SOAPTransport()
+        rate_limiter = RateLimiter(rate=10)
+        throttled = transport.with_rate_limiter(rate_limiter)
+        assert throttled.rate_limiter is rate_limiter
+        assert transport.rate_limiter is None
+        # the connection pool is shared
+        session = throttled.get_session("localhost", 7878, "admin", "admin")
+        assert transport.get_session("localhost", 7878, "admin", "admin") is session
+        transport.close()
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.agent.transport", preview=False)
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import copy
+import json
+from pathlib import Path
+
+import boto3
+import moto
+import pytest
+
+from acore_soap_app import metrics
+from acore_soap_app.agent.impl import SOAPRequest, SOAPResponse
+from acore_soap_app.agent.daemon import AgentDaemon, DaemonClient
+from acore_soap_app.agent.ratelimit import RateLimiter
+from acore_soap_app.cli import impl
+from acore_soap_app.cli.impl import run_gm, write_bounded_stdout
+from acore_soap_app.exc import SOAPCommandFailedError
+
+dir_here = Path(__file__).absolute().parent
+dir_agent = dir_here.parent / "agent"
+success_xml = (dir_agent / "success.xml").read_text()
+fail_xml = (dir_agent / "fail2_account_not_exists.xml").read_text()
+
+
+class HttpResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeTransport:
+    rate_limiter = None
+
+    def __init__(self):
+        self.commands = list()
+        self.closed = False
+
+    def with_rate_limiter(self, rate_limiter):
+        transport = copy.copy(self)
+        transport.rate_limiter = rate_limiter
+        return transport
+
+    def close(self):
+        self.closed = True
+
+    def post(self, host, port, username, password, data, timeout=None, **kwargs):
+        command = data.decode("utf-8").split("<command>")[1].split("</command>")[0]
+        self.commands.append(command)
+        if command.startswith("fail"):
+            return HttpResponse(fail_xml)
+        return HttpResponse(success_xml.replace("Account created: test", command))
+
+
+def get_s3_client():  # pragma: no cover
+    raise AssertionError("S3 should not be used")
+
+
+def test_run_gm():
+    transport = FakeTransport()
+    out, err = list(), list()
+    run_gm(
+        ["cmd1", "cmd2"],
+        transport=transport,
+        get_s3_client=get_s3_client,
+        out=out.append,
+        err=err.append,
+    )
+    assert [json.loads(line)["message"] for line in out] == ["cmd1", "cmd2"]
+    assert err == []
+
+    out, err = list(), list()
+    with pytest.raises(SOAPCommandFailedError):
+        run_gm(
+            ["cmd1", "fail", "cmd2"],
+            transport=transport,
+            get_s3_client=get_s3_client,
+            out=out.append,
+            err=err.append,
+        )
+    assert len(out) == 1
+    assert err == ["1 requests skipped"]
+
+
+def test_run_gm_qps():
+    # the rate limiter is attached to the given transport, not a new one
+    transport = FakeTransport()
+    limiters = list()
+
+    def get_rate_limiter(rate, burst):
+        limiters.append((rate, burst))
+        return RateLimiter(rate=rate, burst=burst)
+
+    out, err = list(), list()
+    run_gm(
+        ["cmd1", "cmd2"],
+        qps=1000,
+        transport=transport,
+        get_rate_limiter=get_rate_limiter,
+        get_s3_client=get_s3_client,
+        out=out.append,
+        err=err.append,
+    )
+    assert transport.commands == ["cmd1", "cmd2"]
+    assert transport.rate_limiter is None
+    assert transport.closed is False
+    assert limiters == [(1000, None)]
+    assert err[0].startswith("rate limit: ")
+
+
+def test_run_gm_latency_stats():
+    transport = FakeTransport()
+    out, err = list(), list()
+    run_gm(
+        ["cmd1", "cmd2"],
+        latency_stats=True,
+        transport=transport,
+        get_s3_client=get_s3_client,
+        out=out.append,
+        err=err.append,
+    )
+    assert len(out) == 2
+    assert err[0].startswith("elapsed: ")
+    assert err[1].split()[0] == "phase"
+    assert [line.split()[:2] for line in err[2:]] == [["build", "2"], ["parse", "2"]]
+
+
+def test_run_gm_metrics_file(tmp_path):
+    path = tmp_path / "acsoap.prom"
+    try:
+        run_gm(
+            ["cmd1", "fail"],
+            raises=False,
+            metrics_file=str(path),
+            transport=FakeTransport(),
+            get_s3_client=get_s3_client,
+            out=list().append,
+            err=list().append,
+        )
+    finally:
+        metrics.disable_metrics()
+    text = path.read_text()
+    endpoint = "localhost:7878"
+    assert f'acsoap_soap_requests_total{{endpoint="{endpoint}"}} 2' in text
+    assert (
+        f'acsoap_soap_responses_total{{endpoint="{endpoint}",outcome="fault"}} 1'
+        in text
+    )
+
+
+def test_run_gm_overflow():
+    transport = FakeTransport()
+    # small outputs are not changed
+    out = list()
+    run_gm(
+        ["cmd1", "cmd2"],
+        overflow="inline",
+        transport=transport,
+        get_s3_client=get_s3_client,
+        out=out.append,
+        err=list().append,
+    )
+    assert [json.loads(line)["message"] for line in out] == ["cmd1", "cmd2"]
+
+    # large outputs are compressed into one line
+    commands = [f"cmd{i}" for i in range(100)]
+    out = list()
+    run_gm(
+        commands,
+        overflow="inline",
+        transport=transport,
+        get_s3_client=get_s3_client,
+        out=out.append,
+        err=list().append,
+    )
+    assert len(out) == 1
+    assert len(out[0]) < 20000
+    responses = list(SOAPResponse.batch_iter_from_inline(out[0]))
+    assert [r.message for r in responses] == commands
+
+    # the responses before a failure in the middle of the batch are still written
+    out, err = list(), list()
+    with pytest.raises(SOAPCommandFailedError):
+        run_gm(
+            commands[:50] + ["fail"] + commands[50:],
+            overflow="inline",
+            transport=transport,
+            get_s3_client=get_s3_client,
+            out=out.append,
+            err=err.append,
+        )
+    assert len(out) == 1
+    responses = list(SOAPResponse.batch_iter_from_inline(out[0]))
+    assert [r.message for r in responses] == commands[:50]
+    assert err == ["50 requests skipped"]
+
+
+def test_write_bounded_stdout():
+    json_strs = [
+        json.dumps({"message": f"line{i}", "succeeded": True}) for i in range(100)
+    ]
+    with pytest.raises(ValueError):
+        write_bounded_stdout(json_strs, overflow="/tmp/output.jsonl")
+
+    # still too large after the compression
+    out = list()
+    write_bounded_stdout(json_strs, overflow="inline", out=out.append, max_size=10)
+    assert len(out) == 1 and out[0].startswith("b64gz:")
+
+    with moto.mock_s3():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket="mybucket")
+        s3uri = "s3://mybucket/output.jsonl.gz"
+        out = list()
+        write_bounded_stdout(
+            json_strs,
+            overflow=s3uri,
+            get_s3_client=lambda: s3_client,
+            out=out.append,
+            max_size=10,
+        )
+        assert out == [s3uri]
+        responses = SOAPResponse.batch_load_from_s3(s3_client, s3uri)
+        assert [r.message for r in responses] == [f"line{i}" for i in range(100)]
+
+
+def test_gm_not_plain(monkeypatch):
+    calls = list()
+    monkeypatch.setattr(impl, "ensure_ec2_environment", lambda: None)
+    monkeypatch.setattr(impl, "run_gm", lambda **kwargs: calls.append(kwargs))
+    # a SOAPRequest can't be sent to the daemon as JSON, run it in-process
+    request = SOAPRequest(command="cmd1")
+    impl.gm(request)
+    impl.gm([request])
+    assert [kwargs["request_like"] for kwargs in calls] == [request, [request]]
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32", reason="Unix socket is not supported on Windows"
+)
+def test_run_gm_via_daemon(tmp_path):
+    transport = FakeTransport()
+
+    def handle_gm(args, out, err):
+        run_gm(**args, get_s3_client=get_s3_client, transport=transport, out=out, err=err)
+
+    socket_path = str(tmp_path / "acsoap.sock")
+    with AgentDaemon({"gm": handle_gm}, socket_path=socket_path):
+        client = DaemonClient(socket_path)
+        for _ in range(2):  # the warm transport is reused across requests
+            out = list()
+            client.call(
+                "gm",
+                {"request_like": ["cmd1", "cmd2"], "keep_body": False},
+                out=out.append,
+                err=print,
+            )
+            assert [json.loads(line) for line in out] == [
+                {"message": "cmd1", "succeeded": True},
+                {"message": "cmd2", "succeeded": True},
+            ]
+
+        err = list()
+        with pytest.raises(SOAPCommandFailedError):
+            client.call("gm", {"request_like": ["fail", "cmd"]}, out=print, err=err.append)
+        assert err == ["1 requests skipped"]
+
+    assert transport.commands == ["cmd1", "cmd2", "cmd1", "cmd2", "fail"]
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.cli.impl", preview=False)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import subprocess
+
+from acore_soap_app.cli.main import Command
+
+HEAVY_MODULES = [
+    "fire",
+    "requests",
+    "boto3",
+    "boto_session_manager",
+    "simple_aws_ec2",
+    "aws_ssm_run_command",
+    "acore_server_metadata",
+    "acore_constants",
+]
+
+
+def get_loaded_modules(code: str) -> list:
+    """
+    Run ``code`` in a fresh interpreter and return the heavy modules it loaded.
+    """
+    code = "\n".join(
+        [
+            "import sys, json",
+            code,
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))",
+        ]
+    )
+    res = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return json.loads(res.stdout)
+
+
+def test_lazy_import():
+    assert get_loaded_modules("import acore_soap_app.cli.main") == []
+    assert get_loaded_modules("import acore_soap_app.cli.impl") == []
+    assert get_loaded_modules("import acore_soap_app.sdk.api") == []
+    assert get_loaded_modules(
+        "import acore_soap_app.cli.impl, acore_soap_app.agent.batch"
+    ) == ["requests"]
+    # the envelope template is not read at import time
+    assert (
+        get_loaded_modules(
+            "import acore_soap_app.agent.envelope as m; assert m._envelope is None"
+        )
+        == []
+    )
+
+
+def test_command():
+    Command().hello()
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.cli.main", preview=False)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from acore_soap_app.agent.impl import SOAPRequest, SOAPResponse
+from acore_soap_app.sdk.cache import ResponseCache, normalize_command
+from acore_soap_app.sdk.core import run_soap_command
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_response(message: str, succeeded: bool = True) -> SOAPResponse:
+    return SOAPResponse(body=None, message=message, succeeded=succeeded)
+
+
+def test_normalize_command():
+    assert normalize_command("  .Server   Info ") == ".server info"
+
+
+class TestResponseCache:
+    def test_make_key(self):
+        cache = ResponseCache()
+        key, ttl = cache.make_key("sbx-blue", [SOAPRequest(".server info")])
+        assert key is not None
+        assert ttl == 10
+
+        # mutating commands are never cached
+        key, ttl = cache.make_key(
+            "sbx-blue",
+            [SOAPRequest(".server info"), SOAPRequest(".account create a b")],
+        )
+        assert key is None and ttl is None
+        assert cache.make_key("sbx-blue", []) == (None, None)
+
+        # the smallest ttl wins
+        key, ttl = cache.make_key(
+            "sbx-blue",
+            [SOAPRequest(".gm list"), SOAPRequest(".server info")],
+        )
+        assert ttl == 10
+
+        # credentials and server_id are part of the key
+        key1, _ = cache.make_key("sbx-blue", [SOAPRequest(".server info", "a", "a")])
+        key2, _ = cache.make_key("sbx-blue", [SOAPRequest(".server info", "b", "b")])
+        key3, _ = cache.make_key("sbx-green", [SOAPRequest(".server info", "a", "a")])
+        # a response without body must not be served to a keep_body=True call
+        key4, _ = cache.make_key(
+            "sbx-blue", [SOAPRequest(".server info", "a", "a")], keep_body=False
+        )
+        assert len({key1, key2, key3, key4}) == 4
+
+    def test_ttl_and_lru(self):
+        clock = Clock()
+        cache = ResponseCache(ttls={".server info": 10}, maxsize=2, clock=clock)
+        key1, ttl = cache.make_key("s1", [SOAPRequest(".server info")])
+        key2, _ = cache.make_key("s2", [SOAPRequest(".server info")])
+        key3, _ = cache.make_key("s3", [SOAPRequest(".server info")])
+        responses = [make_response("ok")]
+
+        assert cache.get(key1) is None
+        cache.put(key1, responses, ttl)
+        assert cache.get(key1) == responses
+        clock.now = 10
+        assert cache.get(key1) is None
+        assert cache.stats() == {"size": 0, "hits": 1, "misses": 2, "evictions": 0}
+
+        cache.put(key1, responses, ttl)
+        cache.put(key2, responses, ttl)
+        cache.get(key1)  # key1 is now the most recently used
+        cache.put(key3, responses, ttl)
+        assert cache.get(key2) is None
+        assert cache.get(key1) == responses
+        assert cache.evictions == 1
+
+        cache.invalidate("s1")
+        assert cache.get(key1) is None
+        assert len(cache) == 1
+        cache.invalidate()
+        assert len(cache) == 0
+
+        with pytest.raises(ValueError):
+            ResponseCache(maxsize=0)
+
+
+class Bsm:
+    s3_client = None
+
+
+def test_run_soap_command_cache_hit():
+    cache = ResponseCache()
+    key, ttl = cache.make_key("sbx-blue", [SOAPRequest(".server info")])
+    responses = [make_response("Connected players: 1")]
+    cache.put(key, responses, ttl)
+    # on cache hit, no AWS API is called
+    assert run_soap_command(Bsm(), "sbx-blue", ".server info", cache=cache) == responses
+    assert cache.hits == 1
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.sdk.cache", preview=False)
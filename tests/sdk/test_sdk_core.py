@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import shlex
+
+import moto
+import pytest
+import aws_ssm_run_command.api as aws_ssm_run_command
+
+from acore_soap_app.agent.impl import SOAPRequest, SOAPResponse
+from acore_soap_app.exc import RunCommandError, SSMOutputTruncatedError
+from acore_soap_app.sdk.core import (
+    build_cli_arg_for_gm,
+    _build_commands,
+    _parse_command_invocation,
+)
+from acore_soap_app.tests.mock_aws import BaseMockTest
+
+
+def test_build_cli_arg_for_gm():
+    assert build_cli_arg_for_gm(".server info", path_cli="acsoap") == (
+        "acsoap gm '.server info' -r=True"
+    )
+    assert build_cli_arg_for_gm(
+        ".server info",
+        username="gm",
+        password="pwd",
+        raises=False,
+        s3uri_output="s3://bucket/output.json",
+        path_cli="acsoap",
+        workers=4,
+        keep_body=False,
+    ) == (
+        "acsoap gm '.server info' -u=gm -p=pwd -r=False "
+        "-s=s3://bucket/output.json -w=4 --keep_body=False"
+    )
+    assert build_cli_arg_for_gm(
+        ".server info", path_cli="acsoap", overflow="inline"
+    ) == ("acsoap gm '.server info' -r=True -o=inline")
+
+    # the shell metacharacters are passed to acsoap as is
+    command = """.send mail gm "Hi" "it's $HOME `id`" """
+    arg = build_cli_arg_for_gm(command, password="p'w d", path_cli="acsoap")
+    assert shlex.split(arg) == ["acsoap", "gm", command, "-p=p'w d", "-r=True"]
+
+
+class TestBuildCommands(BaseMockTest):
+    mock_list = [
+        moto.mock_s3,
+    ]
+
+    @classmethod
+    def setup_class_post_hook(cls):
+        cls.bsm.s3_client.create_bucket(Bucket="mybucket")
+
+    def build(self, requests, **kwargs):
+        params = dict(
+            bsm=self.bsm,
+            requests=SOAPRequest.batch_load(requests, username="gm"),
+            username="gm",
+            password=None,
+            raises=True,
+            s3uri_input=None,
+            s3uri_output=None,
+            path_cli="acsoap",
+            workers=4,
+            keep_body=True,
+        )
+        params.update(kwargs)
+        return _build_commands(**params)
+
+    def test_single(self):
+        assert self.build(".server info") == [
+            "acsoap gm '.server info' -u=gm -r=True"
+        ]
+
+    def test_inline(self):
+        # any number of requests runs in a single acsoap process
+        commands = [f".account create user{i} pwd{i}" for i in range(100)]
+        lines = self.build(commands)
+        assert len(lines) == 1
+        args = shlex.split(lines[0])
+        assert args[:2] == ["acsoap", "gm"]
+        assert "-w=4" in args
+        requests = SOAPRequest.batch_load(args[2])
+        assert [r.command for r in requests] == commands
+        assert {r.username for r in requests} == {"gm"}
+
+    def test_s3(self):
+        commands = [f".account create user{i} pwd{i}" for i in range(100)]
+        with pytest.raises(ValueError):
+            self.build(commands, max_inline_size=100)
+
+        s3uri = "s3://mybucket/input.jsonl"
+        lines = self.build(commands, max_inline_size=100, s3uri_input=s3uri)
+        assert lines == [f"acsoap gm {s3uri} -u=gm -r=True -w=4"]
+        requests = SOAPRequest.batch_load(s3uri, s3_client=self.bsm.s3_client)
+        assert [r.command for r in requests] == commands
+
+        # small batches don't need S3 even if s3uri_input is given
+        lines = self.build(commands[:2], s3uri_input="s3://mybucket/unused.jsonl")
+        assert "b64gz:" in lines[0]
+
+
+def make_invocation(output: str, code: int = 0):
+    return aws_ssm_run_command.better_boto.CommandInvocation(
+        CommandId="c-1",
+        InstanceId="i-1",
+        ResponseCode=code,
+        StandardOutputContent=output,
+    )
+
+
+class TestParseCommandInvocation(BaseMockTest):
+    mock_list = [
+        moto.mock_s3,
+    ]
+
+    @classmethod
+    def setup_class_post_hook(cls):
+        cls.bsm.s3_client.create_bucket(Bucket="mybucket")
+        cls.responses = [
+            SOAPResponse(body=None, message=f"message{i}", succeeded=True)
+            for i in range(3)
+        ]
+
+    def parse(self, output: str, n_requests=3):
+        return _parse_command_invocation(
+            self.bsm, make_invocation(output), None, n_requests=n_requests
+        )
+
+    def test_outputs(self):
+        lines = "\n".join(r.to_json() for r in self.responses) + "\n"
+        assert self.parse(lines) == self.responses
+        inline = SOAPResponse.batch_dump_to_inline(self.responses)
+        assert self.parse(inline + "\n") == self.responses
+
+        s3uri = "s3://mybucket/output.jsonl.gz"
+        SOAPResponse.batch_dump_to_s3(self.bsm.s3_client, self.responses, s3uri)
+        assert self.parse(s3uri + "\n") == self.responses
+
+    def test_truncated(self):
+        with pytest.raises(RunCommandError):
+            _parse_command_invocation(self.bsm, make_invocation("", code=1), None)
+
+        lines = [r.to_json() for r in self.responses]
+        # cut at a line boundary
+        with pytest.raises(SSMOutputTruncatedError):
+            self.parse("\n".join(lines[:2]))
+        # reaches the SSM limit
+        line = SOAPResponse(body="x" * 30000, message="", succeeded=True).to_json()
+        with pytest.raises(SSMOutputTruncatedError):
+            self.parse(line[:24000], n_requests=None)
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.sdk.core", preview=False)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+import time
+import collections
+
+import moto
+import pytest
+import aws_ssm_run_command.api as aws_ssm_run_command
+from botocore.exceptions import ClientError
+from acore_constants.api import TagKey
+from acore_server_metadata.api import ServerNotUniqueError
+
+from acore_soap_app import metrics
+from acore_soap_app.agent.impl import SOAPResponse
+from acore_soap_app.exc import EC2IsNotRunningError, RunCommandError
+from acore_soap_app.sdk import fleet
+from acore_soap_app.sdk.fleet import iter_fleet_soap_command, run_fleet_soap_command
+from acore_soap_app.sdk.polling import PollingStrategy
+from acore_soap_app.sdk.resolver import InstanceResolver
+from acore_soap_app.tests.mock_aws import BaseMockTest
+
+CommandInvocation = aws_ssm_run_command.better_boto.CommandInvocation
+
+
+def make_output(message: str) -> str:
+    return SOAPResponse(body=None, message=message, succeeded=True).to_json() + "\n"
+
+
+class FakeSSM:
+    """
+    Replace the command invocation polling, every instance goes through
+    "not visible yet" -> InProgress -> its final invocation.
+    """
+
+    def __init__(self, final: dict):
+        self.final = final
+        self.calls = collections.Counter()
+
+    def get(self, ssm_client, command_id, instance_id):
+        self.calls[instance_id] += 1
+        n = self.calls[instance_id]
+        if n == 1:
+            raise ClientError(
+                {"Error": {"Code": "InvocationDoesNotExist"}}, "GetCommandInvocation"
+            )
+        final = self.final[instance_id]
+        if n == 2 or final is None:
+            return CommandInvocation(
+                CommandId=command_id, InstanceId=instance_id, Status="InProgress"
+            )
+        if isinstance(final, Exception):
+            raise final
+        return CommandInvocation(CommandId=command_id, InstanceId=instance_id, **final)
+
+
+class TestFleet(BaseMockTest):
+    mock_list = [
+        moto.mock_ec2,
+        moto.mock_rds,
+        moto.mock_ssm,
+        moto.mock_sts,
+    ]
+
+    @classmethod
+    def create_server(cls, server_id: str) -> str:
+        image_id = cls.bsm.ec2_client.describe_images()["Images"][0]["ImageId"]
+        res = cls.bsm.ec2_client.run_instances(
+            ImageId=image_id,
+            MinCount=1,
+            MaxCount=1,
+            TagSpecifications=[
+                dict(
+                    ResourceType="instance",
+                    Tags=[dict(Key=TagKey.SERVER_ID, Value=server_id)],
+                )
+            ],
+        )
+        cls.bsm.rds_client.create_db_instance(
+            DBInstanceIdentifier=server_id,
+            DBInstanceClass="db.t3.micro",
+            Engine="mysql",
+            MasterUsername="admin",
+            MasterUserPassword="password",
+            AllocatedStorage=20,
+            Tags=[dict(Key=TagKey.SERVER_ID, Value=server_id)],
+        )
+        return res["Instances"][0]["InstanceId"]
+
+    @classmethod
+    def setup_class_post_hook(cls):
+        cls.instance_ids = {
+            server_id: cls.create_server(server_id)
+            for server_id in ["sbx-blue", "sbx-green", "sbx-black"]
+        }
+
+    def test_run_fleet_soap_command(self, monkeypatch):
+        ids = self.instance_ids
+        fake_ssm = FakeSSM(
+            {
+                ids["sbx-blue"]: dict(
+                    Status="Success",
+                    ResponseCode=0,
+                    StandardOutputContent=make_output("blue"),
+                ),
+                ids["sbx-green"]: dict(
+                    Status="Failed",
+                    ResponseCode=1,
+                    StandardOutputContent="",
+                    StandardErrorContent="failed",
+                ),
+                ids["sbx-black"]: ClientError(
+                    {"Error": {"Code": "AccessDenied"}}, "GetCommandInvocation"
+                ),
+            }
+        )
+        monkeypatch.setattr(CommandInvocation, "get", fake_ssm.get)
+        send_command = self.bsm.ssm_client.send_command
+        sent_to = list()
+
+        def spy_send_command(**kwargs):
+            sent_to.append(kwargs["InstanceIds"])
+            return send_command(**kwargs)
+
+        monkeypatch.setattr(self.bsm.ssm_client, "send_command", spy_send_command)
+
+        partial = list()
+        results = run_fleet_soap_command(
+            self.bsm,
+            ["sbx-red", "sbx-black", "sbx-green", "sbx-blue", "sbx-blue"],
+            ".server info",
+            on_result=lambda server_id, result: partial.append(server_id),
+            delays=0,
+        )
+        # one send command for all the running servers
+        assert len(sent_to) == 1
+        assert sorted(sent_to[0]) == sorted(ids.values())
+        # in input order
+        assert list(results) == ["sbx-red", "sbx-black", "sbx-green", "sbx-blue"]
+        assert isinstance(results["sbx-red"], EC2IsNotRunningError)
+        assert isinstance(results["sbx-black"], ClientError)
+        assert isinstance(results["sbx-green"], RunCommandError)
+        assert [r.message for r in results["sbx-blue"]] == ["blue"]
+        # the not running server is known before sending the command
+        assert partial[0] == "sbx-red"
+        assert sorted(partial) == sorted(results)
+
+    def test_timeout(self, monkeypatch):
+        ids = self.instance_ids
+        fake_ssm = FakeSSM({ids["sbx-blue"]: None})
+        monkeypatch.setattr(CommandInvocation, "get", fake_ssm.get)
+        results = list(
+            iter_fleet_soap_command(
+                self.bsm, ["sbx-blue"], ".server info", delays=0, timeout=0
+            )
+        )
+        assert len(results) == 1
+        assert results[0][0] == "sbx-blue"
+        assert isinstance(results[0][1], TimeoutError)
+
+        # the poll delay doesn't go past the deadline
+        start = time.monotonic()
+        results = run_fleet_soap_command(
+            self.bsm,
+            ["sbx-blue"],
+            ".server info",
+            timeout=0.1,
+            polling=PollingStrategy(initial_delay=5, max_delay=5),
+        )
+        assert time.monotonic() - start < 2
+        assert isinstance(results["sbx-blue"], TimeoutError)
+
+    def test_bad_server(self, monkeypatch):
+        ids = self.instance_ids
+        fake_ssm = FakeSSM(
+            {
+                ids["sbx-blue"]: dict(
+                    Status="Success",
+                    ResponseCode=0,
+                    StandardOutputContent=make_output("blue"),
+                ),
+                ids["sbx-green"]: dict(
+                    Status="Success",
+                    ResponseCode=0,
+                    StandardOutputContent="not json\n",
+                ),
+            }
+        )
+        monkeypatch.setattr(CommandInvocation, "get", fake_ssm.get)
+        results = run_fleet_soap_command(
+            self.bsm, ["sbx-blue", "sbx-green"], ".server info", delays=0
+        )
+        assert [r.message for r in results["sbx-blue"]] == ["blue"]
+        assert isinstance(results["sbx-green"], ValueError)
+
+        def lookup_instance_ids(bsm, server_ids):
+            raise ServerNotUniqueError("duplicated")
+
+        monkeypatch.setattr(fleet, "lookup_instance_ids", lookup_instance_ids)
+        results = run_fleet_soap_command(
+            self.bsm, ["sbx-blue", "sbx-green"], ".server info", delays=0
+        )
+        assert all(isinstance(r, ServerNotUniqueError) for r in results.values())
+        assert list(results) == ["sbx-blue", "sbx-green"]
+
+    def test_chunks_and_resolver(self, monkeypatch):
+        ids = self.instance_ids
+        monkeypatch.setattr(fleet, "MAX_INSTANCES_PER_COMMAND", 2)
+        fake_ssm = FakeSSM(
+            {
+                instance_id: dict(
+                    Status="Success",
+                    ResponseCode=0,
+                    StandardOutputContent=make_output(server_id),
+                )
+                for server_id, instance_id in ids.items()
+            }
+        )
+        monkeypatch.setattr(CommandInvocation, "get", fake_ssm.get)
+        resolver = InstanceResolver()
+        resolver.put("sbx-black", "i-stale")
+        send_command = self.bsm.ssm_client.send_command
+
+        def invalid_send_command(**kwargs):
+            if "i-stale" in kwargs["InstanceIds"]:
+                raise ClientError(
+                    {"Error": {"Code": "InvalidInstanceId"}}, "SendCommand"
+                )
+            return send_command(**kwargs)
+
+        monkeypatch.setattr(self.bsm.ssm_client, "send_command", invalid_send_command)
+        server_ids = ["sbx-black", "sbx-blue", "sbx-green"]
+
+        metrics.enable_metrics()
+        try:
+            results = run_fleet_soap_command(
+                self.bsm, server_ids, ".server info", delays=0, resolver=resolver
+            )
+            sdk_metrics = metrics.sdk_metrics
+            assert sdk_metrics.commands.get(server_id="sbx-green", outcome="succeeded")
+            assert sdk_metrics.latency.get_count(server_id="sbx-black") == 1
+        finally:
+            metrics.disable_metrics()
+        # only the stale instance fails, not the other one in its chunk
+        assert isinstance(results["sbx-black"], ClientError)
+        assert [r.message for r in results["sbx-blue"]] == ["sbx-blue"]
+        assert [r.message for r in results["sbx-green"]] == ["sbx-green"]
+        assert resolver.get("sbx-black") is None
+        assert resolver.get("sbx-blue") == ids["sbx-blue"]
+
+        # looked up again
+        results = run_fleet_soap_command(
+            self.bsm, server_ids, ".server info", delays=0, resolver=resolver
+        )
+        for server_id in server_ids:
+            assert [r.message for r in results[server_id]] == [server_id]
+
+    def test_invalid_instance(self, monkeypatch):
+        # one terminated instance in a chunk doesn't fail the others
+        ids = self.instance_ids
+        fake_ssm = FakeSSM(
+            {
+                instance_id: dict(
+                    Status="Success",
+                    ResponseCode=0,
+                    StandardOutputContent=make_output(server_id),
+                )
+                for server_id, instance_id in ids.items()
+            }
+        )
+        monkeypatch.setattr(CommandInvocation, "get", fake_ssm.get)
+        send_command = self.bsm.ssm_client.send_command
+        sent_to = list()
+
+        def invalid_send_command(**kwargs):
+            sent_to.append(kwargs["InstanceIds"])
+            if ids["sbx-green"] in kwargs["InstanceIds"]:
+                raise ClientError(
+                    {"Error": {"Code": "InvalidInstanceId"}}, "SendCommand"
+                )
+            return send_command(**kwargs)
+
+        monkeypatch.setattr(self.bsm.ssm_client, "send_command", invalid_send_command)
+        server_ids = ["sbx-black", "sbx-blue", "sbx-green"]
+        results = run_fleet_soap_command(
+            self.bsm, server_ids, ".server info", delays=0
+        )
+        assert isinstance(results["sbx-green"], ClientError)
+        for server_id in ["sbx-black", "sbx-blue"]:
+            assert [r.message for r in results[server_id]] == [server_id]
+        # every healthy instance is sent exactly once
+        sent = [
+            instance_id
+            for instance_ids in sent_to
+            if ids["sbx-green"] not in instance_ids
+            for instance_id in instance_ids
+        ]
+        assert sorted(sent) == sorted([ids["sbx-black"], ids["sbx-blue"]])
+
+    def test_edge_cases(self):
+        assert run_fleet_soap_command(self.bsm, [], ".server info") == {}
+        results = run_fleet_soap_command(self.bsm, ["sbx-red"], ".server info")
+        assert isinstance(results["sbx-red"], EC2IsNotRunningError)
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.sdk.fleet", preview=False)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+
+import pytest
+from botocore.exceptions import ClientError
+
+from acore_soap_app.sdk.polling import (
+    PollingStrategy,
+    wait_command_invocation,
+    is_invocation_not_ready,
+)
+from acore_soap_app.tests.fake_ssm_client import FakeSSMClient
+
+
+def take(iterator, n: int):
+    return [round(delay, 6) for delay in itertools.islice(iterator, n)]
+
+
+def test_is_invocation_not_ready():
+    error = ClientError(
+        {"Error": {"Code": "InvocationDoesNotExist"}}, "GetCommandInvocation"
+    )
+    assert is_invocation_not_ready(error) is True
+    assert (
+        is_invocation_not_ready(ClientError({"Error": {"Code": "Throttling"}}, "Get"))
+        is False
+    )
+    assert is_invocation_not_ready(ValueError()) is False
+
+
+def test_polling_strategy():
+    polling = PollingStrategy(
+        initial_delay=0.2, max_delay=1, multiplier=2, jitter=0.2, rand=lambda: 0
+    )
+    assert take(polling.iter_delays(), 5) == [0.205, 0.4, 0.8, 1, 1]
+    # the expected time of the batch, 100 requests in 25 rounds
+    assert take(polling.iter_delays(100, workers=4), 2) == [0.325, 0.4]
+    # only the backoff is capped
+    assert take(polling.iter_delays(1000), 2) == [5.2, 0.4]
+
+    polling = PollingStrategy(initial_delay=0.2, jitter=0.2, rand=lambda: 0.5)
+    assert take(polling.iter_delays(), 1) == [0.185]
+
+    for kwargs in [
+        dict(initial_delay=-1),
+        dict(max_delay=-1),
+        dict(multiplier=0.5),
+        dict(jitter=1),
+    ]:
+        with pytest.raises(ValueError):
+            PollingStrategy(**kwargs)
+
+
+def wait(ssm_client: FakeSSMClient, polling: PollingStrategy, timeout: float = 10):
+    return wait_command_invocation(
+        ssm_client,
+        "c-1",
+        "i-1",
+        timeout=timeout,
+        polling=polling,
+        sleep=ssm_client.sleep,
+        clock=ssm_client.clock,
+    )
+
+
+def test_wait_command_invocation():
+    polling = PollingStrategy(rand=lambda: 0)
+    # the invocation is not visible on the first poll
+    ssm_client = FakeSSMClient(duration=0.3, visible_after=0.25, output="hello")
+    command_invocation = wait(ssm_client, polling)
+    assert command_invocation.Status == "Success"
+    assert command_invocation.StandardOutputContent == "hello"
+    assert ssm_client.now < 1
+    assert ssm_client.calls == 2
+
+    # the old fixed polling is more than 1 second even for a fast command
+    ssm_client = FakeSSMClient(duration=0.3)
+    fixed = PollingStrategy(initial_delay=1, max_delay=1, jitter=0, per_request=0)
+    wait(ssm_client, fixed)
+    assert ssm_client.now == 1
+
+    ssm_client = FakeSSMClient(duration=60)
+    with pytest.raises(TimeoutError):
+        wait(ssm_client, polling, timeout=5)
+    assert ssm_client.now == pytest.approx(5)
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.sdk.polling", preview=False)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+import moto
+import pytest
+import aws_ssm_run_command.api as aws_ssm_run_command
+from botocore.exceptions import ClientError
+from acore_constants.api import TagKey
+
+from acore_soap_app.exc import EC2IsNotRunningError
+from acore_soap_app.sdk.core import run_soap_command
+from acore_soap_app.sdk.resolver import (
+    InstanceResolver,
+    lookup_instance_id,
+    lookup_instance_ids,
+    is_invalid_instance_error,
+)
+from acore_soap_app.tests.mock_aws import BaseMockTest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_invalid_instance_error() -> ClientError:
+    return ClientError(
+        {"Error": {"Code": "InvalidInstanceId", "Message": "not running"}},
+        "SendCommand",
+    )
+
+
+def test_is_invalid_instance_error():
+    assert is_invalid_instance_error(make_invalid_instance_error()) is True
+    assert (
+        is_invalid_instance_error(
+            ClientError({"Error": {"Code": "Throttling"}}, "SendCommand")
+        )
+        is False
+    )
+    assert is_invalid_instance_error(ValueError()) is False
+
+
+class TestInstanceResolver(BaseMockTest):
+    mock_list = [
+        moto.mock_ec2,
+        moto.mock_rds,
+        moto.mock_ssm,
+        moto.mock_sts,
+    ]
+
+    @classmethod
+    def run_instance(cls, server_id: str) -> str:
+        image_id = cls.bsm.ec2_client.describe_images()["Images"][0]["ImageId"]
+        res = cls.bsm.ec2_client.run_instances(
+            ImageId=image_id,
+            MinCount=1,
+            MaxCount=1,
+            TagSpecifications=[
+                dict(
+                    ResourceType="instance",
+                    Tags=[dict(Key=TagKey.SERVER_ID, Value=server_id)],
+                )
+            ],
+        )
+        return res["Instances"][0]["InstanceId"]
+
+    @classmethod
+    def setup_class_post_hook(cls):
+        # sbx-blue has both EC2 and RDS, sbx-green only has EC2
+        cls.blue_instance_id = cls.run_instance("sbx-blue")
+        cls.green_instance_id = cls.run_instance("sbx-green")
+        cls.bsm.rds_client.create_db_instance(
+            DBInstanceIdentifier="sbx-blue",
+            DBInstanceClass="db.t3.micro",
+            Engine="mysql",
+            MasterUsername="admin",
+            MasterUserPassword="password",
+            AllocatedStorage=20,
+            Tags=[dict(Key=TagKey.SERVER_ID, Value="sbx-blue")],
+        )
+
+    def test_lookup_instance_id(self):
+        assert lookup_instance_id(self.bsm, "sbx-blue") == self.blue_instance_id
+        with pytest.raises(EC2IsNotRunningError):
+            lookup_instance_id(self.bsm, "sbx-green")
+        assert (
+            lookup_instance_id(self.bsm, "sbx-green", ec2_only=True)
+            == self.green_instance_id
+        )
+        with pytest.raises(EC2IsNotRunningError):
+            lookup_instance_id(self.bsm, "sbx-red", ec2_only=True)
+
+    def test_lookup_instance_ids(self):
+        results = lookup_instance_ids(self.bsm, ["sbx-blue", "sbx-green", "sbx-blue"])
+        assert list(results) == ["sbx-blue", "sbx-green"]
+        assert results["sbx-blue"] == self.blue_instance_id
+        assert isinstance(results["sbx-green"], EC2IsNotRunningError)
+
+        results = lookup_instance_ids(
+            self.bsm, ["sbx-blue", "sbx-green", "sbx-red"], ec2_only=True
+        )
+        assert results["sbx-blue"] == self.blue_instance_id
+        assert results["sbx-green"] == self.green_instance_id
+        assert isinstance(results["sbx-red"], EC2IsNotRunningError)
+
+    def test_resolve_many(self):
+        resolver = InstanceResolver()
+        resolver.put("sbx-green", "i-cached")
+        results = resolver.resolve_many(self.bsm, ["sbx-blue", "sbx-green", "sbx-red"])
+        assert results == {
+            "sbx-green": "i-cached",
+            "sbx-blue": self.blue_instance_id,
+            "sbx-red": results["sbx-red"],
+        }
+        assert isinstance(results["sbx-red"], EC2IsNotRunningError)
+        assert resolver.get("sbx-blue") == self.blue_instance_id
+        assert resolver.get("sbx-red") is None
+
+    def test_resolve(self, monkeypatch):
+        clock = Clock()
+        resolver = InstanceResolver(ttl=60, clock=clock)
+        assert resolver.resolve(self.bsm, "sbx-blue") == self.blue_instance_id
+
+        def lookup(*args, **kwargs):  # pragma: no cover
+            raise AssertionError("AWS should not be called")
+
+        monkeypatch.setattr("acore_soap_app.sdk.resolver.lookup_instance_id", lookup)
+        assert resolver.resolve(self.bsm, "sbx-blue") == self.blue_instance_id
+        assert resolver.stats() == {
+            "size": 1,
+            "hits": 1,
+            "misses": 1,
+            "invalidations": 0,
+        }
+        monkeypatch.undo()
+
+        # expired
+        clock.now = 60
+        assert resolver.get("sbx-blue") is None
+        assert resolver.resolve(self.bsm, "sbx-blue") == self.blue_instance_id
+
+        # not running servers are never cached
+        with pytest.raises(EC2IsNotRunningError):
+            resolver.resolve(self.bsm, "sbx-green")
+        assert resolver.get("sbx-green") is None
+
+        resolver.invalidate("sbx-blue")
+        resolver.invalidate("sbx-blue")
+        assert resolver.stats()["invalidations"] == 1
+        resolver.put("sbx-blue", "i-1")
+        resolver.put("sbx-green", "i-2")
+        resolver.invalidate()
+        assert resolver.stats()["size"] == 0
+        assert resolver.stats()["invalidations"] == 3
+
+    def test_ec2_only(self):
+        resolver = InstanceResolver(ec2_only=True)
+        assert resolver.resolve(self.bsm, "sbx-green") == self.green_instance_id
+
+    def test_maxsize(self):
+        clock = Clock()
+        resolver = InstanceResolver(maxsize=2, clock=clock)
+        for i in range(3):
+            clock.now = i
+            resolver.put(f"sbx-{i}", f"i-{i}")
+        assert resolver.stats()["size"] == 2
+        assert resolver.get("sbx-0") is None
+        assert resolver.get("sbx-2") == "i-2"
+
+        with pytest.raises(ValueError):
+            InstanceResolver(ttl=0)
+        with pytest.raises(ValueError):
+            InstanceResolver(maxsize=0)
+
+    def test_run_soap_command(self, monkeypatch):
+        resolver = InstanceResolver()
+        # the cached instance was replaced
+        resolver.put("sbx-blue", "i-stale")
+        run_shell_script_async = aws_ssm_run_command.better_boto.run_shell_script_async
+        sent_to = list()
+
+        def run_shell_script(ssm_client, commands, instance_ids):
+            sent_to.append(instance_ids)
+            if instance_ids == "i-stale":
+                raise make_invalid_instance_error()
+            if instance_ids == "i-throttled":
+                raise ClientError({"Error": {"Code": "Throttling"}}, "SendCommand")
+            return run_shell_script_async(ssm_client, commands, instance_ids)
+
+        monkeypatch.setattr(
+            aws_ssm_run_command.better_boto,
+            "run_shell_script_async",
+            run_shell_script,
+        )
+        command_id = run_soap_command(
+            self.bsm, "sbx-blue", ".server info", sync=False, resolver=resolver
+        )
+        assert isinstance(command_id, str)
+        # looked up again and retried once
+        assert sent_to == ["i-stale", self.blue_instance_id]
+        assert resolver.get("sbx-blue") == self.blue_instance_id
+
+        # other errors are not retried
+        sent_to.clear()
+        resolver.put("sbx-blue", "i-throttled")
+        with pytest.raises(ClientError):
+            run_soap_command(
+                self.bsm, "sbx-blue", ".server info", sync=False, resolver=resolver
+            )
+        assert sent_to == ["i-throttled"]
+        assert resolver.get("sbx-blue") == "i-throttled"
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.sdk.resolver", preview=False)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from acore_soap_app.agent.impl import SOAPResponse
+from acore_soap_app.sdk import core
+from acore_soap_app.sdk.singleflight import SingleFlight, AsyncSingleFlight
+
+
+class TestSingleFlight:
+    def test_coalesce(self):
+        sf = SingleFlight()
+        n_calls = 0
+        started = threading.Event()
+        release = threading.Event()
+
+        def func():
+            nonlocal n_calls
+            n_calls += 1
+            started.set()
+            release.wait()
+            return [1, 2, 3]
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            leader = pool.submit(sf.do, "key", func)
+            started.wait()
+            followers = [pool.submit(sf.do, "key", func) for _ in range(7)]
+            while sf.coalesced < 7:
+                time.sleep(0.001)
+            release.set()
+            results = [leader.result()] + [f.result() for f in followers]
+
+        assert n_calls == 1
+        assert all(result == [1, 2, 3] for result in results)
+        assert sf.stats() == {"calls": 8, "executions": 1, "coalesced": 7, "in_flight": 0}
+
+        # the key is released after the call is done
+        assert sf.do("key", lambda: 1) == 1
+        assert sf.executions == 2
+
+    def test_error(self):
+        sf = SingleFlight()
+        with pytest.raises(ZeroDivisionError):
+            sf.do("key", lambda: 1 / 0)
+        assert sf.stats()["in_flight"] == 0
+
+
+class TestAsyncSingleFlight:
+    def test_coalesce(self):
+        sf = AsyncSingleFlight()
+        n_calls = 0
+
+        async def func():
+            nonlocal n_calls
+            n_calls += 1
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        async def main():
+            return await asyncio.gather(*[sf.do("key", func) for _ in range(5)])
+
+        assert asyncio.run(main()) == ["ok"] * 5
+        assert n_calls == 1
+        assert sf.stats() == {"calls": 5, "executions": 1, "coalesced": 4, "in_flight": 0}
+
+    def test_error(self):
+        sf = AsyncSingleFlight()
+
+        async def func():
+            await asyncio.sleep(0.01)
+            raise ZeroDivisionError
+
+        async def main():
+            return await asyncio.gather(
+                *[sf.do("key", func) for _ in range(3)],
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(main())
+        assert all(isinstance(result, ZeroDivisionError) for result in results)
+        assert sf.coalesced == 2
+
+
+class Bsm:
+    s3_client = None
+
+
+def test_run_soap_command(monkeypatch):
+    n_calls = 0
+    release = threading.Event()
+
+    def _run_soap_command(**kwargs):
+        nonlocal n_calls
+        n_calls += 1
+        release.wait()
+        return [SOAPResponse(body=None, message="ok", succeeded=True)]
+
+    monkeypatch.setattr(core, "_run_soap_command", _run_soap_command)
+    sf = SingleFlight()
+
+    def run(command: str):
+        return core.run_soap_command(Bsm(), "sbx-blue", command, singleflight=sf)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(run, ".server info") for _ in range(3)]
+        while sf.calls < 3:
+            time.sleep(0.001)
+        # mutating commands are never coalesced
+        futures.append(pool.submit(run, ".account create a b"))
+        while n_calls < 2:
+            time.sleep(0.001)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert n_calls == 2
+    assert sf.coalesced == 2
+    assert all(result[0].message == "ok" for result in results)
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.sdk.singleflight", preview=False)
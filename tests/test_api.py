@@ -11,8 +11,16 @@ def test():
     _ = api.DEFAULT_PORT
     _ = api.SOAPRequest
     _ = api.SOAPResponse
+    _ = api.SOAPTransport
     _ = api.run_soap_command
+    _ = api.run_fleet_soap_command
+    _ = api.iter_fleet_soap_command
     _ = api.canned
+    _ = api.ResponseCache
+    _ = api.InstanceResolver
+    _ = api.PollingStrategy
+    _ = api.SingleFlight
+    _ = api.AsyncSingleFlight
     _ = api.canned.extract_online_players
     _ = api.canned.get_online_players
     _ = api.canned.is_server_online
@@ -23,8 +31,21 @@ def test():
     _ = api.canned.gm_list
     _ = api.EC2IsNotRunningError
     _ = api.RunCommandError
+    _ = api.SSMOutputTruncatedError
     _ = api.SOAPResponseParseError
     _ = api.SOAPCommandFailedError
+    _ = api.CircuitOpenError
+    _ = api.CircuitState
+    _ = api.CircuitBreaker
+    _ = api.Phase
+    _ = api.Collector
+    _ = api.HistogramCollector
+    _ = api.collect
+    _ = api.MetricsRegistry
+    _ = api.MetricsServer
+    _ = api.write_textfile
+    _ = api.enable_metrics
+    _ = api.disable_metrics
 
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import socket
+
+import pytest
+import requests
+
+from acore_soap_app.agent.impl import SOAPRequest
+from acore_soap_app.agent.transport import SOAPTransport
+from acore_soap_app.circuit_breaker import CircuitState, CircuitBreaker
+from acore_soap_app.exc import CircuitOpenError, EC2IsNotRunningError, RunCommandError
+from acore_soap_app.sdk import core
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def fail():
+    raise ConnectionError
+
+
+class TestCircuitBreaker:
+    def test_transitions(self):
+        clock = Clock()
+        events = list()
+        breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=10, clock=clock)
+        breaker.add_listener(lambda key, old, new: events.append((key, old, new)))
+
+        assert breaker.call("a", lambda: 1) == 1
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                breaker.call("a", fail)
+        assert breaker.get_state("a") is CircuitState.OPEN
+        assert breaker.get_state("b") is CircuitState.CLOSED
+
+        # fail fast
+        with pytest.raises(CircuitOpenError) as e:
+            breaker.call("a", lambda: 1)
+        assert e.value.key == "a"
+        assert e.value.retry_after == pytest.approx(10)
+        # other keys are not affected
+        assert breaker.call("b", lambda: 1) == 1
+
+        # half open, the failed probe opens the circuit again
+        clock.now = 10
+        assert breaker.get_state("a") is CircuitState.HALF_OPEN
+        with pytest.raises(ConnectionError):
+            breaker.call("a", fail)
+        assert breaker.get_state("a") is CircuitState.OPEN
+
+        # half open, the successful probe closes the circuit
+        clock.now = 20
+        assert breaker.call("a", lambda: 2) == 2
+        assert breaker.get_state("a") is CircuitState.CLOSED
+
+        assert [(old.value, new.value) for _, old, new in events] == [
+            ("closed", "open"),
+            ("open", "half_open"),
+            ("half_open", "open"),
+            ("open", "half_open"),
+            ("half_open", "closed"),
+        ]
+        assert breaker.stats() == {
+            "rejected": 1,
+            "opened": 2,
+            "half_opened": 2,
+            "closed": 1,
+            "not_closed": {},
+        }
+
+    def test_half_open_max_calls(self):
+        clock = Clock()
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=1, clock=clock)
+        breaker.before_call("a")
+        breaker.on_failure("a")
+        clock.now = 1
+        breaker.before_call("a")  # the probe
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call("a")
+        assert breaker.stats()["not_closed"] == {"a": "half_open"}
+        breaker.on_success("a")
+        breaker.before_call("a")
+
+    def test_is_failure(self):
+        breaker = CircuitBreaker(
+            failure_threshold=1,
+            is_failure=lambda e: isinstance(e, ConnectionError),
+        )
+        # application errors don't open the circuit
+        with pytest.raises(ValueError):
+            breaker.call("a", lambda: int("x"))
+        assert breaker.get_state("a") is CircuitState.CLOSED
+        with pytest.raises(ConnectionError):
+            breaker.call("a", fail)
+        assert breaker.get_state("a") is CircuitState.OPEN
+
+        breaker.reset("a")
+        assert breaker.get_state("a") is CircuitState.CLOSED
+        breaker.on_success("not-exists")
+        breaker.on_failure("not-exists")
+        breaker.reset()
+
+        with pytest.raises(ValueError):
+            CircuitBreaker(failure_threshold=0)
+        with pytest.raises(ValueError):
+            CircuitBreaker(half_open_max_calls=0)
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_transport():
+    port = get_free_port()  # nothing is listening on it
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60)
+    transport = SOAPTransport(circuit_breaker=breaker)
+    request = SOAPRequest(command=".server info", host="127.0.0.1", port=port)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            request.send(transport=transport)
+    with pytest.raises(CircuitOpenError):
+        request.send(transport=transport)
+    assert breaker.get_state(f"127.0.0.1:{port}") is CircuitState.OPEN
+    transport.close()
+
+    # the is_failure of the breaker overrides the default of the transport
+    breaker = CircuitBreaker(failure_threshold=1, is_failure=lambda e: False)
+    transport = SOAPTransport(circuit_breaker=breaker)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            request.send(transport=transport)
+    assert breaker.get_state(f"127.0.0.1:{port}") is CircuitState.CLOSED
+    transport.close()
+
+
+class Bsm:
+    s3_client = None
+
+
+def test_run_soap_command(monkeypatch):
+    errors = [EC2IsNotRunningError, RunCommandError, TimeoutError, TimeoutError]
+
+    def _run_soap_command(**kwargs):
+        raise errors.pop(0)
+
+    monkeypatch.setattr(core, "_run_soap_command", _run_soap_command)
+    breaker = CircuitBreaker(failure_threshold=2)
+
+    with pytest.raises(EC2IsNotRunningError):
+        core.run_soap_command(Bsm(), "sbx-blue", ".server info", circuit_breaker=breaker)
+    # the command failed on a healthy server, this resets the failure count
+    with pytest.raises(RunCommandError):
+        core.run_soap_command(Bsm(), "sbx-blue", ".server info", circuit_breaker=breaker)
+    with pytest.raises(TimeoutError):
+        core.run_soap_command(Bsm(), "sbx-blue", ".server info", circuit_breaker=breaker)
+    assert breaker.get_state("sbx-blue") is CircuitState.CLOSED
+    with pytest.raises(TimeoutError):
+        core.run_soap_command(Bsm(), "sbx-blue", ".server info", circuit_breaker=breaker)
+    assert breaker.get_state("sbx-blue") is CircuitState.OPEN
+    # fail fast without calling AWS
+    with pytest.raises(CircuitOpenError):
+        core.run_soap_command(Bsm(), "sbx-blue", ".server info", circuit_breaker=breaker)
+    assert errors == []
+
+    # the is_failure of the breaker overrides is_server_failure
+    errors = [RunCommandError]
+    breaker = CircuitBreaker(failure_threshold=1, is_failure=lambda e: True)
+    with pytest.raises(RunCommandError):
+        core.run_soap_command(Bsm(), "sbx-blue", ".server info", circuit_breaker=breaker)
+    assert breaker.get_state("sbx-blue") is CircuitState.OPEN
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.circuit_breaker", preview=False)
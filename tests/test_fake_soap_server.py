@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+import requests
+
+from acore_soap_app.agent.transport import SOAPTransport
+from acore_soap_app.sdk.canned.impl import extract_online_players
+from acore_soap_app.tests.fake_soap_server import Reply, FakeSOAPServer
+
+
+def test_replies():
+    with FakeSOAPServer() as server, SOAPTransport() as transport:
+        response = server.make_request(".server info").send(transport=transport)
+        assert response.succeeded is True
+        assert extract_online_players(response.message) == (0, 0)
+
+        response = server.make_request(".account create test pwd").send(transport=transport)
+        assert response.succeeded is True
+        assert response.message == "Account created: test"
+
+        response = server.make_request(".account delete test").send(transport=transport)
+        assert response.succeeded is False
+        assert response.message == "Account not exist: TEST"
+
+        response = server.make_request(".account").send(transport=transport)
+        assert response.succeeded is False
+        assert response.message.startswith("### USAGE: .account ...")
+
+        response = server.make_request(".not a command").send(transport=transport)
+        assert response.succeeded is False
+        assert response.message == "There is no such command."
+
+        # like the real server, the lines end with "\r\n" once parsed
+        for reply in [Reply("a & b <c>\nline 2"), Reply("x\ny", succeeded=False)]:
+            xml = reply.to_xml()
+            expected = reply.message.replace("\n", "\r\n")
+            assert response.parse(xml).message == expected
+            assert response._parse_element_tree(xml).message == expected
+
+        response = server.make_request(".server info", password="wrong").send(
+            transport=transport
+        )
+        assert response.succeeded is False
+        assert response.message == "HTTP Error: 401 Unauthorized"
+
+        assert server.commands == [
+            ".server info",
+            ".account create test pwd",
+            ".account delete test",
+            ".account",
+            ".not a command",
+        ]
+        assert server.stats() == {
+            "requests": 5,
+            "max_in_flight": 1,
+            "succeeded": 2,
+            "failed": 3,
+            "errors": 0,
+            "dropped": 0,
+            "unauthorized": 1,
+            "bad_request": 0,
+        }
+
+
+def test_custom_replies():
+    replies = {
+        ".echo": lambda command: Reply(command[len(".echo ") :]),
+        ".ok": Reply("ok"),
+    }
+    with FakeSOAPServer(replies=replies, default_reply=Reply("default")) as server:
+        assert server.make_request(".echo <hello> & bye").send().message == "<hello> & bye"
+        assert server.make_request(".ok").send().message == "ok"
+        assert server.make_request(".server info").send().message == "default"
+
+
+def test_errors_and_drops():
+    with FakeSOAPServer(error_rate=1.0) as server:
+        response = server.make_request(".server info").send(transport=SOAPTransport())
+        assert response.succeeded is False
+        assert response.message == "Internal server error"
+
+    with FakeSOAPServer(drop_rate=1.0) as server:
+        with pytest.raises(requests.ConnectionError):
+            server.make_request(".server info").send(transport=SOAPTransport())
+        assert server.stats()["dropped"] == 1
+
+
+@pytest.mark.parametrize("max_concurrency,expected", [(1, 1), (None, 4)])
+def test_max_concurrency(max_concurrency, expected):
+    barrier = threading.Barrier(4)
+
+    with FakeSOAPServer(latency=0.05, max_concurrency=max_concurrency) as server:
+        transport = SOAPTransport(pool_maxsize=4)
+
+        def send():
+            barrier.wait()
+            assert server.make_request(".gm list").send(transport=transport).succeeded
+
+        threads = [threading.Thread(target=send) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert server.stats()["max_in_flight"] == expected
+        assert server.stats()["succeeded"] == 4
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.tests.fake_soap_server", preview=False)
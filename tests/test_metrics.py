@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+from xml.etree import ElementTree
+
+import pytest
+import requests
+
+from acore_soap_app import metrics
+from acore_soap_app.metrics import (
+    CONTENT_TYPE,
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsRegistry,
+    MetricsServer,
+    write_textfile,
+    enable_metrics,
+    disable_metrics,
+)
+from acore_soap_app.agent.impl import SOAPRequest, SOAPResponse
+from acore_soap_app.agent.transport import SOAPTransport
+from acore_soap_app.exc import SOAPResponseParseError
+from acore_soap_app.timing import Phase, timer
+from acore_soap_app.sdk import core
+from acore_soap_app.tests.fake_soap_server import FakeSOAPServer
+
+
+@pytest.fixture
+def registry():
+    registry = enable_metrics()
+    yield registry
+    disable_metrics()
+
+
+def test_counter_and_gauge():
+    counter = Counter("c_total", "A counter.", ["a"])
+    counter.inc(a="x")
+    counter.inc(2, a="x")
+    counter.inc(a='y"\n\\')
+    assert counter.get(a="x") == 3
+    assert counter.get(a="z") == 0
+    with pytest.raises(ValueError):
+        counter.inc(-1, a="x")
+    with pytest.raises(ValueError):
+        counter.inc(b="x")
+    assert counter.render() == (
+        "# HELP c_total A counter.\n"
+        "# TYPE c_total counter\n"
+        'c_total{a="x"} 3\n'
+        'c_total{a="y\\"\\n\\\\"} 1\n'
+    )
+
+    gauge = Gauge("g", "A gauge.")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert gauge.get() == 1
+    gauge.set(0.5)
+    assert gauge.render().splitlines()[-1] == "g 0.5"
+
+
+def test_histogram():
+    histogram = Histogram("h_seconds", "A histogram.", ["a"], buckets=[0.1, 1])
+    for value in [0.05, 0.1, 0.5, 3]:
+        histogram.observe(value, a="x")
+    assert histogram.get_count(a="x") == 4
+    assert histogram.get_count(a="y") == 0
+    assert histogram.render().splitlines()[2:] == [
+        'h_seconds_bucket{a="x",le="0.1"} 2',
+        'h_seconds_bucket{a="x",le="1"} 3',
+        'h_seconds_bucket{a="x",le="+Inf"} 4',
+        'h_seconds_sum{a="x"} 3.65',
+        'h_seconds_count{a="x"} 4',
+    ]
+
+
+def test_registry_and_textfile(tmp_path):
+    registry = MetricsRegistry()
+    counter = registry.register(Counter("c_total", "A counter."))
+    with pytest.raises(ValueError):
+        registry.register(Counter("c_total", "A counter."))
+    assert registry.get("c_total") is counter
+    counter.inc()
+
+    path = tmp_path / "acsoap.prom"
+    write_textfile(registry, str(path))
+    assert path.read_text() == registry.render()
+    assert oct(os.stat(path).st_mode & 0o777) == oct(0o644)
+    assert os.listdir(tmp_path) == ["acsoap.prom"]
+
+
+def test_metrics_server():
+    registry = MetricsRegistry()
+    registry.register(Counter("c_total", "A counter.")).inc()
+    with MetricsServer(registry, port=0) as server:
+        res = requests.get(f"http://127.0.0.1:{server.port}/metrics")
+        assert res.status_code == 200
+        assert res.headers["Content-Type"] == CONTENT_TYPE
+        assert res.text == registry.render()
+        res = requests.get(f"http://127.0.0.1:{server.port}/other")
+        assert res.status_code == 404
+
+
+def test_enable_metrics(registry):
+    assert enable_metrics() is registry
+    assert metrics.get_registry() is registry
+    with timer(Phase.HTTP):
+        pass
+    histogram = registry.get("acsoap_phase_duration_seconds")
+    assert histogram.get_count(phase="http") == 1
+
+    disable_metrics()
+    assert metrics.get_registry() is None
+    assert metrics.agent_metrics is None
+    with timer(Phase.HTTP):
+        pass
+    assert histogram.get_count(phase="http") == 1
+
+
+def test_agent_metrics(registry):
+    agent_metrics = metrics.agent_metrics
+    transport = SOAPTransport()
+    with FakeSOAPServer() as server:
+        endpoint = f"127.0.0.1:{server.port}"
+        server.make_request(".server info").send(transport=transport)
+        server.make_request(".not a command").send(transport=transport)
+        assert agent_metrics.requests.get(endpoint=endpoint) == 2
+        assert agent_metrics.responses.get(endpoint=endpoint, outcome="succeeded") == 1
+        assert agent_metrics.responses.get(endpoint=endpoint, outcome="fault") == 1
+        assert agent_metrics.latency.get_count(endpoint=endpoint) == 2
+        assert agent_metrics.in_flight.get(endpoint=endpoint) == 0
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]  # nothing is listening on it
+    request = SOAPRequest(command=".server info", host="127.0.0.1", port=port)
+    with pytest.raises(requests.ConnectionError):
+        request.send(transport=transport)
+    assert agent_metrics.errors.get(endpoint=f"127.0.0.1:{port}") == 1
+    assert agent_metrics.in_flight.get(endpoint=f"127.0.0.1:{port}") == 0
+    transport.close()
+
+    with pytest.raises(ElementTree.ParseError):
+        SOAPResponse.parse("not xml")
+    with pytest.raises(SOAPResponseParseError):
+        SOAPResponse.parse("<Envelope></Envelope>")
+    assert agent_metrics.parse_errors.get() == 2
+    assert f'acsoap_soap_requests_total{{endpoint="{endpoint}"}} 2' in registry.render()
+
+
+class Bsm:
+    s3_client = None
+
+
+def test_sdk_metrics(registry, monkeypatch):
+    results = [
+        [SOAPResponse(body="", message="ok", succeeded=True)],
+        [SOAPResponse(body="", message="failed", succeeded=False)],
+        "command-id",
+        TimeoutError,
+    ]
+
+    def _run_soap_command(**kwargs):
+        result = results.pop(0)
+        if result is TimeoutError:
+            raise result
+        return result
+
+    monkeypatch.setattr(core, "_run_soap_command", _run_soap_command)
+    for _ in range(3):
+        core.run_soap_command(Bsm(), "sbx-blue", ".server info")
+    with pytest.raises(TimeoutError):
+        core.run_soap_command(Bsm(), "sbx-blue", ".server info")
+
+    sdk_metrics = metrics.sdk_metrics
+    for outcome in ["succeeded", "failed", "submitted", "error"]:
+        assert sdk_metrics.commands.get(server_id="sbx-blue", outcome=outcome) == 1
+    assert sdk_metrics.latency.get_count(server_id="sbx-blue") == 4
+    assert sdk_metrics.in_flight.get(server_id="sbx-blue") == 0
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.metrics", preview=False)
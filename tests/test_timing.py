@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+
+import pytest
+
+from acore_soap_app import timing
+from acore_soap_app.timing import (
+    Phase,
+    Histogram,
+    HistogramCollector,
+    collect,
+    timer,
+)
+from acore_soap_app.agent.transport import SOAPTransport
+from acore_soap_app.tests.fake_soap_server import FakeSOAPServer
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.percentile(50) == 0.0
+    for value in [5, 1, 4, 2, 3, 10, 6, 8, 7, 9]:
+        histogram.add(value)
+    assert histogram.count == 10
+    assert histogram.percentile(0) == 1
+    assert histogram.percentile(50) == 5
+    assert histogram.percentile(95) == 10
+    assert histogram.percentile(100) == 10
+    histogram.add(0)
+    assert histogram.percentile(0) == 0
+    assert histogram.summary()["total"] == 55
+    assert histogram.summary()["mean"] == 5
+
+
+def test_histogram_max_samples():
+    histogram = Histogram(max_samples=100, rand=random.Random(0).random)
+    for value in range(10000):
+        histogram.add(value)
+    # the memory is bounded, the count, total and max are still exact
+    assert len(histogram.samples) == 100
+    assert histogram.count == 10000
+    assert histogram.total == sum(range(10000))
+    assert histogram.percentile(100) == 9999
+    assert histogram.summary()["max"] == 9999
+    # the percentiles are estimated from a uniform sample
+    assert 4000 < histogram.percentile(50) < 6000
+    assert histogram.percentile(99) > 9000
+
+    with pytest.raises(ValueError):
+        Histogram(max_samples=0)
+
+
+def test_collect():
+    assert isinstance(timer(Phase.HTTP), timing._NullTimer)
+    with collect() as collector:
+        assert isinstance(timer(Phase.HTTP), timing._Timer)
+        with collect() as other:
+            with timer(Phase.PARSE):
+                pass
+        with timer(Phase.HTTP):
+            pass
+        with pytest.raises(ValueError):
+            with timer(Phase.HTTP):
+                raise ValueError
+        timing.record("custom", 0.5)
+    assert timing._collectors == tuple()
+
+    assert list(collector.summary()) == ["http", "parse", "custom"]
+    assert collector.summary()["http"]["count"] == 2
+    assert collector.summary()["custom"]["p99"] == 0.5
+    assert list(other.summary()) == ["parse"]
+    lines = collector.format_summary().splitlines()
+    assert lines[0].split() == [
+        "phase", "count", "total(s)", "mean", "p50", "p95", "p99", "max"
+    ]
+    assert lines[3].split()[:3] == ["custom", "1", "0.500"]
+
+
+def test_thread_safety():
+    collector = HistogramCollector()
+
+    def run():
+        for _ in range(1000):
+            collector.record(Phase.HTTP, 0.001)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert collector.summary()["http"]["count"] == 4000
+
+
+def test_send():
+    with FakeSOAPServer() as server, SOAPTransport() as transport:
+        with collect() as collector:
+            for _ in range(3):
+                server.make_request(".server info").send(transport=transport)
+    summary = collector.summary()
+    assert list(summary) == ["build", "http", "parse"]
+    assert all(s["count"] == 3 for s in summary.values())
+    assert summary["http"]["p50"] > summary["build"]["p50"]
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.timing", preview=False)
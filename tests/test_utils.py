@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+
+import moto
+import pytest
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+from acore_soap_app.utils import (
+    MIN_PART_SIZE,
+    GZIP,
+    ZSTD,
+    split_s3uri,
+    get_compression,
+    is_json_lines,
+    compress,
+    decompress,
+    get_object,
+    put_object,
+    iter_json_objects,
+    S3ObjectWriter,
+    write_json_objects,
+)
+from acore_soap_app.timing import collect
+from acore_soap_app.tests.mock_aws import BaseMockTest
+
+
+def test_split_s3uri():
+    assert split_s3uri("s3://mybucket/a/b.json") == ("mybucket", "a/b.json")
+
+
+def test_get_compression():
+    assert get_compression("s3://mybucket/a.json") is None
+    assert get_compression("s3://mybucket/a.json.gz") == GZIP
+    assert get_compression("s3://mybucket/a.jsonl.zst") == ZSTD
+    assert is_json_lines("s3://mybucket/a.jsonl.gz") is True
+    assert is_json_lines("s3://mybucket/a.json.gz") is False
+
+
+def test_compress():
+    data = b"<result>hello</result>" * 100
+    assert decompress(compress(data, None), None) == data
+    assert decompress(compress(data, GZIP), GZIP) == data
+    assert len(compress(data, GZIP)) < len(data)
+    with pytest.raises(ValueError):
+        compress(data, "bz2")
+
+
+@pytest.mark.parametrize(
+    "compression",
+    [
+        GZIP,
+        pytest.param(
+            ZSTD,
+            marks=pytest.mark.skipif(
+                zstandard is None, reason="zstandard is not installed"
+            ),
+        ),
+    ],
+)
+def test_decompress_multiple_frames(compression):
+    data = compress(b"a\n", compression) + compress(b"b\n", compression)
+    assert decompress(data, compression) == b"a\nb\n"
+    assert decompress(compress(b"", compression), compression) == b""
+
+
+class TestS3(BaseMockTest):
+    mock_list = [
+        moto.mock_s3,
+    ]
+
+    @classmethod
+    def setup_class_pre_hook(cls):
+        # newer botocore sends upload_part with aws-chunked checksum by default,
+        # which is not understood by moto 4
+        os.environ.setdefault("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+
+    @classmethod
+    def setup_class_post_hook(cls):
+        cls.bsm.s3_client.create_bucket(Bucket="mybucket")
+
+    def _read(self, body: str, s3uri: str = "s3://mybucket/data.json") -> list:
+        put_object(self.bsm.s3_client, s3uri, body)
+        return list(iter_json_objects(self.bsm.s3_client, s3uri))
+
+    def _test_iter_json_objects(self):
+        records = [{"a": 1}, {"b": 2}, {"c": 3}]
+        jsonl = "\n".join(json.dumps(record) for record in records) + "\n\n"
+
+        # JSON Lines, detected by extension or by content
+        assert self._read(jsonl, "s3://mybucket/data.jsonl") == records
+        assert self._read(jsonl, "s3://mybucket/data.ndjson") == records
+        assert self._read(jsonl) == records
+        # JSON array, in one line or in multiple lines
+        assert self._read(json.dumps(records)) == records
+        assert self._read(json.dumps(records, indent=4)) == records
+        # a single JSON object in multiple lines
+        assert self._read(json.dumps(records[0], indent=4)) == records[:1]
+        # empty file
+        assert self._read("") == []
+
+    def _test_write_json_objects(self):
+        json_strs = ['{"a": 1}', '{"b": 2}']
+        write_json_objects(self.bsm.s3_client, "s3://mybucket/out.json", iter(json_strs))
+        assert json.loads(get_object(self.bsm.s3_client, "s3://mybucket/out.json")) == [
+            {"a": 1},
+            {"b": 2},
+        ]
+        write_json_objects(self.bsm.s3_client, "s3://mybucket/out.jsonl", iter(json_strs))
+        assert (
+            get_object(self.bsm.s3_client, "s3://mybucket/out.jsonl")
+            == '{"a": 1}\n{"b": 2}\n'
+        )
+        write_json_objects(self.bsm.s3_client, "s3://mybucket/empty.json", [])
+        assert get_object(self.bsm.s3_client, "s3://mybucket/empty.json") == "[]"
+
+    def _test_multipart(self):
+        line = json.dumps({"message": "x" * 1000})
+        n = MIN_PART_SIZE // len(line) + 100
+        write_json_objects(
+            self.bsm.s3_client,
+            "s3://mybucket/big.jsonl",
+            (line for _ in range(n)),
+            part_size=MIN_PART_SIZE,
+        )
+        records = list(iter_json_objects(self.bsm.s3_client, "s3://mybucket/big.jsonl"))
+        assert len(records) == n
+
+        with pytest.raises(ValueError):
+            S3ObjectWriter(self.bsm.s3_client, "s3://mybucket/x", part_size=1024)
+
+    def _test_abort(self):
+        s3uri = "s3://mybucket/aborted.jsonl"
+        with pytest.raises(ZeroDivisionError):
+            with S3ObjectWriter(self.bsm.s3_client, s3uri, part_size=MIN_PART_SIZE) as writer:
+                writer.write(b"x" * MIN_PART_SIZE)
+                assert writer._upload_id is not None
+                1 / 0
+        res = self.bsm.s3_client.list_objects_v2(Bucket="mybucket", Prefix="aborted")
+        assert res.get("KeyCount", 0) == 0
+        res = self.bsm.s3_client.list_multipart_uploads(Bucket="mybucket")
+        assert not res.get("Uploads")
+
+    def _test_compression(self, ext: str):
+        s3_client = self.bsm.s3_client
+        records = [{"message": f"<result>{i}</result>"} for i in range(1000)]
+        json_strs = [json.dumps(record) for record in records]
+
+        # compressed by key suffix
+        for s3uri in [
+            f"s3://mybucket/out.json{ext}",
+            f"s3://mybucket/out.jsonl{ext}",
+        ]:
+            write_json_objects(s3_client, s3uri, iter(json_strs))
+            bucket, key = split_s3uri(s3uri)
+            res = s3_client.get_object(Bucket=bucket, Key=key)
+            assert res["ContentEncoding"] == get_compression(s3uri)
+            raw = res["Body"].read()
+            assert len(raw) < sum(len(json_str) for json_str in json_strs) // 5
+            assert list(iter_json_objects(s3_client, s3uri)) == records
+
+        # big enough to use multipart upload
+        line = json.dumps({"message": "x" * 1000})
+        n = MIN_PART_SIZE // len(line) * 2
+        s3uri = f"s3://mybucket/big.jsonl{ext}"
+        write_json_objects(
+            s3_client,
+            s3uri,
+            (line for _ in range(n)),
+            part_size=MIN_PART_SIZE,
+        )
+        assert sum(1 for _ in iter_json_objects(s3_client, s3uri)) == n
+
+        # compressed by ContentEncoding only
+        body = "\n".join(json_strs)
+        s3_client.put_object(
+            Bucket="mybucket",
+            Key="no-suffix.jsonl",
+            Body=compress(body.encode("utf-8"), get_compression(ext)),
+            ContentEncoding=get_compression(ext),
+        )
+        s3uri = "s3://mybucket/no-suffix.jsonl"
+        assert get_object(s3_client, s3uri) == body
+        assert list(iter_json_objects(s3_client, s3uri)) == records
+
+        # multiple members, e.g. two files concatenated by cat
+        s3uri = f"s3://mybucket/concatenated.jsonl{ext}"
+        s3_client.put_object(
+            Bucket="mybucket",
+            Key=f"concatenated.jsonl{ext}",
+            Body=b"".join(
+                compress((json_str + "\n").encode("utf-8"), get_compression(ext))
+                for json_str in json_strs
+            ),
+        )
+        assert list(iter_json_objects(s3_client, s3uri)) == records
+
+        # put_object
+        s3uri = f"s3://mybucket/single.json{ext}"
+        put_object(s3_client, s3uri, json.dumps(records))
+        assert json.loads(get_object(s3_client, s3uri)) == records
+
+    def _test_timing(self):
+        line = json.dumps({"message": "x" * 1000})
+        n = MIN_PART_SIZE // len(line) + 100
+        with collect() as collector:
+            write_json_objects(
+                self.bsm.s3_client,
+                "s3://mybucket/timed.jsonl",
+                (line for _ in range(n)),
+                part_size=MIN_PART_SIZE,
+            )
+            get_object(self.bsm.s3_client, "s3://mybucket/timed.jsonl")
+        summary = collector.summary()
+        # two parts + complete
+        assert summary["s3_upload"]["count"] == 3
+        assert summary["s3_download"]["count"] == 1
+
+    def test(self):
+        self._test_iter_json_objects()
+        self._test_write_json_objects()
+        self._test_multipart()
+        self._test_abort()
+        self._test_compression(".gz")
+        self._test_timing()
+
+    @pytest.mark.skipif(zstandard is None, reason="zstandard is not installed")
+    def test_zstd(self):
+        self._test_compression(".zst")
+
+
+if __name__ == "__main__":
+    from acore_soap_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_soap_app.utils", preview=False)